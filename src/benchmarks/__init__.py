@@ -0,0 +1,15 @@
+#!/usr/bin/python3
+"""Benchmarks for the pyupspack library.
+
+Each module in this package is a standalone benchmark. Run them from the src
+directory, e.g.::
+
+    $ cd src
+    $ python3 -m benchmarks.contention
+
+benchmarks.suite runs them all (against a pyupspack.simulator, so no UPSPack is
+needed) and writes the results as JSON, for comparing one release with another::
+
+    $ python3 -m benchmarks.suite --output results.json
+
+"""
@@ -0,0 +1,66 @@
+#!/usr/bin/python3
+"""How well do reads of SmartUPS scale when lots of threads poll it at once?
+
+Each of N threads reads charging, discharging, batterylevel, Vout and timeleft
+in a tight loop for a fixed period. The total number of property reads per
+second is printed for each N. Because SmartUPSInterface publishes its state
+copy-on-write, readers never take a lock; the total should hold roughly steady
+as N grows (CPython's GIL stops it from rising), rather than collapsing as it
+did when every read went through a ReadWriteLock.
+
+Example:
+    Run me on a machine with an UPSPack attached::
+
+        $ cd src
+        $ python3 -m benchmarks.contention --duration 2 --threads 1 2 4 8 16 32
+
+"""
+import argparse
+import time
+from threading import Event, Thread
+
+
+def _poll(ups, ready, stop, counts, index):
+    n = 0
+    ready.wait()
+    while not stop.is_set():
+        ups.charging
+        ups.discharging
+        ups.batterylevel
+        ups.Vout
+        ups.timeleft
+        n += 5
+    counts[index] = n
+
+
+def measure(ups, noof_threads, duration):
+    """Return the number of property reads per second achieved by noof_threads threads."""
+    ready = Event()
+    stop = Event()
+    counts = [0] * noof_threads
+    threads = [Thread(target=_poll, args=(ups, ready, stop, counts, i)) for i in range(noof_threads)]
+    for t in threads:
+        t.start()
+    started = time.perf_counter()
+    ready.set()
+    time.sleep(duration)
+    stop.set()
+    for t in threads:
+        t.join()
+    return sum(counts) / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--duration', type=float, default=2., help='seconds per measurement')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    args = parser.parse_args()
+    from pyupspack import SmartUPS
+    print('%8s %16s %16s' % ('threads', 'reads/sec', 'per thread'))
+    for noof_threads in args.threads:
+        rate = measure(SmartUPS, noof_threads, args.duration)
+        print('%8d %16.0f %16.0f' % (noof_threads, rate, rate / noof_threads))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/python3
+"""How long do the library's hot paths take?
+
+Four measurements are made:
+
+* property access: nanoseconds per read of each of SmartUPS's attributes;
+* timeleft_and_verboseinfo(): nanoseconds per call, both for the most recent
+  frame and for a fake (dictionaryized) frame, which runs the estimator;
+* SelfCachingCall.result: reads per second, in total, by N concurrent threads,
+  both deep-copying the result for every reader (the default) and handing out
+  one frozen result by reference (immutable=True);
+* ReadWriteLock: read and write acquisitions per second by N reader threads and
+  one writer thread, for each policy.
+
+The SmartUPSInterface is attached to a pyupspack.simulator, so no UPSPack is needed.
+
+Example:
+    $ cd src
+    $ python3 -m benchmarks.hotpaths --threads 1 4 16
+
+"""
+import argparse
+import time
+from threading import Event, Thread
+
+from pyupspack import SmartUPSInterface
+from pyupspack.classes import ReadWriteLock, SelfCachingCall
+from pyupspack.simulator import UPSPackSimulator, steady
+
+PROPERTIES = ('charging', 'discharging', 'batterylevel', 'Vout', 'timeleft', 'verbose', 'hardwareversion', 'stale')
+
+
+def _ns_per_call(func, noof_calls):
+    started = time.perf_counter()
+    for _ in range(noof_calls):
+        func()
+    return (time.perf_counter() - started) * 1e9 / noof_calls
+
+
+def measure_properties(ups, noof_reads):
+    """Return a dictionary of nanoseconds per read, for each property of ups."""
+    return {name: _ns_per_call(lambda: getattr(ups, name), noof_reads) for name in PROPERTIES}
+
+
+def measure_timeleft(ups, noof_calls):
+    """Return nanoseconds per call of timeleft_and_verboseinfo(), with and without a fake frame."""
+    fake_dct = {'SmartUPS': 'V3.2P', 'Vin': 'NG', 'BATCAP': '57', 'Vout': '5123'}
+    return {
+        'most_recent_frame': _ns_per_call(ups.timeleft_and_verboseinfo, noof_calls),
+        'fake_dct': _ns_per_call(lambda: ups.timeleft_and_verboseinfo(fake_dct), noof_calls),
+    }
+
+
+def _hammer(func, ready, stop, counts, index):
+    n = 0
+    ready.wait()
+    while not stop.is_set():
+        func()
+        n += 1
+    counts[index] = n
+
+
+def _run_threads(funcs, duration):
+    """Call each func in its own thread, over and over, for duration seconds. Return the calls per second of each."""
+    ready = Event()
+    stop = Event()
+    counts = [0] * len(funcs)
+    threads = [Thread(target=_hammer, args=(func, ready, stop, counts, i)) for i, func in enumerate(funcs)]
+    for t in threads:
+        t.start()
+    started = time.perf_counter()
+    ready.set()
+    time.sleep(duration)
+    stop.set()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    return [count / elapsed for count in counts]
+
+
+def measure_selfcachingcall(noof_threads, duration, immutable=False):
+    """Return the total reads per second of SelfCachingCall.result by noof_threads threads."""
+    cached_call = SelfCachingCall(1, lambda: {'Vin': 'GOOD', 'BATCAP': 87, 'Vout': 5.123}, immutable=immutable)
+    while True:
+        try:
+            cached_call.result
+            break
+        except Exception:
+            time.sleep(.01)
+    try:
+        return sum(_run_threads([lambda: cached_call.result] * noof_threads, duration))
+    finally:
+        cached_call.join()
+
+
+def measure_rwlock(noof_threads, duration, policy):
+    """Return the read and write acquisitions per second by noof_threads readers and one writer."""
+    lck = ReadWriteLock(policy=policy)
+
+    def read():
+        lck.acquire_read()
+        lck.release_read()
+
+    def write():
+        lck.acquire_write()
+        lck.release_write()
+        time.sleep(.001)  # SerialFrameReader and SelfCachingCall write now and then, not constantly.
+    rates = _run_threads([read] * noof_threads + [write], duration)
+    return {'reads_per_sec': sum(rates[:-1]), 'writes_per_sec': rates[-1]}
+
+
+def measure(noof_calls, threads, duration):
+    """Return a dictionary of every measurement described above."""
+    with UPSPackSimulator(steady(3600, 87), speed=10) as sim:
+        ups = SmartUPSInterface(sim.device)
+        try:
+            results = {
+                'property_ns': measure_properties(ups, noof_calls),
+                'timeleft_and_verboseinfo_ns': measure_timeleft(ups, noof_calls),
+            }
+        finally:
+            ups.cached_smartups.join()
+    results['selfcachingcall_reads_per_sec'] = {str(n): measure_selfcachingcall(n, duration) for n in threads}
+    results['selfcachingcall_immutable_reads_per_sec'] = {str(n): measure_selfcachingcall(n, duration, immutable=True)
+                                                          for n in threads}
+    results['rwlock'] = {policy: {str(n): measure_rwlock(n, duration, policy) for n in threads}
+                         for policy in ReadWriteLock.POLICIES}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--calls', type=int, default=100000, help='calls per single-threaded measurement')
+    parser.add_argument('--duration', type=float, default=1., help='seconds per multi-threaded measurement')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4, 16])
+    args = parser.parse_args()
+    results = measure(args.calls, args.threads, args.duration)
+    for name, ns in results['property_ns'].items():
+        print('SmartUPS.%-22s %10.0f ns' % (name, ns))
+    for name, ns in results['timeleft_and_verboseinfo_ns'].items():
+        print('timeleft_and_verboseinfo (%s) %10.0f ns' % (name, ns))
+    for n, rate in results['selfcachingcall_reads_per_sec'].items():
+        print('SelfCachingCall.result, %3s threads %12.0f reads/sec' % (n, rate))
+    for n, rate in results['selfcachingcall_immutable_reads_per_sec'].items():
+        print('SelfCachingCall.result (immutable), %3s threads %12.0f reads/sec' % (n, rate))
+    for policy, by_threads in results['rwlock'].items():
+        for n, rates in by_threads.items():
+            print('ReadWriteLock(%r), %3s readers %12.0f reads/sec %8.0f writes/sec' % (
+                policy, n, rates['reads_per_sec'], rates['writes_per_sec']))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+#!/usr/bin/python3
+"""How long does 'import pyupspack' take?
+
+Each run imports pyupspack in a fresh interpreter and reports how long the
+import took (not counting interpreter startup). It also checks that the import
+left the hardware alone, i.e. that the SmartUPS instance hasn't been created.
+No UPSPack is needed.
+
+Example:
+    $ cd src
+    $ python3 -m benchmarks.import_time --runs 20
+
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+_CHILD = '''
+import time
+t = time.perf_counter()
+import pyupspack
+elapsed = time.perf_counter() - t
+print(elapsed, 'SmartUPS' in vars(pyupspack))
+'''
+
+
+def measure(runs):
+    """Return a list of import durations (in seconds), one per fresh interpreter."""
+    src_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    durations = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', _CHILD], cwd=src_dir, check=True,
+                             stdout=subprocess.PIPE, universal_newlines=True).stdout.split()
+        if out[1] != 'False':
+            raise AssertionError("Importing pyupspack created the SmartUPS instance")
+        durations.append(float(out[0]))
+    return durations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+    durations = measure(args.runs)
+    print('import pyupspack: median %.2f ms, min %.2f ms, max %.2f ms over %d runs' % (
+        statistics.median(durations) * 1000, min(durations) * 1000, max(durations) * 1000, len(durations)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+"""How soon after the UPSPack reports a power cut does SmartUPS.discharging say so?
+
+A pyupspack.simulator is attached to a SmartUPSInterface. Each trial writes one
+frame that flips Vin (GOOD to NG, or back) and times how long it takes until:
+
+* a frame listener is called, on the reader's thread; and
+* a thread polling SmartUPS.discharging (every poll_interval seconds) sees it flip.
+
+No UPSPack is needed.
+
+Example:
+    $ cd src
+    $ python3 -m benchmarks.latency --trials 200
+
+"""
+import argparse
+import statistics
+import time
+
+from pyupspack import SmartUPSInterface
+from pyupspack.simulator import UPSPackSimulator, frame
+
+
+def _summary(latencies):
+    latencies = sorted(latencies)
+    return {
+        'trials': len(latencies),
+        'median_ms': statistics.median(latencies) * 1000,
+        'p99_ms': latencies[min(len(latencies) - 1, int(len(latencies) * .99))] * 1000,
+        'max_ms': latencies[-1] * 1000,
+    }
+
+
+def measure(noof_trials, poll_interval=.0001, timeout=2.):
+    """Return summaries of the listener and polling latencies, in milliseconds."""
+    listener_latencies = []
+    polling_latencies = []
+    heard = []
+    with UPSPackSimulator([]) as sim:
+        sim.send(frame(87, 'GOOD'))
+        ups = SmartUPSInterface(sim.device)
+        ups.add_frame_listener(lambda snapshot: heard.append(time.monotonic()))
+        try:
+            for trial in range(noof_trials):
+                discharging = trial % 2 == 0
+                del heard[:]
+                written = sim.send(frame(87, 'NG' if discharging else 'GOOD'))
+                give_up = written + timeout
+                while ups.discharging != discharging:
+                    if time.monotonic() > give_up:
+                        raise TimeoutError("SmartUPS.discharging didn't flip within %s seconds" % timeout)
+                    time.sleep(poll_interval)
+                polling_latencies.append(time.monotonic() - written)
+                if heard:
+                    listener_latencies.append(heard[0] - written)
+                time.sleep(.01)
+        finally:
+            ups.cached_smartups.join()
+    return {'listener': _summary(listener_latencies), 'polling': _summary(polling_latencies)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--trials', type=int, default=200)
+    parser.add_argument('--poll-interval', type=float, default=.0001, help='seconds between polls of discharging')
+    args = parser.parse_args()
+    for name, summary in measure(args.trials, args.poll_interval).items():
+        print('%-9s median %.3f ms, p99 %.3f ms, max %.3f ms over %d trials' % (
+            name, summary['median_ms'], summary['p99_ms'], summary['max_ms'], summary['trials']))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+"""How many frames per second can pyupspack.parser parse?
+
+Three measurements are made over the same synthetic capture: the old
+split()-and-find() dictionaryizer that SmartUPSInterface used to use, one
+parse_frame() call per frame, and a single parse_many() call over the whole
+buffer. No UPSPack is needed.
+
+Example:
+    $ cd src
+    $ python3 -m benchmarks.parser --frames 200000
+
+"""
+import argparse
+import time
+
+from pyupspack.parser import parse_frame, parse_many
+
+
+def make_capture(noof_frames):
+    """Return (list of frames, buffer of the same frames) resembling a long capture of the serial port."""
+    frames = []
+    for i in range(noof_frames):
+        frames.append('$ SmartUPS V3.2P,Vin %s,BATCAP %d,Vout %d $' % ('GOOD' if i % 1000 < 700 else 'NG', 100 - i % 100, 4000 + i % 1300))
+    return frames, ('\n'.join(frames) + '\n').encode()
+
+
+def _legacy_dictionaryize(txt):
+    """What _read_smartups_output() used to do to each frame (and the properties did afterwards)."""
+    incoming_info_lst = txt.strip('\n').strip(' ').strip('$').strip(' ').split(',')
+    dct = {}
+    for item in incoming_info_lst:
+        p = item.find(' ')
+        if p < 0:
+            dct[p] = ''
+        else:
+            dct[item[:p]] = item[p + 1:]
+    int(dct['BATCAP'])
+    float(dct['Vout']) / 1000.
+    return dct
+
+
+def _rate(noof_frames, func, *args):
+    started = time.perf_counter()
+    func(*args)
+    return noof_frames / (time.perf_counter() - started)
+
+
+def measure(noof_frames):
+    """Return a dictionary of frames per second for each approach."""
+    frames, buffer = make_capture(noof_frames)
+    return {
+        'legacy_split': _rate(noof_frames, lambda: [_legacy_dictionaryize(f) for f in frames]),
+        'parse_frame': _rate(noof_frames, lambda: [parse_frame(f) for f in frames]),
+        'parse_many': _rate(noof_frames, parse_many, buffer),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--frames', type=int, default=200000)
+    args = parser.parse_args()
+    for name, rate in measure(args.frames).items():
+        print('%-14s %12.0f frames/sec' % (name, rate))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/python3
+"""Run every benchmark and write the results as JSON, for comparing releases.
+
+The results are keyed by benchmark name, alongside a description of the machine,
+the Python version and the git revision, so that two result files can be compared
+(e.g. with jq or a few lines of Python) before a release is rolled out. Everything
+runs against a pyupspack.simulator; no UPSPack is needed.
+
+Example:
+    $ cd src
+    $ python3 -m benchmarks.suite --output results-$(git describe --always).json
+    $ python3 -m benchmarks.suite --quick
+
+"""
+import argparse
+from contextlib import redirect_stdout
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+
+from benchmarks import contention, hotpaths, import_time, latency, parser as parser_benchmark
+from pyupspack import SmartUPSInterface
+from pyupspack.simulator import UPSPackSimulator, steady
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _measure_contention(threads, duration):
+    with UPSPackSimulator(steady(3600, 87), speed=10) as sim:
+        ups = SmartUPSInterface(sim.device)
+        try:
+            return {str(n): contention.measure(ups, n, duration) for n in threads}
+        finally:
+            ups.cached_smartups.join()
+
+
+def run(quick=False):
+    """Run every benchmark; return the results (and a description of where they were run) as a dictionary."""
+    threads = [1, 4] if quick else [1, 2, 4, 8, 16, 32]
+    duration = .2 if quick else 1.
+    return {
+        'meta': {
+            'when': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'git_revision': _git_revision(),
+            'python': sys.version,
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'quick': quick,
+        },
+        'parser_frames_per_sec': parser_benchmark.measure(20000 if quick else 200000),
+        'import_seconds': import_time.measure(3 if quick else 20),
+        'hotpaths': hotpaths.measure(10000 if quick else 100000, threads, duration),
+        'contention_reads_per_sec': _measure_contention(threads, duration),
+        'latency': latency.measure(20 if quick else 200),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--output', metavar='FILE', help='write the JSON here (default: stdout)')
+    parser.add_argument('--quick', action='store_true', help='fewer, shorter runs, e.g. for CI')
+    args = parser.parse_args()
+    with redirect_stdout(sys.stderr):  # The library chats on stdout; keep the JSON clean.
+        results = json.dumps(run(args.quick), indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(results + '\n')
+    else:
+        print(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,13 +6,24 @@ This program monitors the output of the RPi UPSPack circuit board. When the
 battery begins discharging or begins charging, the users are warned via console
 walls and by calls to xmessage. If discharging continues, warnings continue to
 occur with greater frequency, until a shutdown occurs (if the battery level dips
-too low).
+too low). Before shutting down, I give the pre-shutdown hooks as long as the
+battery can spare (see pyupspack.orchestrator). I react to each frame as it
+arrives (see pyupspack.policy), so a power cut is noticed within a second or so.
 
 Example:
     Here is how to run me::
 
         $ python3 monitor.py
 
+    or, to watch a particular serial device (e.g. a pyupspack.simulator)::
+
+        $ python3 monitor.py --device /dev/pts/5
+
+Other processes can read the UPSPack's state from me, via pyupspack.client,
+without fighting me for the serial port. I serve it on SOCKET_FILE (or --socket).
+Processes that read it very often should map SHM_FILE with
+pyupspack.shm.SharedSnapshotReader instead; that costs no system calls at all.
+
 I do not terminate unless you tell me to terminate. I'm tough like that.
 
 Attributes:
@@ -26,8 +37,31 @@ Todo:
    http://google.github.io/styleguide/pyguide.html
 
 """
-import os
-from pyupspack.utilities import send_global_message
+import argparse
+from pyupspack.notifications import default_dispatcher
+from pyupspack.orchestrator import ShutdownOrchestrator
+from pyupspack.policy import BATTERY_CRITICAL, BATTERY_LOW, EVENTS, POWER_LOST, POWER_RESTORED, REMINDER, PolicyEngine, notify, run_hook
+from pyupspack.server import SmartUPSServer
+from pyupspack.shm import SharedSnapshotWriter
+from pyupspack.telemetry import TelemetryLogWriter, TelemetryRingRecorder
+
+LOG_FILE = "/var/log/rpiupspackcomms"
+LOG_FLUSH_INTERVAL = 60  # seconds
+LOG_MAX_BYTES = 1 << 20
+LOG_BACKUP_COUNT = 3
+RING_FILE = "/var/log/rpiupspackcomms.ring"
+RING_CAPACITY = 28 * 24 * 3600  # four weeks of frames, one per second
+PROFILE_FILE = "/var/lib/rpiupspackcomms.profile"
+SOCKET_FILE = "/run/rpiupspackcomms.sock"
+SHM_FILE = "/dev/shm/rpiupspackcomms"
+LOG_INTERVAL = 5  # seconds
+STARTUP_TIMEOUT = 50  # seconds
+LOW_LEVEL = 20  # percent
+SHUTDOWN_LEVEL = 10  # percent
+HYSTERESIS = 2  # percent
+NOTIFICATION_TIMEOUT = 5  # seconds to spend telling the users that we're shutting down
+PRE_SHUTDOWN_DIR = "/etc/rpiupspackcomms/pre-shutdown.d"
+SAFETY_MARGIN = 30  # seconds between the poweroff command and the battery's expected end
 
 # try:
 #     import serial
@@ -36,18 +70,18 @@ from pyupspack.utilities import send_global_message
 
 
 def generate_our_logging_string():
-    if SmartUPS.Vout is None:
+    snapshot = SmartUPS.snapshot_or_None()
+    if snapshot is None or snapshot.Vout is None:
         return "Waiting for UPS to connect"
     else:
-        return "Vout=%1.4f; charging?%s; discharging?%s; batterylevel=%d%%; timeleft=%s; verbose=%s" % (SmartUPS.Vout, 'Yes' if SmartUPS.charging else 'No',
-                    'Yes' if SmartUPS.discharging else 'No', SmartUPS.batterylevel, ('?' if SmartUPS.timeleft is None else (str(SmartUPS.timeleft // 60) + 'm')), SmartUPS.verbose)
+        return "Vout=%1.4f; charging?%s; discharging?%s; batterylevel=%d%%; timeleft=%s; verbose=%s" % (snapshot.Vout, 'Yes' if snapshot.charging else 'No',
+                    'Yes' if snapshot.discharging else 'No', snapshot.batterylevel, ('?' if snapshot.timeleft is None else (str(snapshot.timeleft // 60) + 'm')), snapshot.verbose)
 
 
-def generate_echo_and_log_our_logging_string():
+def generate_echo_and_log_our_logging_string(log_writer, urgent=False):
     loggingstring = generate_our_logging_string()
     print(loggingstring)
-    with open("/var/log/rpiupspackcomms", "a") as f:
-        f.write(loggingstring + '\n')
+    log_writer.write(loggingstring, urgent=urgent)
 
 
 if __name__ == "__main__":
@@ -58,28 +92,52 @@ if __name__ == "__main__":
     vice versa -- notify the user. If the battery level dips below a certain level, notify the user. If the
     battery level dips below 10%, shut down the computer gracefully.
     """
-    from pyupspack import SmartUPS
-    from time import sleep
-    loops_since_last_warning = 999999
-    i = 10
-    while i > 0 and 'Waiting for UPS' not in generate_our_logging_string():
-        sleep(5)
-    if i == 0:
-        raise SystemError("Unable to contact UPS")
-    while True:
-        generate_echo_and_log_our_logging_string()
-        if SmartUPS.charging:
-            # Tell all users *once*, the power is back online.
-            if loops_since_last_warning > 0:
-                loops_since_last_warning = 0
-                send_global_message(SmartUPS.verbose)
-        if SmartUPS.discharging and SmartUPS.batterylevel is not None and SmartUPS.batterylevel >= 10:
-            # Tell all users repeatedly (with a decent pause in between), we're running on batteries
-            loops_since_last_warning += 1
-            if loops_since_last_warning > SmartUPS.batterylevel:
-                loops_since_last_warning = 0
-                send_global_message(SmartUPS.verbose)
-        if SmartUPS.batterylevel is not None and SmartUPS.batterylevel < 10:
-            send_global_message("SHUTTING DOWN")
-            os.system("shutdown -h now")
-        sleep(5)
+    import pyupspack
+    from time import monotonic, sleep
+    parser = argparse.ArgumentParser(description="Monitor the RPi UPSPack. Warn the users if the power is low; shut down if necessary.")
+    parser.add_argument('--device', help="serial device of the UPSPack (default: find it automatically)")
+    parser.add_argument('--socket', default=SOCKET_FILE, help="serve the UPSPack's state here (default: %(default)s)")
+    parser.add_argument('--low-level', type=int, default=LOW_LEVEL, help="warn the users below this battery level (default: %(default)s%%)")
+    parser.add_argument('--shutdown-level', type=int, default=SHUTDOWN_LEVEL, help="shut down below this battery level (default: %(default)s%%)")
+    parser.add_argument('--hysteresis', type=int, default=HYSTERESIS, help="the battery must climb this much above --low-level to stop being low (default: %(default)s%%)")
+    parser.add_argument('--pre-shutdown-dir', default=PRE_SHUTDOWN_DIR, help="before shutting down, run every executable in here, in parallel (default: %(default)s)")
+    parser.add_argument('--safety-margin', type=float, default=SAFETY_MARGIN, help="power off at least this many seconds before the battery is expected to run out (default: %(default)s)")
+    parser.add_argument('--hook', help="shell command to run on every event, with UPS_EVENT, UPS_BATTERYLEVEL and UPS_VERBOSE set")
+    args = parser.parse_args()
+    log_writer = TelemetryLogWriter(LOG_FILE, flush_interval=LOG_FLUSH_INTERVAL, max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT)
+    ring_recorder = TelemetryRingRecorder(RING_FILE, capacity=RING_CAPACITY)
+    SmartUPS = pyupspack.open(args.device, profile_path=PROFILE_FILE, recorder=ring_recorder)
+    server = SmartUPSServer(SmartUPS, args.socket)
+    shm_writer = SharedSnapshotWriter(SHM_FILE)
+    SmartUPS.add_frame_listener(shm_writer.publish)
+    engine = PolicyEngine(low_level=args.low_level, critical_level=args.shutdown_level, hysteresis=args.hysteresis)
+    for event in (POWER_LOST, BATTERY_LOW, REMINDER, POWER_RESTORED):
+        engine.on(event, notify())
+    engine.on(BATTERY_CRITICAL, notify("SHUTTING DOWN", urgent=True))
+    if args.hook is not None:
+        for event in EVENTS:
+            engine.on(event, run_hook(args.hook))
+
+    def close_everything():
+        default_dispatcher().close(timeout=NOTIFICATION_TIMEOUT)
+        server.close()
+        shm_writer.close()
+        log_writer.close()
+        ring_recorder.close()
+    orchestrator = ShutdownOrchestrator(SmartUPS, safety_margin=args.safety_margin, before_poweroff=close_everything)
+    orchestrator.add_hooks_from(args.pre_shutdown_dir)
+    engine.on(BATTERY_CRITICAL, orchestrator.shutdown)
+    last_logged = None
+
+    def log_frame(snapshot, events):
+        # Log every LOG_INTERVAL seconds; at once (and flush the log) if something has happened.
+        global last_logged
+        if events or last_logged is None or monotonic() - last_logged >= LOG_INTERVAL:
+            last_logged = monotonic()
+            generate_echo_and_log_our_logging_string(log_writer, urgent=bool(events))
+    started = monotonic()
+    while SmartUPS.snapshot_or_None() is None:
+        if monotonic() - started > STARTUP_TIMEOUT:
+            raise SystemError("Unable to contact UPS")
+        sleep(1)
+    engine.run(SmartUPS, log_frame, interval=LOG_INTERVAL)
@@ -23,6 +23,12 @@ Example:
 
 Note:
     For a full list of attributes and methods, see the SmartUPSInterface source code.
+    asyncio applications should use pyupspack.aio.AsyncSmartUPS instead.
+
+    Importing pyupspack doesn't touch the hardware. The SmartUPS instance is created
+    (and the serial device found) the first time it is used. To choose the device
+    yourself, or to get an instance of your own, call pyupspack.open() instead. To
+    watch several UPSPacks at once, call pyupspack.open_all().
 
 Todo: QQQ
     * For module TODOs
@@ -41,8 +47,10 @@ from threading import Condition, Lock, Thread
 from time import sleep
 import time
 
-from pyupspack.classes import ReadWriteLock, DummyCachingCall, SelfCachingCall
+from pyupspack.classes import DummyCachingCall, SelfCachingCall, SerialFrameReader, SmartUPSBaseInterface
+from pyupspack.estimators import BatteryProfile, ProfileEstimator
 from pyupspack.exceptions import ReadSmartUPSError, ReadOnlyError, CachingStructureInitializationError, CachingStructurePrematureReadError
+from pyupspack.ioloop import default_loop
 from pyupspack.utilities import identify_serial_device, loworchargebattery_string_info, sleep_for_a_random_period
 
 try:
@@ -51,13 +59,17 @@ except ImportError as ex:
     raise ImportError("Please install pySerial module (Python 3)")
 
 
-class SmartUPSInterface:
+class SmartUPSInterface(SmartUPSBaseInterface):
     """Interface class for the RPi UPSPack Standard V2
     
     This library facilitates communication between the RPi UPSPack Standard V2 and a
     single-board computer of your choosing. Connect the UPSPack to a USB port on your
     computer and interface with it.
 
+    If the serial device goes away, the reader reopens it (with exponential backoff),
+    meanwhile carrying on serving the last-known-good snapshot. Check the stale
+    attribute to see whether that's what is happening.
+
     Attributes:
         Vout (float): Voltage out from the UPSPack's battery.
             If unknown, returns None.
@@ -67,16 +79,25 @@ class SmartUPSInterface:
         
         timeleft (int): Time until battery empties/fills entirely.
             If unknown, returns None.
+
+        timeleft_range (tuple): Confidence interval of timeleft, as (low, high) seconds.
+            If unknown, returns None.
     
-        cached_smartups (str): The cached version of _latest_serial_rx. Please use
-            this, rather than _latest_serial_rx, because it is cached and therefore
-            doesn't cause you to wait for the serial port to spit something out.
+        cached_smartups (SerialFrameReader): The cached, dictionaryized version of the
+            most recent frame. Its result is updated by a background thread the moment
+            each frame arrives. Please use this, rather than _latest_serial_rx, because
+            it doesn't cause you to wait for the serial port to spit something out.
     
         charging (bool): If the UPSPack is charging, True; else, False.
             If unknown, returns None.
     
         discharging (bool): If the UPSPack is discharging, True; else, False.
             If unknown, returns None.
+
+        connected (bool): False if we have lost contact with the serial device.
+
+        stale (bool): True if we haven't got a frame, or have lost contact with the
+            serial device, or the most recent frame is older than stale_after seconds.
         
         hardwareversion (str): The current hardware version of the UPSPack.
 
@@ -96,6 +117,11 @@ class SmartUPSInterface:
         _return_meaningful_status (): Returns dictionary of attributes derived
             from the cached output of the SmartUPSInterface's serial device.
 
+        snapshot (): Returns an immutable SmartUPSSnapshot of the most recent frame.
+            The attributes above are read from it.
+
+        close (): Stop reading the serial device and close it.
+
         module_level_variable1 (int): Module level variables may be documented in
             either the ``Attributes`` section of the module docstring, or in an
             inline docstring immediately following the variable.
@@ -109,7 +135,8 @@ class SmartUPSInterface:
 
     """
 
-    def __init__(self, serial_device, use_caching=True, baudrate=9600, pause_duration_between_uncached_reads=5):
+    def __init__(self, serial_device, use_caching=True, baudrate=9600, pause_duration_between_uncached_reads=5,
+                 device_finder=None, stale_after=5, recorder=None, estimator=None, io_loop=None):
         """The __init__ method of the SmartUPSInterface class.
 
         Note:
@@ -117,10 +144,22 @@ class SmartUPSInterface:
 
         Args:
             serial_device (str): Serial device that the RPi UPSPack is using.
-            use_caching (bool): If True, use an internally cached copy of the output of the
-                serial device. Otherwise, read a fresh copy whenever it's needed.
+            use_caching (bool): If True, read the serial device continuously in the background
+                and cache each frame as it arrives. Otherwise, read a fresh copy whenever it's needed.
             pause_duration_between_uncached_reads (:obj:`int`, optional): How often should the cache
                 be updated? This must be a nonzero positive integer.
+            device_finder (:obj:`function`, optional): If we lose contact with the serial device,
+                call this to find out what it's called now (e.g. identify_serial_device). If None,
+                we assume it will come back with the same name.
+            stale_after (:obj:`float`, optional): If the most recent frame is older than this many
+                seconds, it is considered stale.
+            recorder (:obj:`TelemetryRingRecorder`, optional): If supplied, every frame is
+                recorded in it by the reader, as soon as the frame arrives.
+            estimator (:obj:`TimeLeftEstimator`, optional): Works out timeleft. Default is a
+                SlidingWindowEstimator; see pyupspack.estimators.
+            io_loop (:obj:`IOLoop`, optional): If use_caching is True, the serial device is read
+                on this loop's thread, which may be reading other devices too. Default is the
+                shared pyupspack.ioloop.default_loop().
 
         Methods:
             ...lots of protected methods; no public ones.
@@ -132,50 +171,68 @@ class SmartUPSInterface:
         """
         if pause_duration_between_uncached_reads < 2:
             raise ValueError("Please specify a pause_duration_between_uncached_reads of 2 or more.")
-        self.__serialdev_lck = ReadWriteLock()
-        self.__smupsinfo_lck = ReadWriteLock()
-        self.__battlevel_lck = ReadWriteLock()
-        self.__smversion_lck = ReadWriteLock()
-        self.__verbostxt_lck = ReadWriteLock()
-        self.__time_left_lck = ReadWriteLock()
-        self.__Volts_out_lck = ReadWriteLock()
-        self.__dischargg_lck = ReadWriteLock()
-        self.__charging_lock = ReadWriteLock()
-        self.__serial_rx_lck = ReadWriteLock()
+        super().__init__(stale_after=stale_after, estimator=estimator)
+        if recorder is not None:
+            self.add_frame_listener(recorder.record)
+        self.__serial_rx_lck = Lock()
         self.__serial_device = serial_device
+        self.__device_finder = device_finder
+        self.__baudrate = baudrate
+        self.__serial_timeout = pause_duration_between_uncached_reads - 0.5
         self._last_time_we_read_smartups = None
         self._last_smartups_output = None
-        self._our_timeremainingestimate_dct = {}  # Used by timeleft_and_verboseinfo()
-        self._when_did_we_start_discharging = None
-        self._when_did_we_start_recharging = None
-        self._what_was_battery_level_when_we_did_start_disch_or_rchgg = None
-        self._verbose_werewechargingordischarging = None
-        self._serial_iface = serial.Serial(
-            port=serial_device,
-            baudrate=baudrate,
-            timeout=pause_duration_between_uncached_reads - 0.5,
-            parity=serial.PARITY_NONE,
-            stopbits=serial.STOPBITS_ONE,
-            bytesize=serial.EIGHTBITS
-        )
+        self._serial_iface = self._open_serial_iface(serial_device)
         if serial_device is None or type(serial_device) is not str or not os.path.exists(serial_device):
             raise ValueError("serial_device should be a string and also an existent filename/device")
         if type(pause_duration_between_uncached_reads) is not int or pause_duration_between_uncached_reads < 1:
             raise ValueError("pause_duration_between_uncached_reads must be a nonzero positive integer")
 #         os.system("stty -F %s 9600 cs8 -cstopb -parenb" % self.__serial_device)
-        self.__cached_smartups = DummyCachingCall(pause_duration_between_uncached_reads, self._forgivingly_read_smartups_output) \
-                                if not use_caching else \
-                                SelfCachingCall(pause_duration_between_uncached_reads, self._forgivingly_read_smartups_output)  # , self.serial_device)
-        self.__cached_smartups._update_me()
+        if use_caching:
+            self.__cached_smartups = SerialFrameReader(self._serial_iface, self._process_smartups_frame,
+                                                       reopen=self._reopen_serial_iface, metrics=self._metrics,
+                                                       io_loop=default_loop() if io_loop is None else io_loop)
+            self.__cached_smartups.wait_for_frame(pause_duration_between_uncached_reads)
+        else:
+            self.__cached_smartups = DummyCachingCall(pause_duration_between_uncached_reads, self._forgivingly_read_smartups_output)
 #        self._wait_until_nonNone_cached_result()
-        super().__init__()
+
+    def _open_serial_iface(self, serial_device):
+        return serial.Serial(
+            port=serial_device,
+            baudrate=self.__baudrate,
+            timeout=self.__serial_timeout,
+            parity=serial.PARITY_NONE,
+            stopbits=serial.STOPBITS_ONE,
+            bytesize=serial.EIGHTBITS
+        )
+
+    def _reopen_serial_iface(self):
+        """Find the serial device again (if we know how) and open it.
+
+        The SerialFrameReader calls this after the serial device has gone away, e.g. because
+        the USB/TTL converter was reset or unplugged and plugged back in.
+
+        Returns:
+            serial.Serial: The newly-opened serial port.
+
+        Raises:
+            SmartUPSInitializationError, serial.SerialException, OSError: Not back yet.
+
+        """
+        serial_device = self.__serial_device if self.__device_finder is None else self.__device_finder()
+        old_serial_iface, self._serial_iface = self._serial_iface, self._open_serial_iface(serial_device)
+        self.__serial_device = serial_device
+        try:
+            old_serial_iface.close()
+        except Exception:
+            pass
+        return self._serial_iface
 
     def _forgivingly_read_smartups_output(self):
-        """Up to ten times, try to obtain a dictionaryized output of the RPi UPSPack's USB port.
+        """Up to ten times, try to obtain a snapshot of the output of the RPi UPSPack's USB port.
         
         Returns:
-            dict: A simple dictionary of the output. The structure tends to look like this:-
-                {'Vin':'...', 'Vout':'...', 'hardwareversion':'...', 'BATCAP':'...','SmartUPS':'...'} 
+            SmartUPSSnapshot: See _process_smartups_frame().
         
         Args:
             None
@@ -186,12 +243,18 @@ class SmartUPSInterface:
         """
         for attempts in range(10):
             try:
-                res = self._read_smartups_output()
-                print("_forgivingly_read_smartups_output() -- after %d attempts, returning %s" % (attempts + 1, str(res)))
-                return res
+                return self._read_smartups_output()
             except Exception as ex:
+                self._metrics.increment('retries')
                 print("%s occurred while trying to read from serial port" % str(ex))
+                if isinstance(ex, (OSError, serial.SerialException)):
+                    self._metrics.increment('reconnect_attempts')
+                    try:
+                        self._reopen_serial_iface()
+                    except Exception as ex:
+                        print("%s occurred while trying to reopen serial port" % str(ex))
                 sleep_for_a_random_period(random.randint(1, 10) / 10.)
+        self._metrics.increment('read_failures')
         raise ReadSmartUPSError("Attempted %d times to read the smartUPS output. Failed totally." % attempts)
 
     def _wait_until_nonNone_cached_result(self):
@@ -232,20 +295,26 @@ class SmartUPSInterface:
             ? QQQ
 
         """
-        try:
-            self.__serial_rx_lck.acquire_read()
+        started = time.perf_counter()
+        with self.__serial_rx_lck:
+            self._metrics.observe('lock_wait_seconds', time.perf_counter() - started)
+            started = time.perf_counter()
 #             txt = ''
 #             while txt.count('$') < 2:
 #                 with open(serial_device, 'rt') as f:
 #                     txt += f.readline().strip('\n')
 #             txt = [r.strip(' ') for r in txt.strip(' \n ').split('$') if r != ''][-1]
             retval = ''
-            while len(retval) == 0 or retval[-1] != '\n':
-                retval = retval + self._serial_iface.read(999999).decode()
+            try:
+                while len(retval) == 0 or retval[-1] != '\n':
+                    retval = retval + self._serial_iface.read(999999).decode()
+                    self._metrics.increment('reads')
+            except Exception:
+                self._metrics.increment('read_errors')
+                raise
+            self._metrics.observe('serial_read_seconds', time.perf_counter() - started)
+            self._metrics.increment('bytes_read', len(retval))
             return retval.strip('\n').split('\n')[-1]
-        finally:
-            self.__serial_rx_lck.release_read()
-        return retval
 
     @_latest_serial_rx.setter
     def _latest_serial_rx(self, value):
@@ -268,229 +337,133 @@ class SmartUPSInterface:
         if self._last_time_we_read_smartups is None or (current_timestamp - self._last_time_we_read_smartups).seconds >= 1:
             self._last_time_we_read_smartups = current_timestamp
             self._last_smartups_output = self._latest_serial_rx
-        txt = self._last_smartups_output
-        if txt is None:
+        return self._process_smartups_frame(self._last_smartups_output)
+
+    def snapshot(self):
+        """Return an immutable record of the most recent frame from the UPSPack.
+
+        All of the public attributes of this class (charging, batterylevel, etc.) are
+        read from this record. If you want more than one of them, call snapshot() once
+        and read them from the record instead: it's quicker, and you can be sure that
+        they all came from the same frame.
+
+        Returns:
+            SmartUPSSnapshot: The most recent frame, or None if we haven't got one yet.
+
+        Args:
+            None
+
+        Raises:
+            ReadSmartUPSError, ValueError, etc.: The most recent frame was unreadable.
+
+        """
+        try:
+            return self.__cached_smartups.result
+        except CachingStructurePrematureReadError:
             return None
-        incoming_info_lst = txt.strip('\n').strip(' ').strip('$').strip(' ').split(',')
-        dct = {}
-        for item in incoming_info_lst:
-            p = item.find(' ')
-            if p < 0:
-                dct[p] = ''
-            else:
-                dct[item[:p]] = item[p + 1:]
-        if dct['Vin'] == 'GOOD':
-            if self._when_did_we_start_recharging is None:
-                self._when_did_we_start_recharging = datetime.datetime.now()
-                self._when_did_we_start_discharging = None
-                self._what_was_battery_level_when_we_did_start_disch_or_rchgg = int(dct['BATCAP'])
-                self._our_timeremainingestimate_dct = {}  # Used by timeleft_and_verboseinfo()
-                if self._verbose_werewechargingordischarging is None:
-                    self._verbose_werewechargingordischarging = 'charging'
-        else:
-            if self._when_did_we_start_discharging is None:
-                self._when_did_we_start_discharging = datetime.datetime.now()
-                self._when_did_we_start_recharging = None
-                self._our_timeremainingestimate_dct = {}  # Used by timeleft_and_verboseinfo()
-                self._what_was_battery_level_when_we_did_start_disch_or_rchgg = int(dct['BATCAP'])
-                if self._verbose_werewechargingordischarging is None:
-                    self._verbose_werewechargingordischarging = 'discharging'
-        return dct
+
+    def close(self):
+        """Stop reading the serial device and close it. The last snapshot stays available."""
+        if isinstance(self.__cached_smartups, SerialFrameReader):
+            self.__cached_smartups.join()
+        try:
+            self._serial_iface.close()
+        except Exception:
+            pass
 
     @property
     def serial_device(self):
-        try:
-            self.__serialdev_lck.acquire_read()
-            retval = self.__serial_device
-        finally:
-            self.__serialdev_lck.release_read()
-        return retval
+        return self.__serial_device
 
     @serial_device.setter
     def serial_device(self, value):
         raise ReadOnlyError("Cannot set serial_device attribute. That is inappropriate!")
 
+    @property
+    def connected(self):
+        if isinstance(self.__cached_smartups, SerialFrameReader):
+            return self.__cached_smartups.connected
+        return self._serial_iface.is_open
+
+    @connected.setter
+    def connected(self, value):
+        raise ReadOnlyError("Cannot set connected attribute. That is inappropriate!")
+
     @property
     def cached_smartups(self):
-        try:
-            self.__smupsinfo_lck.acquire_read()
-            retval = self.__cached_smartups
-        finally:
-            self.__smupsinfo_lck.release_read()
-        return retval
+        return self.__cached_smartups
 
     @cached_smartups.setter
     def cached_smartups(self, value):
         raise ReadOnlyError("Cannot set cached_smartups attribute. That is inappropriate!")
 
-    @property
-    def charging(self):
-        try:
-            self.__charging_lock.acquire_read()
-            try:
-                retval = True if self.__cached_smartups.result['Vin'] == 'GOOD' and self.__cached_smartups.result['BATCAP'] != '100' else False
-            except (TypeError, AttributeError):
-                return None
-        finally:
-            self.__charging_lock.release_read()
-        return retval
 
-    @charging.setter
-    def charging(self, value):
-        raise ReadOnlyError("Cannot set charging attribute. That is inappropriate!")
 
-    @property
-    def discharging(self):
-        try:
-            self.__dischargg_lck.acquire_read()
-            try:
-                retval = False if self.__cached_smartups.result['Vin'] == 'GOOD' else True
-            except (TypeError, CachingStructurePrematureReadError):
-                return None
-        finally:
-            self.__dischargg_lck.release_read()
-        return retval
 
-    @discharging.setter
-    def discharging(self, value):
-        raise ReadOnlyError("Cannot set discharging attribute. That is inappropriate!")
+def open(serial_device=None, use_caching=True, pause_duration_between_uncached_reads=2, profile_path=None, **kwargs):  # @ReservedAssignment
+    """Create a new SmartUPSInterface instance.
 
-    @property
-    def batterylevel(self):
-        try:
-            self.__battlevel_lck.acquire_read()
-            try:
-                retval = int(self.__cached_smartups.result['BATCAP'])
-            except (TypeError, ValueError, CachingStructurePrematureReadError):
-                retval = None
-        finally:
-            self.__battlevel_lck.release_read()
-        return retval
+    Unless told otherwise, find the serial device of the UPSPack with identify_serial_device(),
+    and find it again that way if it is unplugged and plugged back in.
 
-    @batterylevel.setter
-    def batterylevel(self, value):
-        raise ReadOnlyError("Cannot set batterylevel attribute. That is inappropriate!")
+    Args:
+        serial_device (:obj:`str`, optional): Serial device that the RPi UPSPack is using.
+        use_caching, pause_duration_between_uncached_reads: See SmartUPSInterface.
+        profile_path (:obj:`str`, optional): If supplied, estimate timeleft with a ProfileEstimator,
+            learning (and remembering, in this file) how long the battery takes to charge and
+            discharge. Then timeleft is available from the first frame after a power cut.
+        **kwargs: Passed to SmartUPSInterface, e.g. recorder or stale_after.
 
-    @property
-    def Vout(self):
-        try:
-            self.__Volts_out_lck.acquire_read()
-            try:
-                retval = float(self.__cached_smartups.result['Vout']) / 1000.
-            except (TypeError, ValueError, CachingStructurePrematureReadError):
-                retval = None
-        finally:
-            self.__Volts_out_lck.release_read()
-        return retval
+    Returns:
+        SmartUPSInterface: The new instance.
 
-    @Vout.setter
-    def Vout(self, value):
-        raise ReadOnlyError("Cannot set Vout attribute. That is inappropriate!")
+    Raises:
+        SmartUPSInitializationError: Cannot find the device.
 
-    @property
-    def hardwareversion(self):
-        try:
-            self.__smversion_lck.acquire_read()
-            try:
-                retval = self.__cached_smartups.result['SmartUPS']
-            except (TypeError, ValueError, CachingStructurePrematureReadError):
-                retval = None
-        finally:
-            self.__smversion_lck.release_read()
-        return retval
+    """
+    if profile_path is not None:
+        kwargs['estimator'] = ProfileEstimator(BatteryProfile(profile_path))
+    return SmartUPSInterface(serial_device=identify_serial_device() if serial_device is None else serial_device,
+                             use_caching=use_caching,
+                             pause_duration_between_uncached_reads=pause_duration_between_uncached_reads,
+                             device_finder=identify_serial_device if serial_device is None else None,
+                             **kwargs)
 
-    @hardwareversion.setter
-    def hardwareversion(self, value):
-        raise ReadOnlyError("Cannot set Vout attribute. That is inappropriate!")
 
-    @property
-    def verbose(self):
-        try:
-            self.__verbostxt_lck.acquire_read()
-            try:
-                retval = self.timeleft_and_verboseinfo()[1]
-            except (TypeError, ValueError, CachingStructurePrematureReadError):
-                return None
-        finally:
-            self.__verbostxt_lck.release_read()
-        return retval
+def open_all(vid=None, pid=None, **kwargs):
+    """Watch every UPSPack that is plugged in, from one I/O thread, for computers with more than one.
 
-    @verbose.setter
-    def verbose(self, value):
-        raise ReadOnlyError("Cannot set Voutverboseattribute. That is inappropriate!")
+    Args:
+        vid, pid (:obj:`int`, optional): Only consider USB/TTL converters with this vendor/product ID.
+        **kwargs: Passed to every SmartUPSInterface, e.g. recorder or stale_after.
 
-    @property
-    def timeleft(self):
-        try:
-            self.__time_left_lck.acquire_read()
-            retval = self.timeleft_and_verboseinfo()[0]
-        finally:
-            self.__time_left_lck.release_read()
-        return retval
-
-    @timeleft.setter
-    def timeleft(self, value):
-        raise ReadOnlyError("Cannot set timeleft attribute. That is inappropriate!")
-
-    def timeleft_and_verboseinfo(self, fake_dct=None):
-        """Return a tuple containing the time left and a verbose string describing the current status.
-        
-        Returns:
-            tuple:
-                int: time left in seconds
-                str: verbose description of status 
+    Returns:
+        SmartUPSRegistry: Keyed by device identity; see pyupspack.multi.
 
-        Args:
-            None
+    """
+    from pyupspack.multi import SmartUPSRegistry
+    registry = SmartUPSRegistry(**kwargs)
+    registry.discover(vid, pid)
+    return registry
 
-        Raises:
-            ? QQQ
 
-        """
+_SmartUPS_lock = Lock()
 
-        nowish = datetime.datetime.now()
-        retdct = fake_dct if fake_dct else self.cached_smartups.result
-        if retdct is None:
-            return None
-        assert(self._when_did_we_start_discharging is not None or self._when_did_we_start_recharging is not None)
-        our_delta = nowish - (self._when_did_we_start_discharging if self._when_did_we_start_discharging is not None else self._when_did_we_start_recharging)
-        seconds_since_discharging_began = our_delta.seconds
-        initial_battery_level = self._what_was_battery_level_when_we_did_start_disch_or_rchgg
-        current_battery_level = int(retdct['BATCAP'].strip('%'))
-        battery_level_difference = initial_battery_level - current_battery_level
-        time_taken_to_change_by_one_percentage_point = 0 if battery_level_difference == 0 else seconds_since_discharging_began / float(battery_level_difference)
-        retdct['timeleft'] = None
-        if current_battery_level == 100 and not self.discharging:
-            self._verbose_werewechargingordischarging = 'neither'
-            retdct['timeleft'] = 0
-            retdct['verbose'] = "Battery is full and trickle-charging."
-        elif initial_battery_level is None or time_taken_to_change_by_one_percentage_point == 0:
-            retdct['verbose'] = "Battery is %s; currently at %d%%." % ("recharging" if self.charging else "discharging" if self.discharging else "trickling", current_battery_level)  # retdct['Vin' ] == 'GOOD' else "discharging" if current_battery_level < 100
-        elif self.discharging:
-            if current_battery_level not in self._our_timeremainingestimate_dct.keys():
-                self._our_timeremainingestimate_dct[current_battery_level] = time_taken_to_change_by_one_percentage_point * (initial_battery_level - 20)
-                print("As if by magik, the value is %d" % self._our_timeremainingestimate_dct[current_battery_level])
-            retdct['timeleft'] = self._our_timeremainingestimate_dct[current_battery_level]
-            self._verbose_werewechargingordischarging = 'discharging'
-            if retdct['timeleft'] < 0:
-                retdct['verbose'] = "Discharging. Battery at %d%%." % current_battery_level
-            else:
-                retdct['verbose'] = "Discharging. Battery at %d%%. Time until low battery: %s" % (current_battery_level, loworchargebattery_string_info(retdct['timeleft']))
-        elif self.charging:
-            self._verbose_werewechargingordischarging = 'charging'  #        ['Vin'] == 'GOOD'
-            if current_battery_level not in self._our_timeremainingestimate_dct.keys():
-                self._our_timeremainingestimate_dct[current_battery_level] = -time_taken_to_change_by_one_percentage_point * (100 - current_battery_level)
-                print("As if by magic, the value is %d" % self._our_timeremainingestimate_dct[current_battery_level])
-            retdct['timeleft'] = self._our_timeremainingestimate_dct[current_battery_level]
-            if retdct['timeleft'] < 0:
-                retdct['timeleft'] = 999999999  # Battery level FELL, even though we're charging. WEIRD.
-                retdct['verbose'] = "Charging. Battery at %d%%. Oddly enough, the battery level is falling even though we're charging." % current_battery_level
-            else:
-                retdct['verbose'] = "Charging. Battery at %d%%. Time until full: %s" % (current_battery_level, loworchargebattery_string_info(retdct['timeleft']))
-        else:
-            retdct['verbose'] = "Recalculating..."
-        return (retdct['timeleft'], retdct['verbose'])
 
+def __getattr__(name):
+    """Create the module-level SmartUPS instance the first time somebody asks for it.
 
-SmartUPS = SmartUPSInterface(serial_device=identify_serial_device(), use_caching=True, pause_duration_between_uncached_reads=2)
+    Importing pyupspack therefore doesn't touch the hardware; 'from pyupspack import SmartUPS'
+    (or 'pyupspack.SmartUPS') does.
 
+    Raises:
+        AttributeError: No such attribute.
+        SmartUPSInitializationError: Cannot find the device.
+
+    """
+    if name != 'SmartUPS':
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    with _SmartUPS_lock:
+        if 'SmartUPS' not in globals():
+            globals()['SmartUPS'] = open()
+    return globals()['SmartUPS']
@@ -0,0 +1,249 @@
+#!/usr/bin/python3
+"""asyncio-native interface to the RPi UPSPack Standard V2.
+
+This module contains AsyncSmartUPS, the asyncio counterpart of SmartUPSInterface.
+Instead of a background thread, it registers the serial port's file descriptor
+with the running event loop (loop.add_reader), so frames are processed by the
+loop itself as soon as their bytes arrive. No threads, no polling.
+
+Example:
+    Here is how to wait for a power cut::
+
+        import asyncio
+        from pyupspack.aio import AsyncSmartUPS
+
+        async def main():
+            async with AsyncSmartUPS('/dev/ttyUSB0') as ups:
+                await ups.wait_for(lambda s: s.discharging)
+                async for frame in ups.frames():
+                    print(frame.batterylevel)
+
+        asyncio.run(main())
+
+.. _Google Python Style Guide:
+   http://google.github.io/styleguide/pyguide.html
+
+"""
+
+import asyncio
+import os
+
+from pyupspack.classes import SmartUPSBaseInterface, SmartUPSFramer
+from pyupspack.exceptions import MalformedFrameError, ReadSmartUPSError, ReadOnlyError
+from pyupspack.utilities import modification_time_of
+
+try:
+    import serial
+except ImportError as ex:
+    raise ImportError("Please install pySerial module (Python 3)")
+
+
+class AsyncSmartUPS(SmartUPSBaseInterface):
+    """asyncio interface class for the RPi UPSPack Standard V2
+
+    Create me from within a coroutine; I attach myself to the running event loop.
+    The attributes (charging, batterylevel, etc.) are the same as SmartUPSInterface's
+    and never block: they read the snapshot of the most recent frame.
+
+    Args:
+        serial_device (str): Serial device that the RPi UPSPack is using.
+        baudrate (:obj:`int`, optional): Default is 9600.
+        max_queued_frames (:obj:`int`, optional): How many frames may pile up for a
+            slow consumer of frames() before the oldest ones are dropped.
+        device_finder (:obj:`function`, optional): See SmartUPSInterface.
+        stale_after (:obj:`float`, optional): See SmartUPSInterface.
+        estimator (:obj:`TimeLeftEstimator`, optional): See SmartUPSInterface.
+        min_backoff, max_backoff (:obj:`float`, optional): See below.
+
+    Methods:
+        frames (): Asynchronous iterator over snapshots, one per frame.
+        wait_for (predicate, timeout): Wait until predicate(snapshot) is true.
+        snapshot (): Returns the SmartUPSSnapshot of the most recent frame, or None.
+        close (): Detach from the event loop and close the serial port.
+
+    If the serial device goes away, I keep serving the last-known-good snapshot (see
+    stale) and try to reopen it, backing off exponentially from min_backoff to
+    max_backoff seconds, or at once if something changes in /dev. If device_finder is
+    supplied, I call it to find out what the device is called now.
+
+    Raises:
+        ValueError: Bad parameters were supplied by the programmer.
+        RuntimeError: There is no running event loop.
+
+    """
+
+    def __init__(self, serial_device, baudrate=9600, max_queued_frames=16, device_finder=None,
+                 stale_after=5, min_backoff=.05, max_backoff=2., estimator=None):
+        if serial_device is None or type(serial_device) is not str or not os.path.exists(serial_device):
+            raise ValueError("serial_device should be a string and also an existent filename/device")
+        super().__init__(stale_after=stale_after, estimator=estimator)
+        self.__serial_device = serial_device
+        self.__baudrate = baudrate
+        self.__max_queued_frames = max_queued_frames
+        self.__device_finder = device_finder
+        self.__min_backoff = min_backoff
+        self.__max_backoff = max_backoff
+        self.__loop = asyncio.get_running_loop()
+        self.__framer = SmartUPSFramer()
+        self.__snapshot = None
+        self.__error = None
+        self.__connected = False
+        self.__closed = False
+        self.__reconnect_handle = None
+        self.__subscribers = set()
+        self._serial_iface = None
+        self._attach(serial_device)
+
+    def _attach(self, serial_device):
+        self._serial_iface = serial.Serial(
+            port=serial_device,
+            baudrate=self.__baudrate,
+            timeout=0,
+            parity=serial.PARITY_NONE,
+            stopbits=serial.STOPBITS_ONE,
+            bytesize=serial.EIGHTBITS
+        )
+        self.__serial_device = serial_device
+        self.__framer = SmartUPSFramer()
+        self.__loop.add_reader(self._serial_iface.fileno(), self._on_readable)
+        self.__connected = True
+        self.__error = None
+
+    def _detach(self):
+        if self._serial_iface is not None and self._serial_iface.is_open:
+            self.__loop.remove_reader(self._serial_iface.fileno())
+            self._serial_iface.close()
+        self.__connected = False
+
+    def _try_to_reattach(self, backoff, deadline, dev_mtime):
+        """Reopen the serial device, backing off exponentially; retry at once if /dev changes."""
+        self.__reconnect_handle = None
+        if self.__closed:
+            return
+        if self.__loop.time() < deadline and modification_time_of('/dev') == dev_mtime:
+            self.__reconnect_handle = self.__loop.call_later(
+                min(self.__min_backoff, backoff), self._try_to_reattach, backoff, deadline, dev_mtime)
+            return
+        dev_mtime = modification_time_of('/dev')
+        self._metrics.increment('reconnect_attempts')
+        try:
+            self._attach(self.__serial_device if self.__device_finder is None else self.__device_finder())
+            self._metrics.increment('reconnects')
+        except Exception as e:
+            self.__error = e
+            backoff = min(backoff * 2, self.__max_backoff)
+            self.__reconnect_handle = self.__loop.call_later(
+                min(self.__min_backoff, backoff), self._try_to_reattach, backoff, self.__loop.time() + backoff, dev_mtime)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def _on_readable(self):
+        try:
+            data = self._serial_iface.read(max(1, self._serial_iface.in_waiting))
+        except (OSError, serial.SerialException) as e:
+            self._metrics.increment('read_errors')
+            self._detach()
+            self.__error = ReadSmartUPSError("Lost contact with %s: %s" % (self.__serial_device, str(e)))
+            self._try_to_reattach(self.__min_backoff, self.__loop.time(), None)
+            return
+        self._metrics.increment('reads')
+        self._metrics.increment('bytes_read', len(data))
+        for frame in self.__framer.feed(data):
+            try:
+                snapshot = self._process_smartups_frame(frame)
+            except MalformedFrameError as e:
+                print("%s occurred while processing %r" % (str(e), frame))
+                continue
+            self._publish(snapshot)
+
+    def _publish(self, snapshot):
+        self.__snapshot = snapshot
+        for queue in self.__subscribers:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(snapshot)
+
+    def snapshot(self):
+        """Return an immutable record of the most recent frame from the UPSPack.
+
+        If we have lost contact with the serial device, this is the last-known-good
+        snapshot; see stale.
+
+        Returns:
+            SmartUPSSnapshot: The most recent frame, or None if we haven't got one yet.
+
+        """
+        return self.__snapshot
+
+    async def frames(self):
+        """Yield a SmartUPSSnapshot for every frame that arrives from now on.
+
+        If the consumer falls behind by more than max_queued_frames frames, the
+        oldest frames are skipped. If we lose contact with the serial device, no
+        frames arrive until we regain it.
+
+        """
+        queue = asyncio.Queue(maxsize=self.__max_queued_frames)
+        self.__subscribers.add(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self.__subscribers.discard(queue)
+
+    async def wait_for(self, predicate, timeout=None):
+        """Wait until predicate(snapshot) is true; return that snapshot.
+
+        The most recent snapshot is checked first, so this returns at once if the
+        condition is already true.
+
+        Args:
+            predicate: Function that takes a SmartUPSSnapshot and returns a bool.
+            timeout (:obj:`float`, optional): Give up after this many seconds.
+
+        Returns:
+            SmartUPSSnapshot: The first snapshot for which predicate() was true.
+
+        Raises:
+            asyncio.TimeoutError: We gave up.
+
+        """
+        async def _wait():
+            snapshot = self.snapshot()
+            if snapshot is not None and predicate(snapshot):
+                return snapshot
+            async for snapshot in self.frames():
+                if predicate(snapshot):
+                    return snapshot
+        return await asyncio.wait_for(_wait(), timeout)
+
+    def close(self):
+        """Detach from the event loop and close the serial port."""
+        self.__closed = True
+        if self.__reconnect_handle is not None:
+            self.__reconnect_handle.cancel()
+        self._detach()
+
+    @property
+    def connected(self):
+        return self.__connected
+
+    @connected.setter
+    def connected(self, value):
+        raise ReadOnlyError("Cannot set connected attribute. That is inappropriate!")
+
+    @property
+    def last_error(self):
+        return self.__error
+
+    @property
+    def serial_device(self):
+        return self.__serial_device
+
+    @serial_device.setter
+    def serial_device(self, value):
+        raise ReadOnlyError("Cannot set serial_device attribute. That is inappropriate!")
@@ -1,7 +1,8 @@
 #!/usr/bin/python3
 """Useful classes used by the SmartUPSInterface class.
 
-This module contains ReadWriteLock, DummyCachingCall, and SelfCachingCall.
+This module contains ReadWriteLock, DummyCachingCall, SelfCachingCall, SmartUPSFramer,
+SerialFrameReader, SmartUPSSnapshot, and SmartUPSBaseInterface.
 They are used by the SmartUPSInterface class and perhaps by other code too.
 
 Todo:
@@ -13,12 +14,21 @@ Todo:
 
 """
 
+from collections import Counter
+from contextlib import contextmanager
 import copy
-from threading import Condition, Lock, Thread
-from time import sleep
+import itertools
+import math
+from threading import Condition, Lock, Thread, local
+import time
+from time import perf_counter, sleep
 
-from pyupspack.exceptions import CachingStructurePrematureReadError
-from pyupspack.utilities import sleep_for_a_random_period
+from pyupspack.estimators import SlidingWindowEstimator
+from pyupspack.exceptions import CachingStructurePrematureReadError, MalformedFrameError, ReadOnlyError, ReadSmartUPSError
+from pyupspack.ioloop import default_loop
+from pyupspack.metrics import Metrics
+from pyupspack.parser import parse_frame
+from pyupspack.utilities import freeze, loworchargebattery_string_info, modification_time_of, sleep_for_a_random_period
 
 try:
     import serial  # @UnusedImport
@@ -28,45 +38,204 @@ except ImportError as ex:
 
 class ReadWriteLock:
     """ A lock object that allows many simultaneous "read locks", but
-    only one "write lock." """
+    only one "write lock."
 
-    def __init__(self):
+    Three policies are available. With 'reader' (the default, and the only
+    behaviour this class used to have), readers never wait for a writer that
+    is merely waiting, so a steady stream of readers can starve writers. With
+    'writer', new readers wait whenever a writer is waiting. With 'fair',
+    readers and writers take turns: a reader that arrives while a writer is
+    waiting is let in once that writer (or another) has had its turn, but
+    before any writer that is still waiting.
+
+    Both acquire_* methods accept a timeout and return True or False, like
+    threading.Lock.acquire(). read_locked() and write_locked() are context
+    managers that raise TimeoutError instead; using the lock itself in a
+    'with' statement takes the write lock.
+
+    If collect_stats is True, the number of acquisitions and timeouts and the
+    total/maximum wait and hold times are recorded; see stats().
+
+    e.g.
+        >>> lck = ReadWriteLock(policy='writer', collect_stats=True)
+        >>> with lck.read_locked(timeout=1):
+        >>>     pass
+        >>> lck.stats()['read_acquisitions']
+        1
+
+    Args:
+        policy (:obj:`str`, optional): 'reader', 'writer' or 'fair'.
+        collect_stats (:obj:`bool`, optional): Keep counters? Default is False.
+
+    Raises:
+        ValueError: Unknown policy.
+
+    """
+
+    POLICIES = ('reader', 'writer', 'fair')
+
+    def __init__(self, policy='reader', collect_stats=False):
+        if policy not in self.POLICIES:
+            raise ValueError("policy must be one of %s" % ', '.join(self.POLICIES))
+        self._policy = policy
         self._read_ready_lck = Lock()
         self._read_ready = Condition(self._read_ready_lck)
         self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+        self._writes_completed = 0
+        self._readers_waiting = Counter()  # value of _writes_completed when they began waiting -> how many
+        self._collect_stats = collect_stats
+        self._write_acquired_at = None
+        self._read_acquired_at = local()
+        self.reset_stats()
 
     def locked(self):
-        return self._read_ready_lck.locked()
+        return self._writer
 
-    def acquire_read(self):
-        """ Acquire a read lock. Blocks only if a thread has
-        acquired the write lock. """
-        self._read_ready.acquire()
-        try:
-            self._readers += 1
-        finally:
-            self._read_ready.release()
+    @property
+    def policy(self):
+        return self._policy
+
+    def _may_read(self, since):
+        if self._writer:
+            return False
+        if self._policy == 'reader' or self._writers_waiting == 0:
+            return True
+        if self._policy == 'writer':
+            return False
+        return since != self._writes_completed
+
+    def _may_write(self):
+        if self._writer or self._readers > 0:
+            return False
+        if self._policy == 'fair':
+            return all(since == self._writes_completed for since in self._readers_waiting)
+        return True
+
+    def acquire_read(self, timeout=None):
+        """ Acquire a read lock. Blocks if a thread has acquired the write
+        lock (or, depending on the policy, is waiting to). Returns False if
+        the timeout expired first. """
+        started = perf_counter()
+        with self._read_ready:
+            since = self._writes_completed
+            self._readers_waiting[since] += 1
+            try:
+                acquired = self._read_ready.wait_for(lambda: self._may_read(since), timeout)
+            finally:
+                self._readers_waiting[since] -= 1
+                if not self._readers_waiting[since]:
+                    del self._readers_waiting[since]
+            if acquired:
+                self._readers += 1
+            elif self._policy == 'fair':
+                self._read_ready.notify_all()
+            if self._collect_stats:
+                self._record_acquisition('read', acquired, perf_counter() - started)
+        if acquired and self._collect_stats:
+            self._read_acquired_at.__dict__.setdefault('stack', []).append(perf_counter())
+        return acquired
 
     def release_read(self):
         """ Release a read lock. """
-        self._read_ready.acquire()
-        try:
+        held_since = self._read_acquired_at.stack.pop() if self._collect_stats else None
+        with self._read_ready:
             self._readers -= 1
             if not self._readers:
-                self._read_ready.notifyAll()
-        finally:
-            self._read_ready.release()
+                self._read_ready.notify_all()
+            if held_since is not None:
+                self._record_hold('read', perf_counter() - held_since)
 
-    def acquire_write(self):
+    def acquire_write(self, timeout=None):
         """ Acquire a write lock. Blocks until there are no
-        acquired read or write locks. """
-        self._read_ready.acquire()
-        while self._readers > 0:
-            self._read_ready.wait()
+        acquired read or write locks. Returns False if the timeout
+        expired first. """
+        started = perf_counter()
+        with self._read_ready:
+            self._writers_waiting += 1
+            try:
+                acquired = self._read_ready.wait_for(self._may_write, timeout)
+            finally:
+                self._writers_waiting -= 1
+            if acquired:
+                self._writer = True
+                self._write_acquired_at = perf_counter()
+            else:
+                self._read_ready.notify_all()  # Readers that were waiting for us needn't wait any more.
+            if self._collect_stats:
+                self._record_acquisition('write', acquired, perf_counter() - started)
+        return acquired
 
     def release_write(self):
         """ Release a write lock. """
-        self._read_ready.release()
+        with self._read_ready:
+            self._writer = False
+            self._writes_completed += 1
+            self._read_ready.notify_all()
+            if self._collect_stats:
+                self._record_hold('write', perf_counter() - self._write_acquired_at)
+
+    @contextmanager
+    def read_locked(self, timeout=None):
+        """ Context manager that holds a read lock. Raises TimeoutError
+        if it can't be acquired within the timeout. """
+        if not self.acquire_read(timeout):
+            raise TimeoutError("Timed out after %s seconds waiting for a read lock" % timeout)
+        try:
+            yield self
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write_locked(self, timeout=None):
+        """ Context manager that holds the write lock. Raises TimeoutError
+        if it can't be acquired within the timeout. """
+        if not self.acquire_write(timeout):
+            raise TimeoutError("Timed out after %s seconds waiting for the write lock" % timeout)
+        try:
+            yield self
+        finally:
+            self.release_write()
+
+    def __enter__(self):
+        self.acquire_write()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release_write()
+
+    def _record_acquisition(self, kind, acquired, waited):
+        stats = self._stats
+        if acquired:
+            stats[kind + '_acquisitions'] += 1
+        else:
+            stats[kind + '_timeouts'] += 1
+        stats[kind + '_wait_total'] += waited
+        stats[kind + '_wait_max'] = max(stats[kind + '_wait_max'], waited)
+
+    def _record_hold(self, kind, held):
+        stats = self._stats
+        stats[kind + '_hold_total'] += held
+        stats[kind + '_hold_max'] = max(stats[kind + '_hold_max'], held)
+
+    def stats(self):
+        """ Return a dictionary of counters: {read,write}_acquisitions,
+        {read,write}_timeouts, and {read,write}_{wait,hold}_{total,max}
+        (in seconds). They stay at zero unless collect_stats is True. """
+        with self._read_ready:
+            return dict(self._stats)
+
+    def reset_stats(self):
+        """ Set all the counters to zero. """
+        with self._read_ready:
+            self._stats = {'%s_%s' % (kind, what): 0
+                           for kind in ('read', 'write')
+                           for what in ('acquisitions', 'timeouts', 'wait_total', 'wait_max', 'hold_total', 'hold_max')}
+
+
+INTERVAL, TTL, STALE_WHILE_REVALIDATE = 'interval', 'ttl', 'stale-while-revalidate'
+"""SelfCachingCall's modes. See SelfCachingCall."""
 
 
 class DummyCachingCall:
@@ -74,7 +243,8 @@ class DummyCachingCall:
 
     DummyCachingCall() is a class instance that doesn't actually cache anything. However, it is a
     drop-in replacement for SelfCachingCall. For test purposes, it is very useful. See SelfCachingCall
-    for usage information, arguments, methods, attributes, and exceptions.
+    for usage information, arguments, methods, attributes, and exceptions. For something in between,
+    see SelfCachingCall's TTL mode.
     
     """
 
@@ -88,10 +258,24 @@ class DummyCachingCall:
     def _update_me(self):
         pass
 
+    def refresh_now(self, wait=True):
+        pass
+
+    def join(self):
+        pass
+
     @property
     def result(self):
         return self.__func(*self.__args, **self.__kwargs)
 
+    @property
+    def age(self):
+        return 0.
+
+    @property
+    def last_error(self):
+        return None
+
 
 class SelfCachingCall:
     """Self-repeating call to function; saves result; caches it.
@@ -101,6 +285,30 @@ class SelfCachingCall:
     programmer. The call happens in the background. An instance of SelfCachingCall() encapsulates that
     functionality and caches the result of the call.
 
+    The calls are timers on the shared IOLoop (see pyupspack.ioloop.default_loop()), not a thread
+    per instance, so between calls nothing wakes up at all. The function runs on the loop's
+    thread, which also reads the serial ports and serves SmartUPSServer's clients, and must
+    therefore be quick. If it mightn't be (e.g. it does I/O that can block), pass
+    run_in_thread=True: the timers stay on the loop, but each call gets a thread of its own.
+
+    That is the INTERVAL mode. There are two others, in which nothing happens until somebody
+    reads the result:
+
+        TTL                     If the cached result is more than refreshfrequency seconds
+                                old, the reader calls the function and waits for it.
+        STALE_WHILE_REVALIDATE  If the cached result is more than refreshfrequency seconds
+                                old, the reader gets it anyway, and the function is called
+                                in the background to bring it up to date.
+
+    In every mode, the function is only ever called by one thread at a time; readers that
+    find a call in progress wait for it rather than calling it again.
+
+    By default, each read of result returns a deep copy of the cached result, so that the
+    caller may do as it likes with it. That is safe but slow. With immutable=True, the result
+    is frozen once, when it is cached (see utilities.freeze(): dictionaries become read-only
+    MappingProxyTypes, lists become tuples), and every reader gets the same object, with no
+    lock and no copy.
+
     e.g.
         >>> GVAR = 5
         >>> def myfunc(addme):
@@ -114,72 +322,120 @@ class SelfCachingCall:
         my.globals.exceptions.FrontendStillAwaitingCachedValue: We have not cached the first result yet
         >>> sleep(1); c.result
         605
+        >>> c = SelfCachingCall(2, myfunc, 100, mode=TTL)
+        >>> c.result, c.result, c.age
+        (705, 705, 0.0001)
 
     Note:
         If the programmer tries to read the cached value before the first call to the function,
-        an exception will be thrown.
+        an exception will be thrown. (Not in TTL or STALE_WHILE_REVALIDATE mode: the first
+        reader waits for the first call.)
 
     Args:
-        refreshfrequency (int): How often should I call the function
+        refreshfrequency (int): How often should I call the function; or, in TTL and
+            STALE_WHILE_REVALIDATE mode, how old may the cached result get
         func: What is the function?
         args,kwargs: Pass these parameters to the function
+        mode (:obj:`str`, optional): INTERVAL, TTL or STALE_WHILE_REVALIDATE.
+        immutable (:obj:`bool`, optional): Freeze results and hand them out by reference,
+            instead of deep-copying them for every reader.
+        io_loop (:obj:`IOLoop`, optional): Default is pyupspack.ioloop.default_loop(). Unless
+            run_in_thread is True, the function is called on this loop's thread, and a slow
+            call holds up everything else that uses the loop.
+        run_in_thread (:obj:`bool`, optional): Call the function on a short-lived thread of its
+            own, rather than on the loop's thread.
 
     Methods:
         _update_me(): Force a new call to the function; save the result in our cache.
+        refresh_now(wait): Call the function now, rather than when it is due.
+        join(): Stop calling the function.
 
     Attributes:
         result (int): result of most recent (cached) call to the function that's being cached
             FYI, if the most recent call threw an exception, then the act of getting the result
             attribute will throw that exception. I guess you could say the subroutine didn't
             only catch it; it cached it.
+        age (float): How many seconds ago the most recent call finished. None if none has.
+        last_error (Exception): What the most recent call raised, or None if it returned.
+        mode (str): INTERVAL, TTL or STALE_WHILE_REVALIDATE.
+        immutable (bool): Whether results are frozen and shared, rather than copied.
+        run_in_thread (bool): Whether the function is called on a thread of its own.
 
     Exceptions:
         FrontendStillAwaitingCachedValue: If we don't have a cached value yet, this exception is raised.
+        ValueError: No such mode.
 
     """
 
-    def __init__(self, refreshfrequency, func, *args, **kwargs):
+    def __init__(self, refreshfrequency, func, *args, mode=INTERVAL, immutable=False, io_loop=None,
+                 run_in_thread=False, **kwargs):
         assert (isinstance(refreshfrequency, int)
                 or isinstance(refreshfrequency, float))
+        if mode not in (INTERVAL, TTL, STALE_WHILE_REVALIDATE):
+            raise ValueError("mode must be INTERVAL, TTL or STALE_WHILE_REVALIDATE, not %r" % mode)
         self.__args = args
         self.__kwargs = kwargs
         self.__func = func
+        self.__mode = mode
+        self.__immutable = immutable
+        self.__run_in_thread = run_in_thread
         self.__refreshfrequency = refreshfrequency
         self.__refreshfreq_lock = ReadWriteLock()
-        self.__result = None
-        self.__error = CachingStructurePrematureReadError(
-            'We have not cached the first result yet')
-        self.__result_and_error_lock = ReadWriteLock()
+        # (result, error, time.monotonic() when the call finished), replaced, never modified
+        self.__published = (None, CachingStructurePrematureReadError('We have not cached the first result yet'), None)
+        self.__result_and_error_lock = ReadWriteLock(policy='writer')
+        self.__calling_lock = Lock()  # held while the function is being called
+        self.__revalidating = False
         self.__time_to_join = False
-        self.__keepupdating_thread = Thread(target=self._keep_updating)
-        self.__keepupdating_thread.daemon = True
-        self.__keepupdating_thread.start()
+        self.__io_loop = default_loop() if io_loop is None else io_loop
+        self.__timer = self.__io_loop.call_soon(self._keep_updating) if mode == INTERVAL else None
         super().__init__()
 
     def _error(self):
-        try:
-            self.__result_and_error_lock.acquire_read()
-            retval = self.__error
-        finally:
-            self.__result_and_error_lock.release_read()
-        return retval
+        return self.__published[1]
+
+    def _in_background(self, func):
+        # Run func on the loop's thread, or on a thread of its own if run_in_thread.
+        if self.__run_in_thread:
+            Thread(target=func, daemon=True).start()
+        else:
+            self.__io_loop.call_soon(func)
 
     def _keep_updating(self):
-        time_left_before_update = 0
-        while not self.__time_to_join:
-            if time_left_before_update <= 0:
+        # Runs on the I/O loop: call the function, then set a timer for the next call.
+        if self.__time_to_join:
+            return
+        if self.__run_in_thread:
+            Thread(target=self._refresh_and_reschedule, daemon=True).start()
+        else:
+            self._refresh_and_reschedule()
+
+    def _refresh_and_reschedule(self):
+        self._refresh()
+        if not self.__time_to_join:
+            self.__timer = self.__io_loop.call_later(self.refreshfrequency, self._keep_updating)
+
+    def _refresh(self, max_age=None):
+        # Call the function, unless (having waited for any call in progress) the result is younger than max_age.
+        with self.__calling_lock:
+            if self.__time_to_join:
+                return
+            age = self.age
+            if max_age is None or age is None or age >= max_age:
                 self._update_me()
-                time_left_before_update = self.__refreshfrequency
-            else:
-                sleep_for_how_long = min(1, time_left_before_update)
-                time_left_before_update -= sleep_for_how_long
-                sleep(sleep_for_how_long)
-        print('No more soup for you')
-#         self.join() # FIXME: Why was this commented out?!
+
+    def _revalidate(self):
+        # Runs in the background (see _in_background()), for STALE_WHILE_REVALIDATE mode.
+        try:
+            self._refresh(self.refreshfrequency)
+        finally:
+            self.__revalidating = False
 
     def _update_me(self):
         try:
             the_new_result = self.__func(*self.__args, **self.__kwargs)
+            if self.__immutable:
+                the_new_result = freeze(the_new_result)
             the_new_error = None
         except Exception as e:
             the_new_result = None
@@ -188,23 +444,53 @@ class SelfCachingCall:
             pass
         try:
             self.__result_and_error_lock.acquire_write()
-            self.__error = the_new_error
-            self.__result = the_new_result
+            self.__published = (the_new_result, the_new_error, time.monotonic())
         finally:
             self.__result_and_error_lock.release_write()
 
+    def refresh_now(self, wait=True):
+        """Call the function now, rather than when it is due. Does nothing once join() has been called.
+
+        Args:
+            wait (:obj:`bool`, optional): If True, call it on this thread and return when the
+                result has been cached. If False, call it in the background (on the loop's thread,
+                unless run_in_thread), and return at once.
+
+        """
+        if wait:
+            self._refresh()
+        else:
+            self._in_background(self._refresh)
+
+    def _bring_up_to_date(self):
+        age = self.age
+        if self.__time_to_join or (age is not None and age < self.refreshfrequency):
+            return
+        if self.__mode == TTL or age is None:
+            self._refresh(self.refreshfrequency)
+        elif not self.__revalidating:
+            self.__revalidating = True
+            self._in_background(self._revalidate)
+
     @property
     def result(self):
+        if self.__mode != INTERVAL:
+            self._bring_up_to_date()
+        if self.__immutable:
+            retval, reterr, _ = self.__published  # one atomic read; nothing to copy
+            if reterr is not None:
+                raise reterr
+            return retval
         try:
-            self.__result_and_error_lock.acquire_write()
+            self.__result_and_error_lock.acquire_read()
             while True:
                 try:
-                    retval = copy.deepcopy(self.__result)
+                    the_result, reterr, _ = self.__published
+                    retval = copy.deepcopy(the_result)
                 except RuntimeError:
                     print('value changed while iterating, or something; probably a race condition; retrying...')
                     sleep_for_a_random_period(.1)
                 else:
-                    reterr = self.__error
                     break
         except Exception as e:
             #             from my.globals.logging import Logger
@@ -212,7 +498,7 @@ class SelfCachingCall:
             retval = None
             reterr = e
         finally:
-            self.__result_and_error_lock.release_write()
+            self.__result_and_error_lock.release_read()
         if reterr is not None:
             raise reterr
         else:
@@ -220,7 +506,30 @@ class SelfCachingCall:
 
     def join(self):
         self.__time_to_join = True
-        self.__keepupdating_thread.join()
+        if self.__timer is not None:
+            self.__io_loop.call_and_wait(lambda: self.__timer.cancel())
+
+    @property
+    def age(self):
+        updated = self.__published[2]
+        return None if updated is None else time.monotonic() - updated
+
+    @property
+    def last_error(self):
+        _, error, updated = self.__published
+        return None if updated is None else error
+
+    @property
+    def immutable(self):
+        return self.__immutable
+
+    @property
+    def run_in_thread(self):
+        return self.__run_in_thread
+
+    @property
+    def mode(self):
+        return self.__mode
 
     @property
     def refreshfrequency(self):
@@ -235,3 +544,692 @@ class SelfCachingCall:
         self.__refreshfrequency = value
         self.__refreshfreq_lock.release_write()
 
+
+class SmartUPSFramer:
+    """Incremental splitter for the '$ ... $' frames that the UPSPack emits.
+
+    The UPSPack writes one frame per line, e.g. '$ SmartUPS V3.2P,Vin GOOD,BATCAP 87,Vout 5123 $'.
+    Bytes may arrive in arbitrarily-sized chunks, so feed() keeps whatever is left over after the
+    last complete frame and prepends it to the next chunk. If we start listening halfway through a
+    frame, the first '$' we see is a closing delimiter; feed() notices that (the 'frame' would be
+    empty or would span a newline) and resynchronizes on the next '$'.
+
+    e.g.
+        >>> framer = SmartUPSFramer()
+        >>> framer.feed(b'Vout 5123 $\\n$ SmartUPS V3.2P,Vin GOOD,BAT')
+        []
+        >>> framer.feed(b'CAP 87,Vout 5123 $\\n')
+        ['SmartUPS V3.2P,Vin GOOD,BATCAP 87,Vout 5123']
+
+    Args:
+        max_frame_length (:obj:`int`, optional): If this many bytes pile up without a closing
+            '$', they are discarded as garbage.
+
+    Methods:
+        feed(data): Add some bytes; return a list of the complete frames (str) found so far.
+
+    """
+
+    def __init__(self, max_frame_length=256):
+        self.__buffer = bytearray()
+        self.__max_frame_length = max_frame_length
+
+    def feed(self, data):
+        buf = self.__buffer
+        buf += data
+        frames = []
+        while True:
+            start = buf.find(b'$')
+            if start < 0:
+                del buf[:]
+                break
+            end = buf.find(b'$', start + 1)
+            if end < 0:
+                del buf[:start]
+                if len(buf) > self.__max_frame_length:
+                    del buf[:]
+                break
+            inner = buf[start + 1:end]
+            if b'\n' in inner or not inner.strip():
+                del buf[:end]  # The '$' at 'start' closed a frame that we only saw half of.
+                continue
+            frames.append(inner.strip().decode(errors='replace'))
+            del buf[:end + 1]
+        return frames
+
+
+class _Backoff:
+    """When to try reopening a serial device next: exponential backoff, cut short if /dev changes.
+
+    Used by SerialFrameReader's thread and by its I/O loop callbacks alike, so that both
+    reconnect on the same schedule.
+
+    """
+
+    def __init__(self, min_backoff, max_backoff):
+        self.__min_backoff = min_backoff
+        self.__max_backoff = max_backoff
+        self.__backoff = min_backoff
+        self.__deadline = None  # None means try at once
+        self.__dev_mtime = None
+
+    def attempting(self):
+        """Note that an attempt is being made now; a change to /dev after this makes the next one due."""
+        self.__dev_mtime = modification_time_of('/dev')
+
+    def failed(self):
+        """Note that the attempt failed; the next is due after the current backoff, which then doubles."""
+        self.__deadline = time.monotonic() + self.__backoff
+        self.__backoff = min(self.__backoff * 2, self.__max_backoff)
+
+    def due(self):
+        return (self.__deadline is None or time.monotonic() >= self.__deadline
+                or modification_time_of('/dev') != self.__dev_mtime)
+
+    def next_check(self):
+        """How long to wait before asking due() again. /dev is checked every min_backoff seconds."""
+        if self.__deadline is None:
+            return 0.
+        return max(0., min(self.__min_backoff, self.__deadline - time.monotonic()))
+
+
+class SerialFrameReader:
+    """Continuous reader of a serial port; calls a function on each frame; caches the result.
+
+    SerialFrameReader() is a drop-in alternative to SelfCachingCall for streams that produce
+    frames of their own accord. Instead of waking up every N seconds and reading whatever the
+    serial port has accumulated, a background thread consumes the byte stream as it arrives,
+    splits it into frames with SmartUPSFramer, and calls func(frame, *args, **kwargs) for each
+    complete frame. The result is cached and published the moment the frame arrives, so the
+    latency between the circuit board saying something and the programmer seeing it is one
+    frame, not one polling interval.
+
+    The result is published copy-on-write: each frame produces a new tuple and the reference
+    to it is swapped in one go. Reading the result takes no locks at all, so any number of
+    threads may poll it without getting in each other's way (or the reader's). Results should
+    therefore be immutable, e.g. a SmartUPSSnapshot.
+
+    If func() throws an exception, or the serial port does, the last good result stays put and
+    the exception is recorded in last_error. If the serial port goes away (e.g. the USB/TTL
+    converter was unplugged or reset) and a reopen function was supplied, the reader calls it
+    until it returns a new, open serial port. It backs off exponentially between attempts, from
+    min_backoff up to max_backoff seconds, but tries again at once if a device node appears in
+    or disappears from /dev in the meantime.
+
+    If an IOLoop is supplied, the reader doesn't start a thread of its own. Instead, the loop
+    watches the serial port's file descriptor and hands the reader whatever bytes have arrived,
+    so one thread can read any number of serial ports. Reconnection attempts are scheduled on
+    the loop too.
+
+    e.g.
+        >>> import serial
+        >>> iface = serial.Serial('/dev/ttyUSB0', 9600, timeout=1)
+        >>> reader = SerialFrameReader(iface, lambda frame: frame.split(','))
+        >>> reader.wait_for_frame(5)
+        True
+        >>> reader.result
+        ['SmartUPS V3.2P', 'Vin GOOD', 'BATCAP 87', 'Vout 5123']
+
+    Args:
+        serial_iface (serial.Serial): An open serial port. It should have a read timeout, so that
+            join() doesn't wait forever.
+        func: What is the function? It receives the frame (str) as its first parameter.
+        args,kwargs: Pass these parameters to the function too.
+        reopen (:obj:`function`, optional): Returns a freshly-opened serial port. If None, the
+            reader just keeps trying to read from the old one.
+        min_backoff, max_backoff (:obj:`float`, optional): See above.
+        metrics (:obj:`Metrics`, optional): Where to count reads, read errors and reconnections,
+            and record how long each read took.
+        io_loop (:obj:`IOLoop`, optional): Read on this loop's thread instead of a thread of
+            our own. See above.
+
+    Methods:
+        wait_for_frame(timeout): Wait until the next frame has been processed.
+        join(): Stop reading.
+
+    Attributes:
+        result: result of the most recent successful call to func().
+        last_error (Exception): The most recent exception, or None if the most recent frame was fine.
+        connected (bool): False if we have lost contact with the serial port and not yet regained it.
+        frames_received (int): How many frames have been processed so far.
+
+    Exceptions:
+        CachingStructurePrematureReadError: If no frame has been processed successfully yet. (If
+            something has gone wrong, that exception is raised instead.)
+
+    """
+
+    def __init__(self, serial_iface, func, *args, reopen=None, min_backoff=.05, max_backoff=2., metrics=None, io_loop=None,
+                 **kwargs):
+        self.__serial_iface = serial_iface
+        self.__metrics = Metrics() if metrics is None else metrics
+        self.__func = func
+        self.__args = args
+        self.__kwargs = kwargs
+        self.__reopen = reopen
+        self.__min_backoff = min_backoff
+        self.__max_backoff = max_backoff
+        self.__framer = SmartUPSFramer()
+        # (result, have_result, last_error, frames_received, connected)
+        self.__published = (None, False, None, 0, True)
+        self.__new_frame = Condition(Lock())
+        self.__time_to_join = False
+        self.__io_loop = io_loop
+        self.__reconnect_handle = None
+        if io_loop is None:
+            self.__keepreading_thread = Thread(target=self._keep_reading)
+            self.__keepreading_thread.daemon = True
+            self.__keepreading_thread.start()
+        else:
+            self.__keepreading_thread = None
+            io_loop.add_reader(serial_iface.fileno(), self._on_readable)
+        super().__init__()
+
+    def _read_some(self):
+        started = perf_counter()
+        try:
+            data = self.__serial_iface.read(max(1, self.__serial_iface.in_waiting))
+        except Exception as e:
+            self.__metrics.increment('read_errors')
+            self._publish(None, e, False, False)
+            return False
+        self.__metrics.observe('serial_read_seconds', perf_counter() - started)
+        self.__metrics.increment('reads')
+        self.__metrics.increment('bytes_read', len(data))
+        for frame in self.__framer.feed(data):
+            self._update_me(frame)
+        return True
+
+    def _keep_reading(self):
+        while not self.__time_to_join:
+            if not self._read_some():
+                self._reconnect()
+
+    def _on_readable(self):
+        # The I/O loop's equivalent of _keep_reading().
+        if self.__time_to_join or self._read_some():
+            return
+        self.__io_loop.remove_reader(self.__serial_iface.fileno())
+        if self.__reopen is None:
+            self.__reconnect_handle = self.__io_loop.call_later(1, self._reattach)
+            return
+        self._close_serial_iface()
+        self._try_to_reopen(_Backoff(self.__min_backoff, self.__max_backoff))
+
+    def _reattach(self):
+        self.__reconnect_handle = None
+        if not self.__time_to_join:
+            self.__io_loop.add_reader(self.__serial_iface.fileno(), self._on_readable)
+
+    def _try_to_reopen(self, backoff):
+        """Reopen the serial device on the I/O loop when backoff says so; the loop's equivalent of _reconnect()."""
+        self.__reconnect_handle = None
+        if self.__time_to_join:
+            return
+        if backoff.due() and self._attempt_to_reopen(backoff):
+            self._reattach()
+            return
+        self.__reconnect_handle = self.__io_loop.call_later(backoff.next_check(), self._try_to_reopen, backoff)
+
+    def _reconnect(self):
+        if self.__reopen is None:
+            sleep(1)
+            return
+        self._close_serial_iface()
+        backoff = _Backoff(self.__min_backoff, self.__max_backoff)
+        while not self.__time_to_join:
+            if backoff.due() and self._attempt_to_reopen(backoff):
+                return
+            sleep(backoff.next_check())
+
+    def _close_serial_iface(self):
+        try:
+            self.__serial_iface.close()
+        except Exception:
+            pass
+
+    def _attempt_to_reopen(self, backoff):
+        """Call reopen() once. On success, start reading the new serial port afresh; return True."""
+        backoff.attempting()
+        self.__metrics.increment('reconnect_attempts')
+        try:
+            serial_iface = self.__reopen()
+        except Exception as e:
+            self._publish(None, e, False, False)
+            backoff.failed()
+            return False
+        self.__metrics.increment('reconnects')
+        self.__serial_iface = serial_iface
+        self.__framer = SmartUPSFramer()  # Whatever was half-read from the old port is no use.
+        self._publish(None, None, False, True)
+        return True
+
+    def _update_me(self, frame):
+        try:
+            the_new_result = self.__func(frame, *self.__args, **self.__kwargs)
+            the_new_error = None
+        except Exception as e:
+            the_new_result = None
+            the_new_error = e
+        self._publish(the_new_result, the_new_error, True, True)
+
+    def _publish(self, the_new_result, the_new_error, is_a_frame, connected):
+        # Only the reading thread gets here. Readers never take a lock: they pick up whichever
+        # tuple self.__published refers to, and rebinding that reference is atomic.
+        result, have_result, _, frames_received, _ = self.__published
+        if is_a_frame:
+            frames_received += 1
+            if the_new_error is None:
+                result, have_result = the_new_result, True
+        self.__published = (result, have_result, the_new_error, frames_received, connected)
+        with self.__new_frame:
+            self.__new_frame.notify_all()
+
+    def wait_for_frame(self, timeout=None):
+        """Wait until the next frame (or error) has been published.
+
+        Args:
+            timeout (:obj:`float`, optional): Give up after this many seconds.
+
+        Returns:
+            bool: True if something was published; False if we timed out.
+
+        """
+        with self.__new_frame:
+            return self.__new_frame.wait(timeout)
+
+    @property
+    def result(self):
+        retval, have_result, reterr, _, _ = self.__published
+        if not have_result:
+            raise reterr if reterr is not None else CachingStructurePrematureReadError(
+                'We have not received the first frame yet')
+        return retval
+
+    @property
+    def last_error(self):
+        return self.__published[2]
+
+    @property
+    def frames_received(self):
+        return self.__published[3]
+
+    @property
+    def connected(self):
+        return self.__published[4]
+
+    def join(self):
+        self.__time_to_join = True
+        if self.__keepreading_thread is not None:
+            self.__keepreading_thread.join()
+            return
+        self.__io_loop.call_and_wait(self._detach)
+
+    def _detach(self):
+        if self.__reconnect_handle is not None:
+            self.__reconnect_handle.cancel()
+        if self.__serial_iface.is_open:
+            self.__io_loop.remove_reader(self.__serial_iface.fileno())
+
+
+class SmartUPSSnapshot:
+    """Immutable record of everything one frame from the UPSPack told us.
+
+    SmartUPSInterface builds one of these per frame, once, and hands out the same instance to
+    everybody who asks until the next frame arrives. Because every field comes from the same
+    frame, the programmer can read several of them without worrying that the battery level
+    belongs to one frame and the charging status to another.
+
+    e.g.
+        >>> snapshot = SmartUPS.snapshot()
+        >>> snapshot.discharging, snapshot.batterylevel, snapshot.sequence
+        (True, 86, 1234)
+        >>> snapshot.batterylevel = 100
+        pyupspack.exceptions.ReadOnlyError: Cannot set batterylevel attribute. That is inappropriate!
+
+    Args:
+        sequence (int): Frame sequence number. It increases by one per frame.
+        timestamp (float): When the frame was received, per time.time().
+        monotonic (float): When the frame was received, per time.monotonic().
+        hardwareversion (str): e.g. 'V3.2P'.
+        Vin (str): 'GOOD' if the UPSPack has external power; something else if it doesn't.
+        batterylevel (int): Between 0 and 100. None if the frame didn't say.
+        Vout (float): Voltage out, in volts. None if the frame didn't say.
+        timeleft (int): Seconds until the battery is low/full. None if unknown.
+        timeleft_range (tuple): Confidence interval of timeleft, as (low, high) seconds;
+            high is math.inf if the battery might never get there. None if unknown.
+        verbose (str): Human-readable description of the status.
+        raw (str): The frame itself.
+
+    Attributes:
+        The same as the Args, plus:-
+        charging (bool): True if Vin is GOOD and the battery isn't full.
+        discharging (bool): True if Vin isn't GOOD.
+        age (float): How many seconds ago the frame was received.
+
+    """
+
+    __slots__ = ('sequence', 'timestamp', 'monotonic', 'hardwareversion', 'Vin', 'batterylevel',
+                 'Vout', 'charging', 'discharging', 'timeleft', 'timeleft_range', 'verbose', 'raw')
+
+    def __init__(self, sequence, timestamp, monotonic, hardwareversion, Vin, batterylevel, Vout,
+                 timeleft, verbose, raw, timeleft_range=None):
+        discharging = Vin != 'GOOD'
+        for name, value in (('sequence', sequence), ('timestamp', timestamp), ('monotonic', monotonic),
+                            ('hardwareversion', hardwareversion), ('Vin', Vin),
+                            ('batterylevel', batterylevel), ('Vout', Vout),
+                            ('charging', not discharging and batterylevel != 100),
+                            ('discharging', discharging), ('timeleft', timeleft),
+                            ('timeleft_range', timeleft_range), ('verbose', verbose), ('raw', raw)):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise ReadOnlyError("Cannot set %s attribute. That is inappropriate!" % name)
+
+    def __delattr__(self, name):
+        raise ReadOnlyError("Cannot delete %s attribute. That is inappropriate!" % name)
+
+    @property
+    def age(self):
+        """How long ago (in seconds) the frame was received."""
+        return time.monotonic() - self.monotonic
+
+    def __repr__(self):
+        return 'SmartUPSSnapshot(%s)' % ', '.join('%s=%r' % (name, getattr(self, name)) for name in self.__slots__)
+
+
+class SmartUPSBaseInterface:
+    """Everything that SmartUPSInterface and AsyncSmartUPS have in common.
+
+    Subclasses get frames from the UPSPack somehow and pass each of them to
+    _process_smartups_frame(), which keeps track of when charging/discharging began and
+    turns the frame into a SmartUPSSnapshot. Subclasses must supply snapshot(), which
+    returns the most recent of those; the public attributes are all read from it. They
+    must also supply connected, for the benefit of stale.
+
+    Args:
+        stale_after (:obj:`float`, optional): If the most recent frame is older than this
+            many seconds, it is considered stale.
+        estimator (:obj:`TimeLeftEstimator`, optional): Works out timeleft from the battery
+            levels of recent frames. Default is a SlidingWindowEstimator.
+
+    Attributes:
+        Vout, batterylevel, charging, discharging, hardwareversion, timeleft, timeleft_range,
+            verbose, stale: See SmartUPSInterface.
+
+    Methods:
+        snapshot (): Returns an immutable SmartUPSSnapshot of the most recent frame.
+
+        snapshot_or_None (): The same, or None if there isn't one (yet), rather than an exception.
+
+        add_frame_listener (callback): Call callback(snapshot) for every new frame.
+
+        stats (): Returns counters, histograms and gauges; see pyupspack.metrics.
+
+        remove_frame_listener (callback): Stop doing that.
+
+        time_until (batterylevel): Estimate how long the battery will take to get there.
+
+        timeleft_and_verboseinfo (fake_dct): See below.
+
+    """
+
+    LOW_BATTERY_LEVEL = 20  # When discharging, timeleft is the time until the battery gets this low.
+
+    def __init__(self, stale_after=5, estimator=None):
+        self._stale_after = stale_after
+        self._estimator = SlidingWindowEstimator() if estimator is None else estimator
+        self._were_we_discharging = None  # as of the previous frame; None before the first
+        self._verbose_werewechargingordischarging = None
+        self._frame_sequence = itertools.count(1)
+        self._last_smartups_processed_txt = None
+        self._last_smartups_snapshot = None
+        self._frame_listeners = ()
+        self._metrics = Metrics()
+        super().__init__()
+
+    def add_frame_listener(self, callback):
+        """Call callback(snapshot) for every new frame, from whichever thread processes it.
+
+        The callback runs on the reader's thread (or event loop), so it should be quick.
+        If it raises an exception, the exception is printed and the frame is kept.
+
+        Args:
+            callback: Function that takes a SmartUPSSnapshot.
+
+        """
+        self._frame_listeners = self._frame_listeners + (callback,)
+
+    def remove_frame_listener(self, callback):
+        self._frame_listeners = tuple(cb for cb in self._frame_listeners if cb != callback)
+
+    def _process_smartups_frame(self, txt):
+        """Turn one frame of output from the RPi UPSPack into a snapshot; note any change of charging state.
+
+        This is called by the SerialFrameReader for every frame that arrives (if caching is
+        enabled) and by _read_smartups_output() (if it isn't). The time left and the verbose
+        description are worked out here, once per frame, rather than whenever somebody asks.
+
+        Returns:
+            SmartUPSSnapshot: The frame, typed and timestamped.
+
+        Args:
+            txt (str): One frame, with or without its '$' delimiters.
+
+        Raises:
+            MalformedFrameError: The frame could not be parsed.
+
+        """
+        if txt is None:
+            return None
+        if txt is self._last_smartups_processed_txt:
+            return self._last_smartups_snapshot
+        started = perf_counter()
+        try:
+            parsed = parse_frame(txt)
+        except MalformedFrameError:
+            self._metrics.increment('parse_errors')
+            raise
+        discharging = parsed.Vin != 'GOOD'
+        if discharging is not self._were_we_discharging:
+            self._were_we_discharging = discharging
+            self._estimator.reset()
+            if self._verbose_werewechargingordischarging is None:
+                self._verbose_werewechargingordischarging = 'discharging' if discharging else 'charging'
+        monotonic = time.monotonic()
+        self._estimator.update(monotonic, parsed.batterylevel, parsed.Vout)
+        timeleft, timeleft_range, verbose = self._timeleft_and_verboseinfo_for(parsed.Vin, parsed.batterylevel)
+        self._last_smartups_snapshot = SmartUPSSnapshot(
+            sequence=next(self._frame_sequence), timestamp=time.time(), monotonic=monotonic,
+            hardwareversion=parsed.hardwareversion, Vin=parsed.Vin, batterylevel=parsed.batterylevel,
+            Vout=parsed.Vout, timeleft=timeleft, verbose=verbose, raw=txt, timeleft_range=timeleft_range)
+        self._last_smartups_processed_txt = txt
+        for callback in self._frame_listeners:
+            try:
+                callback(self._last_smartups_snapshot)
+            except Exception as e:
+                self._metrics.increment('listener_errors')
+                print("%s occurred while passing frame #%d to %r" % (str(e), self._last_smartups_snapshot.sequence, callback))
+        self._metrics.increment('frames')
+        self._metrics.observe('frame_processing_seconds', perf_counter() - started)
+        return self._last_smartups_snapshot
+
+    def snapshot(self):
+        raise NotImplementedError("Subclasses of SmartUPSBaseInterface must supply snapshot()")
+
+    def time_until(self, batterylevel):
+        """Estimate how long the battery will take to get from its current level to batterylevel.
+
+        Unlike timeleft, which is the time until LOW_BATTERY_LEVEL (or full), this is the time
+        until any level, e.g. 0 when deciding how long we can afford to spend shutting down.
+
+        Returns:
+            TimeLeftEstimate: See pyupspack.estimators. None if we can't tell.
+
+        """
+        snapshot = self.snapshot_or_None()
+        if snapshot is None or snapshot.batterylevel is None:
+            return None
+        return self._estimator.estimate(snapshot.batterylevel, batterylevel)
+
+    def stats(self):
+        """Return what we have counted and timed so far, and how fresh our information is.
+
+        e.g.
+            >>> SmartUPS.stats()['gauges']
+            {'frame_age_seconds': 0.41, 'connected': True, 'stale': False}
+
+        Returns:
+            dict: 'counters' (e.g. frames, reads, parse_errors, reconnects), 'histograms' (e.g.
+                serial_read_seconds, frame_processing_seconds, lock_wait_seconds), and 'gauges'
+                (frame_age_seconds, connected, stale).
+
+        """
+        stats = self._metrics.stats()
+        snapshot = self.snapshot_or_None()
+        stats['gauges'] = {'frame_age_seconds': None if snapshot is None else snapshot.age,
+                           'connected': self.connected, 'stale': self.stale}
+        return stats
+
+    @property
+    def stale(self):
+        snapshot = self.snapshot_or_None()
+        return snapshot is None or not self.connected or snapshot.age > self._stale_after
+
+    @stale.setter
+    def stale(self, value):
+        raise ReadOnlyError("Cannot set stale attribute. That is inappropriate!")
+
+    def snapshot_or_None(self):
+        """Return snapshot(), or None if there is no good frame to return, e.g. because the link is down."""
+        try:
+            return self.snapshot()
+        except (KeyError, TypeError, ValueError, ReadSmartUPSError, OSError, serial.SerialException):
+            return None
+
+    @property
+    def charging(self):
+        snapshot = self.snapshot_or_None()
+        return None if snapshot is None else snapshot.charging
+
+    @charging.setter
+    def charging(self, value):
+        raise ReadOnlyError("Cannot set charging attribute. That is inappropriate!")
+
+    @property
+    def discharging(self):
+        snapshot = self.snapshot_or_None()
+        return None if snapshot is None else snapshot.discharging
+
+    @discharging.setter
+    def discharging(self, value):
+        raise ReadOnlyError("Cannot set discharging attribute. That is inappropriate!")
+
+    @property
+    def batterylevel(self):
+        snapshot = self.snapshot_or_None()
+        return None if snapshot is None else snapshot.batterylevel
+
+    @batterylevel.setter
+    def batterylevel(self, value):
+        raise ReadOnlyError("Cannot set batterylevel attribute. That is inappropriate!")
+
+    @property
+    def Vout(self):
+        snapshot = self.snapshot_or_None()
+        return None if snapshot is None else snapshot.Vout
+
+    @Vout.setter
+    def Vout(self, value):
+        raise ReadOnlyError("Cannot set Vout attribute. That is inappropriate!")
+
+    @property
+    def hardwareversion(self):
+        snapshot = self.snapshot_or_None()
+        return None if snapshot is None else snapshot.hardwareversion
+
+    @hardwareversion.setter
+    def hardwareversion(self, value):
+        raise ReadOnlyError("Cannot set Vout attribute. That is inappropriate!")
+
+    @property
+    def verbose(self):
+        snapshot = self.snapshot_or_None()
+        return None if snapshot is None else snapshot.verbose
+
+    @verbose.setter
+    def verbose(self, value):
+        raise ReadOnlyError("Cannot set Voutverboseattribute. That is inappropriate!")
+
+    @property
+    def timeleft(self):
+        snapshot = self.snapshot_or_None()
+        return None if snapshot is None else snapshot.timeleft
+
+    @timeleft.setter
+    def timeleft(self, value):
+        raise ReadOnlyError("Cannot set timeleft attribute. That is inappropriate!")
+
+    @property
+    def timeleft_range(self):
+        snapshot = self.snapshot_or_None()
+        return None if snapshot is None else snapshot.timeleft_range
+
+    @timeleft_range.setter
+    def timeleft_range(self, value):
+        raise ReadOnlyError("Cannot set timeleft_range attribute. That is inappropriate!")
+
+    def timeleft_and_verboseinfo(self, fake_dct=None):
+        """Return a tuple containing the time left and a verbose string describing the current status.
+        
+        If fake_dct is supplied, the calculation is done for that (dictionaryized) frame,
+        using the estimator's current fit; the estimator itself is only fed by
+        _process_smartups_frame(). Otherwise, the values that were worked out for the most
+        recent frame are returned.
+
+        Returns:
+            tuple:
+                int: time left in seconds
+                str: verbose description of status 
+
+        Args:
+            fake_dct (:obj:`dict`, optional): The dictionaryized frame.
+
+        Raises:
+            ? QQQ
+
+        """
+
+        if not fake_dct:
+            snapshot = self.snapshot()
+            return None if snapshot is None else (snapshot.timeleft, snapshot.verbose)
+        timeleft, _, verbose = self._timeleft_and_verboseinfo_for(fake_dct['Vin'], int(fake_dct['BATCAP'].strip('%')))
+        return (timeleft, verbose)
+
+    def _timeleft_and_verboseinfo_for(self, Vin, current_battery_level):
+        discharging = Vin != 'GOOD'
+        charging = not discharging and current_battery_level != 100
+        if current_battery_level == 100 and not discharging:
+            self._verbose_werewechargingordischarging = 'neither'
+            return (0, (0, 0), "Battery is full and trickle-charging.")
+        if discharging and current_battery_level <= self.LOW_BATTERY_LEVEL:
+            self._verbose_werewechargingordischarging = 'discharging'
+            return (0, (0, 0), "Discharging. Battery at %d%%." % current_battery_level)
+        estimate = self._estimator.estimate(current_battery_level, self.LOW_BATTERY_LEVEL if discharging else 100)
+        if estimate is None:
+            return (None, None, "Battery is %s; currently at %d%%." % ("recharging" if charging else "discharging" if discharging else "trickling", current_battery_level))
+        timeleft = int(estimate.seconds)
+        timeleft_range = (int(estimate.low), estimate.high if math.isinf(estimate.high) else int(estimate.high))
+        if discharging:
+            self._verbose_werewechargingordischarging = 'discharging'
+            if timeleft < 0:
+                return (None, None, "Discharging. Battery at %d%%." % current_battery_level)
+            return (timeleft, timeleft_range, "Discharging. Battery at %d%%. Time until low battery: %s" % (current_battery_level, loworchargebattery_string_info(timeleft)))
+        elif charging:
+            self._verbose_werewechargingordischarging = 'charging'  #        ['Vin'] == 'GOOD'
+            if timeleft < 0:
+                # Battery level FELL, even though we're charging. WEIRD.
+                return (999999999, None, "Charging. Battery at %d%%. Oddly enough, the battery level is falling even though we're charging." % current_battery_level)
+            return (timeleft, timeleft_range, "Charging. Battery at %d%%. Time until full: %s" % (current_battery_level, loworchargebattery_string_info(timeleft)))
+        else:
+            return (None, None, "Recalculating...")
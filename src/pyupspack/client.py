@@ -0,0 +1,252 @@
+#!/usr/bin/python3
+"""Read the UPSPack's state from a SmartUPSServer, without touching the serial port.
+
+SmartUPSClient has the same attributes as SmartUPS (charging, batterylevel,
+timeleft, verbose, stale, etc.) and the same snapshot() and stats() methods, but
+gets them from the process that owns the serial port (e.g. monitor.py), over its
+Unix socket. Any number of processes may do this at once. See pyupspack.server for
+the protocol.
+
+Example:
+    Here is how to wait for a power cut in a process that isn't monitor.py::
+
+        from pyupspack.client import SmartUPSClient
+
+        ups = SmartUPSClient('/run/rpiupspackcomms.sock')
+        print(ups.verbose)
+        for snapshot in ups.frames():
+            if snapshot.discharging:
+                break
+
+.. _Google Python Style Guide:
+   http://google.github.io/styleguide/pyguide.html
+
+"""
+
+import json
+import math
+import socket
+from threading import Lock, Thread
+import time
+
+from pyupspack.classes import SmartUPSBaseInterface
+from pyupspack.estimators import TimeLeftEstimate
+from pyupspack.exceptions import ReadSmartUPSError, ReadOnlyError
+from pyupspack.server import snapshot_from_dict
+
+DEFAULT_SOCKET_PATH = '/run/rpiupspackcomms.sock'
+
+
+class SmartUPSClient(SmartUPSBaseInterface):
+    """Client of a SmartUPSServer; it looks like a SmartUPSInterface.
+
+    Every attribute read is one round trip to the server, which answers from the
+    snapshot it already has; it never waits for the serial port. To read several
+    attributes of the same frame, call snapshot() once and read them from that.
+
+    Args:
+        path (:obj:`str`, optional): The server's socket.
+        timeout (:obj:`float`, optional): Give up on the server after this many seconds.
+
+    Attributes:
+        Vout, batterylevel, charging, discharging, hardwareversion, timeleft, timeleft_range,
+            verbose, stale: See SmartUPSInterface.
+        connected (bool): True if we are connected to the server.
+        path (str): The server's socket.
+
+    Methods:
+        snapshot (): Returns the server's most recent SmartUPSSnapshot, or None.
+        stats (): Returns the server's SmartUPS.stats().
+        time_until (batterylevel): Returns the server's SmartUPS.time_until(batterylevel).
+        frames (everything): Iterator over snapshots, pushed by the server.
+        add_frame_listener (callback): Call callback(snapshot) for every frame the server
+            pushes, on a thread of the client's own that subscribes with frames().
+        remove_frame_listener (callback): Stop doing that.
+        close (): Disconnect.
+
+    If the connection is lost (e.g. the server has been restarted), the next request
+    reconnects.
+
+    Raises:
+        ReadSmartUPSError: We couldn't get an answer from the server.
+
+    """
+
+    def __init__(self, path=DEFAULT_SOCKET_PATH, timeout=5):
+        super().__init__()
+        self.__path = path
+        self.__timeout = timeout
+        self.__lock = Lock()
+        self.__sock = None
+        self.__rfile = None
+        self.__closing = False
+        self.__listener_lock = Lock()
+        self.__listener_thread = None
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.__timeout)
+        try:
+            sock.connect(self.__path)
+        except OSError:
+            sock.close()
+            raise
+        return sock, sock.makefile('rb')
+
+    def _disconnect(self):
+        if self.__sock is not None:
+            self.__rfile.close()
+            self.__sock.close()
+        self.__sock = self.__rfile = None
+
+    def _request(self, request):
+        """Send one request; return the server's reply. Reconnect once if the connection has gone."""
+        with self.__lock:
+            for attempt in range(2):
+                try:
+                    if self.__sock is None:
+                        self.__sock, self.__rfile = self._connect()
+                    self.__sock.sendall(request.encode() + b'\n')
+                    line = self.__rfile.readline()
+                    if not line:
+                        raise ConnectionResetError("The server hung up")
+                    break
+                except OSError as e:
+                    self._disconnect()
+                    if attempt > 0 or isinstance(e, socket.timeout):
+                        raise ReadSmartUPSError("Unable to ask %s for %s: %s" % (self.__path, request, str(e)))
+        reply = json.loads(line)
+        if 'error' in reply:
+            raise ReadSmartUPSError(reply['error'])
+        return reply
+
+    def snapshot(self):
+        """Return the server's most recent SmartUPSSnapshot, or None if it hasn't got one yet.
+
+        Raises:
+            ReadSmartUPSError: We couldn't get an answer from the server.
+
+        """
+        return snapshot_from_dict(self._request('SNAPSHOT')['snapshot'])
+
+    def stats(self):
+        """Return the server's SmartUPS.stats(). See SmartUPSBaseInterface.stats()."""
+        return self._request('STATS')['stats']
+
+    def time_until(self, batterylevel):
+        """Return the server's estimate of how long the battery will take to get to batterylevel.
+
+        Returns:
+            TimeLeftEstimate: See SmartUPSBaseInterface.time_until(). None if the server can't tell.
+
+        Raises:
+            ReadSmartUPSError: We couldn't get an answer from the server.
+
+        """
+        estimate = self._request('TIME_UNTIL %d' % batterylevel)['time_until']
+        return None if estimate is None else TimeLeftEstimate(*(math.inf if t is None else t for t in estimate))
+
+    def add_frame_listener(self, callback):
+        """Call callback(snapshot) for every frame that the server pushes, starting with the current one.
+
+        The first listener starts a thread that subscribes to every frame (see frames()) and
+        resubscribes if the server goes away; it stops at the first frame after the last
+        listener has been removed, or after close(). If a callback raises an exception, the
+        exception is printed and the other callbacks are called regardless.
+
+        """
+        with self.__listener_lock:
+            super().add_frame_listener(callback)
+            self.__closing = False
+            if self.__listener_thread is None:
+                self.__listener_thread = Thread(target=self._listen, daemon=True)
+                self.__listener_thread.start()
+
+    def _still_listening(self):
+        with self.__listener_lock:
+            if self.__closing or not self._frame_listeners:
+                self.__listener_thread = None
+                return False
+            return True
+
+    def _listen(self):
+        last_sequence = None
+        while self._still_listening():
+            frames = self.frames(everything=True)
+            try:
+                for snapshot in frames:
+                    if not self._still_listening():
+                        return
+                    if snapshot.sequence == last_sequence:
+                        continue  # We've seen it already, before we resubscribed.
+                    last_sequence = snapshot.sequence
+                    for callback in self._frame_listeners:
+                        try:
+                            callback(snapshot)
+                        except Exception as e:
+                            print("%s occurred while running frame listener %r" % (str(e), callback))
+            except ReadSmartUPSError as e:
+                print("%s; I'll subscribe again in a second" % str(e))
+                time.sleep(1)
+            finally:
+                frames.close()
+
+    def frames(self, everything=False):
+        """Yield snapshots as the server pushes them, starting with the current one.
+
+        Each call has a connection of its own, so this doesn't hold up the attributes.
+
+        Args:
+            everything (:obj:`bool`, optional): If True, yield every frame. Otherwise, yield
+                only those in which Vin, batterylevel or hardwareversion has changed.
+
+        Raises:
+            ReadSmartUPSError: We lost contact with the server.
+
+        """
+        try:
+            sock, rfile = self._connect()
+        except OSError as e:
+            raise ReadSmartUPSError("Unable to subscribe to %s: %s" % (self.__path, str(e)))
+        try:
+            sock.settimeout(None)  # Nothing arrives until something changes.
+            sock.sendall(b'SUBSCRIBE ALL\n' if everything else b'SUBSCRIBE\n')
+            for line in rfile:
+                snapshot = snapshot_from_dict(json.loads(line)['snapshot'])
+                if snapshot is not None:
+                    yield snapshot
+            raise ReadSmartUPSError("%s hung up" % self.__path)
+        except OSError as e:
+            raise ReadSmartUPSError("Lost contact with %s: %s" % (self.__path, str(e)))
+        finally:
+            rfile.close()
+            sock.close()
+
+    def close(self):
+        """Disconnect from the server. Frame listeners are called no more."""
+        with self.__listener_lock:
+            self.__closing = True
+        with self.__lock:
+            self._disconnect()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def connected(self):
+        return self.__sock is not None
+
+    @connected.setter
+    def connected(self, value):
+        raise ReadOnlyError("Cannot set connected attribute. That is inappropriate!")
+
+    @property
+    def path(self):
+        return self.__path
+
+    @path.setter
+    def path(self, value):
+        raise ReadOnlyError("Cannot set path attribute. That is inappropriate!")
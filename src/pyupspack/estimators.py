@@ -0,0 +1,431 @@
+#!/usr/bin/python3
+"""Estimators of how long the battery will take to empty or fill.
+
+SmartUPSBaseInterface feeds every frame's battery level to an estimator, along
+with the frame's monotonic timestamp, and asks it how long the battery will take
+to reach a given level. Each estimator keeps an online fit of the rate at which the
+battery level is changing; updating it costs O(1), however long the history.
+
+This module contains TimeLeftEstimate, TimeLeftEstimator (the interface),
+SlidingWindowEstimator (least squares over the last few minutes; the default),
+EWMAEstimator (an exponentially-weighted moving average of the slope), and
+ProfileEstimator, which predicts from a BatteryProfile learned on previous runs and
+saved on disk, so that it has an answer from the very first frame.
+
+Example:
+    Here is how to use a different estimator::
+
+        from pyupspack import SmartUPSInterface
+        from pyupspack.estimators import EWMAEstimator
+        ups = SmartUPSInterface('/dev/ttyUSB0', estimator=EWMAEstimator(halflife=600))
+        ups = SmartUPSInterface('/dev/ttyUSB0', estimator=ProfileEstimator(BatteryProfile('/var/lib/ups.profile')))
+
+.. _Google Python Style Guide:
+   http://google.github.io/styleguide/pyguide.html
+
+"""
+
+from collections import deque, namedtuple
+import math
+import os
+import struct
+
+TimeLeftEstimate = namedtuple('TimeLeftEstimate', ('seconds', 'low', 'high'))
+"""How long the battery will take to reach the target level, and how sure we are.
+
+seconds (float): The best estimate.
+low, high (float): The confidence interval. high is math.inf if the battery might not
+    be heading for the target at all.
+"""
+
+
+class TimeLeftEstimator:
+    """Interface of an estimator of the time left until the battery reaches a certain level.
+
+    Subclasses must supply reset(), update() and rate(); estimate() is worked out from rate().
+
+    Args:
+        z (:obj:`float`, optional): How many standard errors either side of the estimated
+            rate the confidence interval spans. 1.96 gives a 95% interval.
+
+    Methods:
+        reset (): Forget everything; charging has just begun or stopped.
+        update (monotonic, batterylevel, Vout): Add one frame's battery level (and voltage).
+        rate (): Returns (slope, standard error) in percentage points per second, or None.
+        estimate (batterylevel, target): Returns a TimeLeftEstimate, or None.
+
+    """
+
+    def __init__(self, z=1.96):
+        self._z = z
+
+    def reset(self):
+        raise NotImplementedError("Subclasses of TimeLeftEstimator must supply reset()")
+
+    def update(self, monotonic, batterylevel, Vout=None):
+        raise NotImplementedError("Subclasses of TimeLeftEstimator must supply update()")
+
+    def rate(self):
+        raise NotImplementedError("Subclasses of TimeLeftEstimator must supply rate()")
+
+    def estimate(self, batterylevel, target):
+        """Estimate how many seconds the battery will take to get from batterylevel to target.
+
+        Returns:
+            TimeLeftEstimate: The estimate; its seconds are negative if the battery level is
+                moving away from target. None if we can't tell yet (e.g. the battery level
+                hasn't changed since we were reset).
+
+        Args:
+            batterylevel (int): The current battery level.
+            target (int): The battery level of interest, e.g. 100 if we're charging.
+
+        """
+        rate = self.rate()
+        if rate is None or rate[0] == 0:
+            return None
+        slope, stderr = rate
+        distance = target - batterylevel
+        seconds = distance / slope
+        steepest = slope + math.copysign(self._z * stderr, slope)
+        shallowest = slope - math.copysign(self._z * stderr, slope)
+        low = distance / steepest
+        high = distance / shallowest if shallowest * slope > 0 else math.inf
+        return TimeLeftEstimate(seconds, min(low, high), max(low, high))
+
+
+class SlidingWindowEstimator(TimeLeftEstimator):
+    """Least-squares fit of battery level against time, over a sliding window.
+
+    The running sums are updated as each sample arrives and as the oldest sample leaves
+    the window, so each update costs O(1) (amortized). Times are measured from an origin
+    that is moved up to the oldest sample every few windows, when the sums are also added
+    up afresh, so that neither the times nor the rounding errors of all that adding and
+    subtracting grow on a computer that stays up for months. Because the fit uses every frame in
+    the window, rather than the first and last, it isn't thrown by one early step in the
+    battery level, and it follows changes in the load within a window's length.
+
+    Args:
+        window (:obj:`float`, optional): How many seconds of history to fit.
+        z (:obj:`float`, optional): See TimeLeftEstimator.
+
+    """
+
+    def __init__(self, window=900., z=1.96):
+        super().__init__(z=z)
+        self.__window = window
+        self.reset()
+
+    def reset(self):
+        self.__samples = deque()
+        self.__origin = None
+        self.__n = 0
+        self.__sx = self.__sy = self.__sxx = self.__sxy = self.__syy = 0.
+
+    def update(self, monotonic, batterylevel, Vout=None):
+        if self.__origin is None:
+            self.__origin = monotonic
+        x, y = monotonic - self.__origin, float(batterylevel)
+        self.__samples.append((x, y))
+        self.__add(x, y, 1)
+        while x - self.__samples[0][0] > self.__window:
+            self.__add(*self.__samples.popleft(), -1)
+        if x > 4 * self.__window:
+            self.__rebase()
+
+    def __rebase(self):
+        shift = self.__samples[0][0]
+        self.__origin += shift
+        self.__samples = deque((x - shift, y) for x, y in self.__samples)
+        self.__n = 0
+        self.__sx = self.__sy = self.__sxx = self.__sxy = self.__syy = 0.
+        for x, y in self.__samples:
+            self.__add(x, y, 1)
+
+    def __add(self, x, y, sign):
+        self.__n += sign
+        self.__sx += sign * x
+        self.__sy += sign * y
+        self.__sxx += sign * x * x
+        self.__sxy += sign * x * y
+        self.__syy += sign * y * y
+
+    def rate(self):
+        n = self.__n
+        if n < 3:
+            return None
+        sxx = self.__sxx - self.__sx * self.__sx / n
+        if sxx <= 0:
+            return None
+        sxy = self.__sxy - self.__sx * self.__sy / n
+        syy = self.__syy - self.__sy * self.__sy / n
+        slope = sxy / sxx
+        residual_variance = max(0., syy - slope * sxy) / (n - 2)
+        return (slope, math.sqrt(residual_variance / sxx))
+
+
+class EWMAEstimator(TimeLeftEstimator):
+    """Exponentially-weighted moving average of the rate at which the battery level changes.
+
+    Each time the battery level changes, the rate since the previous change is folded into
+    the average, weighted by how long ago the previous update was; the variance of the
+    rate is tracked the same way, for the confidence interval. Each update costs O(1).
+
+    Args:
+        halflife (:obj:`float`, optional): After this many seconds, an old rate counts half
+            as much as a new one.
+        z (:obj:`float`, optional): See TimeLeftEstimator.
+
+    """
+
+    def __init__(self, halflife=300., z=1.96):
+        super().__init__(z=z)
+        self.__halflife = halflife
+        self.reset()
+
+    def reset(self):
+        self.__first_level = None
+        self.__last_change = None  # (monotonic, batterylevel) when the level last changed
+        self.__mean = None
+        self.__variance = 0.
+        self.__noof_rates = 0
+
+    def update(self, monotonic, batterylevel, Vout=None):
+        if self.__last_change is None:
+            # We came in part-way through a percentage point, so its duration means nothing.
+            # Start timing at the first change.
+            if self.__first_level is None:
+                self.__first_level = batterylevel
+            elif batterylevel != self.__first_level:
+                self.__last_change = (monotonic, batterylevel)
+            return
+        when, level = self.__last_change
+        if batterylevel == level or monotonic <= when:
+            return
+        slope = (batterylevel - level) / (monotonic - when)
+        self.__noof_rates += 1
+        if self.__mean is None:
+            self.__mean = slope
+        else:
+            alpha = 1. - 2. ** (-(monotonic - when) / self.__halflife)
+            difference = slope - self.__mean
+            self.__mean += alpha * difference
+            self.__variance = (1. - alpha) * (self.__variance + alpha * difference * difference)
+        self.__last_change = (monotonic, batterylevel)
+
+    def rate(self):
+        if self.__mean is None:
+            return None
+        if self.__noof_rates < 2:
+            return (self.__mean, abs(self.__mean))  # One rate tells us nothing about its spread.
+        return (self.__mean, math.sqrt(self.__variance))
+
+
+class BatteryProfile:
+    """How long this battery takes to discharge/charge by one percentage point, at each level.
+
+    The profile is learned from the steps in battery level that ProfileEstimator sees, and
+    averaged across runs; recent runs count for more, so that it follows the battery as it
+    ages. The average Vout at each level is learned too. The profile is saved in a small
+    binary file (2.4 KiB) and loaded again next time.
+
+    Args:
+        path (:obj:`str`, optional): Where to load the profile from and save it to. If the
+            file doesn't exist (or isn't a profile), we start from scratch.
+        learning_rate (:obj:`float`, optional): The least weight a new observation gets.
+
+    Methods:
+        seconds_at (direction, level): Mean seconds spent at that level, or None.
+        seconds_between (direction, level, target): Mean seconds to get from level to target.
+        Vout_at (direction, level): Mean Vout at that level, or None.
+        learn_step (direction, level, seconds): Note how long we spent at level.
+        learn_Vout (direction, level, Vout): Note the Vout at level.
+        save (): Write the profile to path, atomically.
+
+    """
+
+    DISCHARGING = 0
+    CHARGING = 1
+    MAGIC = b'UPSPROF1'
+    _entry = struct.Struct('<fIf')  # mean seconds at this level, noof observations, mean Vout
+
+    def __init__(self, path=None, learning_rate=.2):
+        self.__path = path
+        self.__learning_rate = learning_rate
+        self.__seconds = [[0.] * 101, [0.] * 101]
+        self.__counts = [[0] * 101, [0] * 101]
+        self.__Vout = [[0.] * 101, [0.] * 101]
+        self.__dirty = False
+        if path is not None and os.path.exists(path):
+            try:
+                self._load(path)
+            except (OSError, ValueError, struct.error) as e:
+                print("Ignoring battery profile %s: %s" % (path, str(e)))
+
+    def _load(self, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        if data[:len(self.MAGIC)] != self.MAGIC or len(data) != len(self.MAGIC) + 2 * 101 * self._entry.size:
+            raise ValueError("not a battery profile")
+        for i, (seconds, count, Vout) in enumerate(self._entry.iter_unpack(data[len(self.MAGIC):])):
+            direction, level = divmod(i, 101)
+            self.__seconds[direction][level] = seconds
+            self.__counts[direction][level] = count
+            self.__Vout[direction][level] = Vout
+
+    def save(self):
+        """Write the profile to its file (if it has one and has changed), atomically."""
+        if self.__path is None or not self.__dirty:
+            return
+        data = self.MAGIC + b''.join(self._entry.pack(self.__seconds[direction][level], self.__counts[direction][level],
+                                                      self.__Vout[direction][level])
+                                     for direction in (self.DISCHARGING, self.CHARGING) for level in range(101))
+        temporary_path = self.__path + '.tmp'
+        with open(temporary_path, 'wb') as f:
+            f.write(data)
+        os.replace(temporary_path, self.__path)
+        self.__dirty = False
+
+    def learn_step(self, direction, level, seconds):
+        count = self.__counts[direction][level]
+        weight = max(1. / (count + 1), self.__learning_rate)
+        self.__seconds[direction][level] += weight * (seconds - self.__seconds[direction][level])
+        self.__counts[direction][level] = count + 1
+        self.__dirty = True
+
+    def learn_Vout(self, direction, level, Vout):
+        self.__Vout[direction][level] += (Vout if self.__Vout[direction][level] == 0. else
+                                          self.__learning_rate * (Vout - self.__Vout[direction][level]))
+        self.__dirty = True
+
+    def seconds_at(self, direction, level):
+        return self.__seconds[direction][level] if self.__counts[direction][level] else None
+
+    def Vout_at(self, direction, level):
+        return self.__Vout[direction][level] or None
+
+    def seconds_between(self, direction, level, target):
+        """Return how many seconds the battery usually takes to get from level to target.
+
+        Levels we have never seen are assumed to take as long as the average level we have.
+
+        Returns:
+            float: The seconds, or None if we haven't learned anything about this direction.
+
+        """
+        counts, seconds = self.__counts[direction], self.__seconds[direction]
+        known = [seconds[i] for i in range(101) if counts[i]]
+        if not known:
+            return None
+        typical = sum(known) / len(known)
+        levels = range(target + 1, level + 1) if direction == self.DISCHARGING else range(level, target)
+        return sum(seconds[i] if counts[i] else typical for i in levels)
+
+    @property
+    def path(self):
+        return self.__path
+
+
+class ProfileEstimator(TimeLeftEstimator):
+    """Predict the time left from a BatteryProfile; refine the prediction as the battery level changes.
+
+    The profile says how long the battery usually takes to get from here to the target, so
+    there is an estimate from the first frame after charging/discharging begins. As the
+    battery level steps up or down, the time each step took is compared with what the
+    profile expected, and the prediction is scaled accordingly (e.g. if the load is heavier
+    than usual). The steps are also learned by the profile, which is saved every few
+    steps and whenever charging/discharging begins or ends.
+
+    If the profile knows nothing yet, or the battery level is going the wrong way, the
+    live estimator is used instead.
+
+    Args:
+        profile (BatteryProfile): What we learned on previous runs.
+        live (:obj:`TimeLeftEstimator`, optional): Default is a SlidingWindowEstimator.
+        save_every (:obj:`int`, optional): Save the profile after this many steps.
+        z (:obj:`float`, optional): See TimeLeftEstimator.
+
+    """
+
+    def __init__(self, profile, live=None, save_every=10, z=1.96):
+        super().__init__(z=z)
+        self.__profile = profile
+        self.__live = SlidingWindowEstimator(z=z) if live is None else live
+        self.__save_every = save_every
+        self.__steps_since_save = 0
+        self.reset()
+
+    def reset(self):
+        self.__live.reset()
+        self.__first_level = None
+        self.__last_change = None  # (monotonic, batterylevel) when the level last changed
+        self.__latest = None
+        self.__noof_steps = 0
+        self.__actual_seconds = self.__expected_seconds = 0.
+        self._save_profile()
+
+    def _save_profile(self):
+        try:
+            self.__profile.save()
+        except OSError as e:
+            print("Unable to save battery profile to %s: %s" % (self.__profile.path, str(e)))
+        self.__steps_since_save = 0
+
+    def update(self, monotonic, batterylevel, Vout=None):
+        self.__live.update(monotonic, batterylevel, Vout)
+        self.__latest = monotonic
+        if self.__last_change is None:
+            # We came in part-way through a percentage point, so don't learn how long it took.
+            if self.__first_level is None:
+                self.__first_level = batterylevel
+            elif batterylevel != self.__first_level:
+                self.__last_change = (monotonic, batterylevel)
+        else:
+            when, level = self.__last_change
+            if batterylevel != level:
+                direction = BatteryProfile.DISCHARGING if batterylevel < level else BatteryProfile.CHARGING
+                levels = range(batterylevel + 1, level + 1) if direction == BatteryProfile.DISCHARGING else range(level, batterylevel)
+                seconds = (monotonic - when) / len(levels)
+                for i in levels:
+                    expected = self.__profile.seconds_at(direction, i)
+                    if expected is not None:
+                        self.__actual_seconds += seconds
+                        self.__expected_seconds += expected
+                    self.__profile.learn_step(direction, i, seconds)
+                self.__noof_steps += 1
+                self.__steps_since_save += 1
+                self.__last_change = (monotonic, batterylevel)
+                if self.__steps_since_save >= self.__save_every:
+                    self._save_profile()
+        if Vout is not None and self.__last_change is not None:
+            # Only the level's direction of travel tells us which curve the Vout belongs on.
+            rate = self.__live.rate()
+            if rate is not None and rate[0]:
+                self.__profile.learn_Vout(BatteryProfile.DISCHARGING if rate[0] < 0 else BatteryProfile.CHARGING,
+                                          batterylevel, Vout)
+
+    def rate(self):
+        return self.__live.rate()
+
+    def estimate(self, batterylevel, target):
+        if batterylevel == target:
+            return TimeLeftEstimate(0., 0., 0.)
+        direction = BatteryProfile.DISCHARGING if target < batterylevel else BatteryProfile.CHARGING
+        rate = self.__live.rate()
+        if rate is not None and rate[0] * (target - batterylevel) < 0:
+            return super().estimate(batterylevel, target)  # The battery level is going the wrong way.
+        seconds = self.__profile.seconds_between(direction, batterylevel, target)
+        if seconds is None:
+            return super().estimate(batterylevel, target)
+        if self.__last_change is not None and self.__latest is not None:
+            # We have been at this level for a while already.
+            seconds -= min(self.__latest - self.__last_change[0],
+                           self.__profile.seconds_at(direction, batterylevel) or 0.)
+        if self.__expected_seconds > 0:
+            seconds *= self.__actual_seconds / self.__expected_seconds
+        uncertainty = .5 / math.sqrt(1 + self.__noof_steps)
+        return TimeLeftEstimate(seconds, seconds * (1 - uncertainty), seconds * (1 + uncertainty))
+
+    @property
+    def profile(self):
+        return self.__profile
@@ -220,3 +220,27 @@ class CachingError(Error):
         super().__init__(message)
         self.__doc__ = 'Class for all caching errors'
 
+
+
+class MalformedFrameError(ReadSmartUPSError, ValueError):
+    """Raised if a frame from the circuit board cannot be parsed.
+
+    The UPSPack's frames look like '$ SmartUPS V3.2P,Vin GOOD,BATCAP 87,Vout 5123 $'.
+    If one is garbled (say, because of line noise, or because we started listening
+    halfway through it), pyupspack.parser raises this. It is also a ValueError, so
+    code that used to catch the ValueError of int('garbage') still catches it.
+
+    Args:
+        msg (str): Human readable string describing the exception.
+        frame (:obj:`str`, optional): The offending frame.
+
+    Attributes:
+        msg (str): Human readable string describing the exception.
+        frame (str): The offending frame.
+
+    """
+
+    def __init__(self, message, frame=None):
+        super().__init__(message)
+        self.frame = frame
+        self.__doc__ = 'Class for all malformed-frame errors'
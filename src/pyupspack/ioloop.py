@@ -0,0 +1,294 @@
+#!/usr/bin/python3
+"""One thread and one selector, shared by everything that would otherwise need a thread of its own.
+
+IOLoop is a minimal event loop in the manner of asyncio's, for code that isn't
+written for asyncio: callbacks, not coroutines. It watches file descriptors
+(add_reader) and runs timed callbacks (call_later), all on its own thread. Any
+thread may ask it to do something (call_soon); the loop is woken through a
+socketpair, so it never polls.
+
+SerialFrameReader uses it to read any number of serial ports from one thread,
+which is how SmartUPSRegistry watches several UPSPacks at once. By default,
+SmartUPSInterface, SelfCachingCall and SmartUPSServer all share one loop,
+default_loop(), so a process that watches a UPSPack has one thread doing so, and
+that thread sleeps until a frame arrives or a timer is due.
+
+Example:
+    >>> loop = IOLoop()
+    >>> ups1 = SmartUPSInterface('/dev/ttyUSB0', io_loop=loop)
+    >>> ups2 = SmartUPSInterface('/dev/ttyUSB1', io_loop=loop)
+    >>> handle = loop.call_later(5, print, 'five seconds later')
+
+.. _Google Python Style Guide:
+   http://google.github.io/styleguide/pyguide.html
+
+"""
+
+from collections import deque
+import heapq
+import itertools
+import selectors
+import socket
+from threading import Event, Lock, Thread, get_ident
+import time
+
+
+class TimerHandle:
+    """A callback scheduled by IOLoop.call_soon() or IOLoop.call_later(). cancel() it to stop it running."""
+
+    __slots__ = ('when', 'callback', 'args', 'cancelled')
+
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class IOLoop:
+    """Background thread that runs callbacks when file descriptors become readable, or at given times.
+
+    Every callback runs on the loop's thread, one at a time, so callbacks should be quick
+    and needn't lock against each other. If a callback raises an exception, the exception
+    is printed and the loop carries on.
+
+    Args:
+        name (:obj:`str`, optional): The thread's name.
+
+    Methods:
+        add_reader (fd, callback, *args): Call callback(*args) whenever fd is readable.
+        remove_reader (fd): Stop doing that.
+        add_writer (fd, callback, *args): Call callback(*args) whenever fd is writable.
+        remove_writer (fd): Stop doing that.
+        call_soon (callback, *args): Call callback(*args) on the loop's thread, soon.
+        call_later (delay, callback, *args): Call callback(*args) in delay seconds.
+        call_and_wait (callback, *args): Call callback(*args) on the loop's thread; return its result.
+        in_loop_thread (): True if the caller is the loop's thread.
+        close (): Stop the loop and wait for its thread.
+
+    Attributes:
+        noof_readers (int): How many file descriptors are being watched.
+        closed (bool): True once close() has been called.
+
+    """
+
+    def __init__(self, name='pyupspack-io'):
+        self.__selector = selectors.DefaultSelector()
+        self.__wakeup_r, self.__wakeup_w = socket.socketpair()
+        self.__wakeup_r.setblocking(False)
+        self.__wakeup_w.setblocking(False)
+        self.__selector.register(self.__wakeup_r, selectors.EVENT_READ, None)
+        self.__lock = Lock()
+        self.__ready = deque()  # TimerHandles to run as soon as possible; appended to by any thread
+        self.__timers = []  # heap of (when, sequence, TimerHandle); the loop's thread only
+        self.__sequence = itertools.count()
+        self.__time_to_join = False
+        self.__closed = False  # set, under the lock, by close(); nothing is queued after that
+        self.__thread = Thread(target=self._run, name=name, daemon=True)
+        self.__thread.start()
+
+    def in_loop_thread(self):
+        return get_ident() == self.__thread.ident
+
+    def _wake(self):
+        try:
+            self.__wakeup_w.send(b'\0')
+        except (BlockingIOError, OSError):
+            pass  # Already awake, or closed.
+
+    def call_soon(self, callback, *args):
+        """Call callback(*args) on the loop's thread as soon as possible. Safe to call from any thread.
+
+        Returns:
+            TimerHandle: cancel() it to stop the call.
+
+        """
+        handle = TimerHandle(time.monotonic(), callback, args)
+        if self._enqueue(handle) and not self.in_loop_thread():
+            self._wake()
+        return handle
+
+    def _enqueue(self, handle):
+        # Return False (and queue nothing) if the loop has been closed.
+        with self.__lock:
+            if self.__closed:
+                return False
+            self.__ready.append(handle)
+            return True
+
+    def call_later(self, delay, callback, *args):
+        """Call callback(*args) on the loop's thread in delay seconds. Safe to call from any thread.
+
+        Returns:
+            TimerHandle: cancel() it to stop the call.
+
+        """
+        handle = TimerHandle(time.monotonic() + delay, callback, args)
+        if self.in_loop_thread():
+            heapq.heappush(self.__timers, (handle.when, next(self.__sequence), handle))
+        else:
+            self.call_soon(self._schedule, handle)
+        return handle
+
+    def call_and_wait(self, callback, *args):
+        """Call callback(*args) on the loop's thread, wait for it, and return what it returned.
+
+        If it raised an exception, the exception is raised here instead. If the loop has been
+        closed, callback(*args) is called on this thread instead, since no other will call it.
+
+        """
+        if self.in_loop_thread():
+            return callback(*args)
+        done = Event()
+        outcome = []
+
+        def _call():
+            try:
+                outcome.append((callback(*args), None))
+            except BaseException as e:
+                outcome.append((None, e))
+            finally:
+                done.set()
+        if not self._enqueue(TimerHandle(time.monotonic(), _call, ())):
+            return callback(*args)
+        self._wake()
+        done.wait()
+        result, error = outcome[0]
+        if error is not None:
+            raise error
+        return result
+
+    def _schedule(self, handle):
+        heapq.heappush(self.__timers, (handle.when, next(self.__sequence), handle))
+
+    def _in_loop_thread_or_soon(self, callback, *args):
+        if self.in_loop_thread():
+            callback(*args)
+        else:
+            self.call_soon(callback, *args)
+
+    def add_reader(self, fd, callback, *args):
+        """Call callback(*args) on the loop's thread whenever fd is readable. Safe to call from any thread."""
+        self._in_loop_thread_or_soon(self._watch, fd, 0, (callback, args))
+
+    def remove_reader(self, fd):
+        """Stop watching fd for reading. Safe to call from any thread; call it before closing fd."""
+        self._in_loop_thread_or_soon(self._watch, fd, 0, None)
+
+    def add_writer(self, fd, callback, *args):
+        """Call callback(*args) on the loop's thread whenever fd is writable. Safe to call from any thread."""
+        self._in_loop_thread_or_soon(self._watch, fd, 1, (callback, args))
+
+    def remove_writer(self, fd):
+        """Stop watching fd for writing. Safe to call from any thread; call it before closing fd."""
+        self._in_loop_thread_or_soon(self._watch, fd, 1, None)
+
+    def _watch(self, fd, which, callback_and_args):
+        # Each registration's data is (reader, writer); each of those is (callback, args) or None.
+        if self.__closed:
+            return  # The selector is closed, or about to be: there is nothing to watch with.
+        try:
+            handlers = list(self.__selector.get_key(fd).data)
+        except (KeyError, ValueError):
+            handlers = [None, None]
+        handlers[which] = callback_and_args
+        events = (selectors.EVENT_READ if handlers[0] else 0) | (selectors.EVENT_WRITE if handlers[1] else 0)
+        try:
+            if not events:
+                self.__selector.unregister(fd)
+            elif fd in self.__selector.get_map():
+                self.__selector.modify(fd, events, tuple(handlers))
+            else:
+                self.__selector.register(fd, events, tuple(handlers))
+        except (KeyError, ValueError, OSError):
+            pass  # fd has been closed already.
+
+    def _run_callback(self, callback, args):
+        try:
+            callback(*args)
+        except Exception as e:
+            print("%s occurred while running %r in the I/O loop" % (str(e), callback))
+
+    def _run(self):
+        while not self.__time_to_join:
+            with self.__lock:
+                ready, self.__ready = self.__ready, deque()
+            for handle in ready:
+                if not handle.cancelled:
+                    self._run_callback(handle.callback, handle.args)
+            if self.__ready:
+                timeout = 0
+            elif self.__timers:
+                timeout = max(0, self.__timers[0][0] - time.monotonic())
+            else:
+                timeout = None
+            for key, events in self.__selector.select(timeout):
+                if key.data is None:
+                    try:
+                        while self.__wakeup_r.recv(4096):
+                            pass
+                    except (BlockingIOError, OSError):
+                        pass
+                    continue
+                reader, writer = key.data
+                if events & selectors.EVENT_READ and reader is not None:
+                    self._run_callback(*reader)
+                if events & selectors.EVENT_WRITE and writer is not None and key.fd in self.__selector.get_map():
+                    self._run_callback(*writer)
+            now = time.monotonic()
+            while self.__timers and self.__timers[0][0] <= now:
+                handle = heapq.heappop(self.__timers)[2]
+                if not handle.cancelled:
+                    self._run_callback(handle.callback, handle.args)
+
+    def close(self):
+        """Stop the loop and wait for its thread to finish. File descriptors are left open.
+
+        Callbacks that were queued with call_soon() but hadn't been run yet are run on the
+        calling thread, so that nobody is left waiting in call_and_wait(). After this,
+        call_soon() and call_later() do nothing, and call_and_wait() calls its callback
+        on the calling thread.
+
+        """
+        with self.__lock:
+            if self.__closed:
+                return
+            self.__closed = True
+        self.__time_to_join = True
+        self._wake()
+        if not self.in_loop_thread():
+            self.__thread.join()
+        self.__selector.close()
+        self.__wakeup_r.close()
+        self.__wakeup_w.close()
+        with self.__lock:
+            ready, self.__ready = self.__ready, deque()
+        for handle in ready:
+            if not handle.cancelled:
+                self._run_callback(handle.callback, handle.args)
+
+    @property
+    def closed(self):
+        return self.__closed
+
+    @property
+    def noof_readers(self):
+        if self.__closed:
+            return 0
+        return sum(1 for key in self.__selector.get_map().values() if key.data is not None and key.data[0] is not None)
+
+
+_default_loop = None
+_default_loop_lock = Lock()
+
+
+def default_loop():
+    """Return the IOLoop that everything shares unless told otherwise, starting it if need be."""
+    global _default_loop
+    with _default_loop_lock:
+        if _default_loop is None:
+            _default_loop = IOLoop()
+        return _default_loop
@@ -0,0 +1,106 @@
+#!/usr/bin/python3
+"""Counters and histograms, cheap enough to leave switched on.
+
+SmartUPSBaseInterface owns one Metrics instance, which the serial reader (and
+whoever else handles frames) updates as it goes; SmartUPS.stats() returns a copy of
+it, together with a few gauges (e.g. the age of the most recent frame). They say
+whether trouble is coming from the serial port, the frame processing, or waiting
+for locks.
+
+Updates happen about once per frame, not once per attribute read, and each takes
+a lock for well under a microsecond.
+
+Example:
+    >>> stats = SmartUPS.stats()
+    >>> stats['counters']['parse_errors'], stats['gauges']['frame_age_seconds']
+    (0, 0.41)
+    >>> stats['histograms']['serial_read_seconds']['buckets']
+    {'1e-06': 0, '1e-05': 3, ..., '+Inf': 0}
+
+.. _Google Python Style Guide:
+   http://google.github.io/styleguide/pyguide.html
+
+"""
+
+from bisect import bisect_left
+from collections import Counter
+from threading import Lock
+
+
+class Histogram:
+    """Distribution of durations (or anything else), in fixed, logarithmically-spaced buckets.
+
+    Not thread-safe by itself; Metrics looks after that.
+
+    Args:
+        bounds (:obj:`tuple`, optional): Upper bounds of the buckets, in increasing order.
+            Values above the last bound go in the '+Inf' bucket.
+
+    """
+
+    DEFAULT_BOUNDS = (1e-6, 1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1., 10.)
+
+    def __init__(self, bounds=DEFAULT_BOUNDS):
+        self.__bounds = tuple(bounds)
+        self.__buckets = [0] * (len(self.__bounds) + 1)
+        self.__count = 0
+        self.__sum = 0.
+        self.__max = None
+
+    def observe(self, value):
+        self.__buckets[bisect_left(self.__bounds, value)] += 1
+        self.__count += 1
+        self.__sum += value
+        if self.__max is None or value > self.__max:
+            self.__max = value
+
+    def as_dict(self):
+        buckets = {repr(bound): n for bound, n in zip(self.__bounds, self.__buckets)}
+        buckets['+Inf'] = self.__buckets[-1]
+        return {'count': self.__count, 'sum': self.__sum, 'max': self.__max,
+                'mean': self.__sum / self.__count if self.__count else None, 'buckets': buckets}
+
+
+class Metrics:
+    """A set of named counters and histograms, updated from any thread.
+
+    e.g.
+        >>> metrics = Metrics()
+        >>> metrics.increment('reads')
+        >>> metrics.observe('serial_read_seconds', .0012)
+        >>> metrics.stats()['counters']
+        {'reads': 1}
+
+    Methods:
+        increment (name, n): Add n (default 1) to a counter.
+        observe (name, value): Add a value to a histogram.
+        stats (): Returns a copy of everything, as a dictionary.
+        reset (): Zero everything.
+
+    """
+
+    def __init__(self):
+        self.__lock = Lock()
+        self.reset()
+
+    def increment(self, name, n=1):
+        with self.__lock:
+            self.__counters[name] += n
+
+    def observe(self, name, value):
+        with self.__lock:
+            histogram = self.__histograms.get(name)
+            if histogram is None:
+                histogram = self.__histograms[name] = Histogram()
+            histogram.observe(value)
+
+    def stats(self):
+        """Return {'counters': {name: int}, 'histograms': {name: {count, sum, max, mean, buckets}}}."""
+        with self.__lock:
+            return {'counters': dict(self.__counters),
+                    'histograms': {name: histogram.as_dict() for name, histogram in self.__histograms.items()}}
+
+    def reset(self):
+        with self.__lock:
+            self.__counters = Counter()
+            self.__histograms = {}
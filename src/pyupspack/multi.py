@@ -0,0 +1,238 @@
+#!/usr/bin/python3
+"""Watch several UPSPacks at once.
+
+SmartUPSRegistry keeps one SmartUPSInterface per UPSPack, keyed by the identity of
+its USB/TTL converter (see utilities.device_identity()): its USB serial number,
+or failing that the USB port it is plugged into. Unlike /dev/ttyUSB0, that
+identity doesn't change if the converters are enumerated in a different order.
+After a hotplug, each device is found again by its identity.
+
+All of the serial ports are read by one IOLoop thread, however many there are.
+
+The registry also answers questions about the lot: is any of them on battery
+(any_discharging)? How long until the first of them runs out (time_until(), which
+makes a registry acceptable to ShutdownOrchestrator)? And run() feeds each device's
+frames to a PolicyEngine of its own.
+
+Example:
+    >>> registry = SmartUPSRegistry()
+    >>> registry.discover()
+    ['serial:A50285BI', 'usb:1-1.3']
+    >>> registry['usb:1-1.3'].batterylevel, registry.min_batterylevel, registry.any_discharging
+    (87, 64, False)
+    >>> registry.run({key: PolicyEngine() for key in registry})
+
+.. _Google Python Style Guide:
+   http://google.github.io/styleguide/pyguide.html
+
+"""
+
+from functools import partial
+import queue
+from threading import Lock
+
+from pyupspack import SmartUPSInterface
+from pyupspack.exceptions import ReadOnlyError
+from pyupspack.ioloop import default_loop
+from pyupspack.utilities import device_identity, find_serial_device, identify_serial_devices
+
+
+class SmartUPSRegistry:
+    """Several SmartUPSInterfaces, keyed by device identity, read by one I/O thread.
+
+    Args:
+        io_loop (:obj:`IOLoop`, optional): The loop that reads the serial ports. Default is
+            the shared pyupspack.ioloop.default_loop().
+        **kwargs: Passed to every SmartUPSInterface, e.g. stale_after or recorder.
+
+    Attributes:
+        any_discharging (bool): True if any of the UPSPacks is running on its battery.
+        all_discharging (bool): True if all of them are (and there is at least one).
+        min_batterylevel (int): The lowest battery level, or None if nobody knows.
+        min_timeleft (int): Of the UPSPacks that are discharging, the shortest timeleft,
+            or None.
+        io_loop (IOLoop): The loop that reads the serial ports.
+
+    Methods:
+        add (key, serial_device): Start watching a UPSPack.
+        discover (vid, pid): Start watching every UPSPack that isn't watched yet.
+        remove (key): Stop watching one.
+        snapshots (): Returns {key: SmartUPSSnapshot}.
+        time_until (batterylevel): Shortest estimated time for any discharging UPSPack to get there.
+        run (engines, callback, interval): Feed each UPSPack's frames to its own PolicyEngine.
+        close (): Stop watching all of them.
+
+    It also behaves like a read-only dictionary of key -> SmartUPSInterface.
+
+    """
+
+    def __init__(self, io_loop=None, **kwargs):
+        self.__io_loop = default_loop() if io_loop is None else io_loop
+        self.__kwargs = kwargs
+        self.__devices = {}
+        self.__lock = Lock()
+
+    def add(self, key, serial_device=None, **kwargs):
+        """Start watching a UPSPack.
+
+        Args:
+            key (str): What to call it. If serial_device isn't supplied, this must be a device
+                identity (see utilities.device_identity()), by which it is found and re-found.
+            serial_device (:obj:`str`, optional): e.g. '/dev/ttyUSB1'. If supplied, the UPSPack
+                is expected to come back with the same name after a hotplug.
+            **kwargs: Passed to this UPSPack's SmartUPSInterface, overriding the registry's.
+
+        Returns:
+            SmartUPSInterface: The new instance.
+
+        Raises:
+            ValueError: There is one called key already.
+            SmartUPSInitializationError: Cannot find the device.
+
+        """
+        with self.__lock:
+            if key in self.__devices:
+                raise ValueError("I am already watching a UPSPack called %s" % key)
+            kwargs = dict(self.__kwargs, **kwargs)
+            kwargs.setdefault('pause_duration_between_uncached_reads', 2)
+            if serial_device is None:
+                serial_device = find_serial_device(key)
+                kwargs.setdefault('device_finder', partial(find_serial_device, key))
+            ups = SmartUPSInterface(serial_device, io_loop=self.__io_loop, **kwargs)
+            self.__devices[key] = ups
+            return ups
+
+    def discover(self, vid=None, pid=None):
+        """Start watching every USB/TTL converter that matches vid and pid and isn't watched yet.
+
+        Args:
+            vid, pid: See utilities.identify_serial_device().
+
+        Returns:
+            list: The keys (device identities) of the newly-watched UPSPacks.
+
+        """
+        added = []
+        for info in identify_serial_devices(vid, pid):
+            key = device_identity(info)
+            if key not in self.__devices:
+                self.add(key, device_finder=partial(find_serial_device, key))
+                added.append(key)
+        return added
+
+    def remove(self, key):
+        """Stop watching a UPSPack; close its serial port."""
+        with self.__lock:
+            ups = self.__devices.pop(key)
+        ups.close()
+
+    def __getitem__(self, key):
+        return self.__devices[key]
+
+    def __contains__(self, key):
+        return key in self.__devices
+
+    def __iter__(self):
+        return iter(list(self.__devices))
+
+    def __len__(self):
+        return len(self.__devices)
+
+    def keys(self):
+        return list(self.__devices)
+
+    def items(self):
+        return list(self.__devices.items())
+
+    def snapshots(self):
+        """Return {key: SmartUPSSnapshot, or None if that UPSPack hasn't said anything yet}."""
+        return {key: ups.snapshot_or_None() for key, ups in self.items()}
+
+    def _known(self):
+        return [snapshot for snapshot in self.snapshots().values() if snapshot is not None]
+
+    @property
+    def any_discharging(self):
+        return any(snapshot.discharging for snapshot in self._known())
+
+    @any_discharging.setter
+    def any_discharging(self, value):
+        raise ReadOnlyError("Cannot set any_discharging attribute. That is inappropriate!")
+
+    @property
+    def all_discharging(self):
+        snapshots = self.snapshots().values()
+        return bool(snapshots) and all(snapshot is not None and snapshot.discharging for snapshot in snapshots)
+
+    @all_discharging.setter
+    def all_discharging(self, value):
+        raise ReadOnlyError("Cannot set all_discharging attribute. That is inappropriate!")
+
+    @property
+    def min_batterylevel(self):
+        levels = [snapshot.batterylevel for snapshot in self._known() if snapshot.batterylevel is not None]
+        return min(levels) if levels else None
+
+    @min_batterylevel.setter
+    def min_batterylevel(self, value):
+        raise ReadOnlyError("Cannot set min_batterylevel attribute. That is inappropriate!")
+
+    @property
+    def min_timeleft(self):
+        timelefts = [snapshot.timeleft for snapshot in self._known()
+                     if snapshot.discharging and snapshot.timeleft is not None]
+        return min(timelefts) if timelefts else None
+
+    @min_timeleft.setter
+    def min_timeleft(self, value):
+        raise ReadOnlyError("Cannot set min_timeleft attribute. That is inappropriate!")
+
+    def time_until(self, batterylevel):
+        """Of the UPSPacks that are discharging, return the estimate that is soonest, pessimistically.
+
+        Returns:
+            TimeLeftEstimate: The one with the smallest low bound. None if none of them can tell.
+
+        """
+        estimates = [ups.time_until(batterylevel) for ups in self.__devices.values() if ups.discharging]
+        estimates = [estimate for estimate in estimates if estimate is not None and estimate.seconds >= 0]
+        return min(estimates, key=lambda estimate: estimate.low) if estimates else None
+
+    def run(self, engines, callback=None, interval=None):
+        """Feed each UPSPack's frames to its own PolicyEngine, as they arrive, on the calling thread. Never returns.
+
+        Args:
+            engines (dict): {key: PolicyEngine}. UPSPacks without an engine are ignored.
+            callback (:obj:`function`, optional): Called as callback(key, snapshot, events) after
+                each frame, and as callback(None, None, []) if interval seconds pass without one.
+            interval (:obj:`float`, optional): See callback.
+
+        """
+        frames = queue.Queue()
+        listeners = {key: partial(lambda key, snapshot: frames.put((key, snapshot)), key) for key in engines}
+        for key, listener in listeners.items():
+            self.__devices[key].add_frame_listener(listener)
+        try:
+            while True:
+                try:
+                    key, snapshot = frames.get(timeout=interval)
+                except queue.Empty:
+                    if callback is not None:
+                        callback(None, None, [])
+                    continue
+                events = engines[key].feed(snapshot)
+                if callback is not None:
+                    callback(key, snapshot, events)
+        finally:
+            for key, listener in listeners.items():
+                if key in self.__devices:
+                    self.__devices[key].remove_frame_listener(listener)
+
+    def close(self):
+        """Stop watching every UPSPack."""
+        for key in self.keys():
+            self.remove(key)
+
+    @property
+    def io_loop(self):
+        return self.__io_loop
@@ -0,0 +1,237 @@
+#!/usr/bin/python3
+"""Tell the logged-in users what the UPSPack is doing, without holding anybody up.
+
+send_global_message() runs wall, then a shell that tries xmessage on displays 0 to
+3 for every user, and waits for all of it. NotificationDispatcher does the same
+job in the background. send() just puts the message in a queue and returns. A
+dispatcher thread takes it from there: it wall()s the message once and hands one
+xmessage per graphical session to a small pool of worker threads.
+
+The sessions come from utmp (who's logged in, on which display), read with
+struct rather than by running 'users', and only read again when utmp changes.
+
+Identical messages are coalesced: a message that is already waiting to be sent
+isn't queued twice, and one that was sent less than min_interval seconds ago is
+dropped, unless it is urgent. If messages pile up faster than they can be sent,
+the oldest non-urgent ones are dropped.
+
+Example:
+    >>> dispatcher = NotificationDispatcher()
+    >>> dispatcher.send("Discharging. Battery at 87%.")
+    >>> dispatcher.send("SHUTTING DOWN", urgent=True)
+    >>> dispatcher.close(timeout=5)
+
+.. _Google Python Style Guide:
+   http://google.github.io/styleguide/pyguide.html
+
+"""
+
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+import shlex
+import struct
+import subprocess
+from threading import Condition, Lock, Thread
+import time
+
+from pyupspack.utilities import modification_time_of
+
+UTMP_FILE = '/var/run/utmp'
+_USER_PROCESS = 7
+_utmp_record = struct.Struct('<hxxi32s4s32s256shhi8x16x20x')  # struct utmp, as glibc lays it out on Linux
+
+Session = namedtuple('Session', ('user', 'line', 'display'))
+"""One login session, from utmp.
+
+user (str): e.g. 'pi'. line (str): e.g. 'tty1' or 'pts/0'.
+display (str): X display, e.g. ':0', or None if it isn't a graphical session.
+"""
+
+
+def _text(value):
+    return value.split(b'\0', 1)[0].decode(errors='replace')
+
+
+def read_sessions(path=UTMP_FILE):
+    """Return the sessions in utmp that belong to logged-in users.
+
+    Args:
+        path (:obj:`str`, optional): The utmp file.
+
+    Returns:
+        list: Session tuples. Empty if there is no utmp file.
+
+    """
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return []
+    sessions = []
+    for offset in range(0, len(data) - _utmp_record.size + 1, _utmp_record.size):
+        ut_type, _, line, _, user, host, _, _, _ = _utmp_record.unpack_from(data, offset)
+        if ut_type != _USER_PROCESS or not user.strip(b'\0'):
+            continue
+        line, host = _text(line), _text(host)
+        display = line if line.startswith(':') else host if host.startswith(':') else None
+        sessions.append(Session(_text(user), line, display))
+    return sessions
+
+
+class NotificationDispatcher:
+    """Send messages to every logged-in user, in the background, coalescing repeats.
+
+    Args:
+        max_workers (:obj:`int`, optional): How many xmessages may be started at once.
+        min_interval (:obj:`float`, optional): Don't send the same message again within
+            this many seconds, unless it is urgent.
+        max_pending (:obj:`int`, optional): How many messages may wait to be sent.
+        utmp_path (:obj:`str`, optional): Where to find out who is logged in.
+        xmessage_timeout (:obj:`int`, optional): How long the xmessage windows stay up.
+
+    Attributes:
+        sent (int): How many messages have been sent.
+        dropped (int): How many were coalesced, rate-limited or crowded out.
+
+    Methods:
+        send (message, urgent): Queue a message; return at once.
+        sessions (): The sessions that messages go to.
+        close (timeout): Send whatever is waiting (for up to timeout seconds); stop.
+
+    """
+
+    def __init__(self, max_workers=4, min_interval=60, max_pending=8, utmp_path=UTMP_FILE, xmessage_timeout=10):
+        self.__min_interval = min_interval
+        self.__max_pending = max_pending
+        self.__utmp_path = utmp_path
+        self.__xmessage_timeout = xmessage_timeout
+        self.__pending = OrderedDict()  # message -> urgent
+        self.__last_sent = {}  # message -> time.monotonic() when it was sent
+        self.__condition = Condition(Lock())
+        self.__closing = False
+        self.__sent = 0
+        self.__dropped = 0
+        self.__sessions = []
+        self.__utmp_mtime = None
+        self.__pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='notify')
+        self.__deliveries = set()  # futures of the wall and xmessage commands that haven't finished
+        self.__thread = Thread(target=self._dispatch, daemon=True)
+        self.__thread.start()
+
+    def send(self, message, urgent=False):
+        """Queue message for all users; return at once.
+
+        Args:
+            message (str): What to tell them.
+            urgent (:obj:`bool`, optional): If True, send it even if it was sent recently,
+                and never drop it to make room.
+
+        Returns:
+            bool: True if it was queued; False if it was coalesced or rate-limited.
+
+        """
+        with self.__condition:
+            if self.__closing or message in self.__pending:
+                self.__dropped += 1
+                return False
+            last_sent = self.__last_sent.get(message)
+            if not urgent and last_sent is not None and time.monotonic() - last_sent < self.__min_interval:
+                self.__dropped += 1
+                return False
+            if len(self.__pending) >= self.__max_pending:
+                victim = next((m for m, u in self.__pending.items() if not u), None)
+                if victim is None and not urgent:
+                    self.__dropped += 1
+                    return False
+                if victim is not None:
+                    del self.__pending[victim]
+                    self.__dropped += 1
+            self.__pending[message] = urgent
+            self.__condition.notify()
+            return True
+
+    def sessions(self):
+        """Return the logged-in sessions (see read_sessions()), rereading utmp only if it has changed."""
+        mtime = modification_time_of(self.__utmp_path)
+        if mtime != self.__utmp_mtime:
+            self.__sessions = read_sessions(self.__utmp_path)
+            self.__utmp_mtime = mtime
+        return self.__sessions
+
+    def _dispatch(self):
+        while True:
+            with self.__condition:
+                while not self.__pending and not self.__closing:
+                    self.__condition.wait()
+                if not self.__pending:
+                    return
+                message, _ = self.__pending.popitem(last=False)
+                now = time.monotonic()
+                self.__last_sent = {m: t for m, t in self.__last_sent.items() if now - t < self.__min_interval}
+                self.__last_sent[message] = now
+            self._deliver(message)
+            with self.__condition:
+                self.__sent += 1
+
+    def _deliver(self, message):
+        self._submit(['wall'], message)
+        displays = {(session.user, session.display) for session in self.sessions() if session.display is not None}
+        for user, display in displays:
+            self._submit(['su', '-l', user, '-c', 'DISPLAY=%s xmessage -timeout %d %s'
+                          % (shlex.quote(display), self.__xmessage_timeout, shlex.quote(message))])
+
+    def _submit(self, command, stdin=None):
+        future = self.__pool.submit(self._run, command, stdin)
+        with self.__condition:
+            self.__deliveries.add(future)
+        future.add_done_callback(self._delivered)
+
+    def _delivered(self, future):
+        with self.__condition:
+            self.__deliveries.discard(future)
+
+    def _run(self, command, stdin=None):
+        try:
+            subprocess.run(command, input=None if stdin is None else stdin.encode(), stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL, timeout=self.__xmessage_timeout + 5)
+        except (OSError, subprocess.SubprocessError) as e:
+            print("%s occurred while running %s" % (str(e), command[0]))
+
+    def close(self, timeout=None):
+        """Send whatever is waiting, then stop.
+
+        Wait for up to timeout seconds (None means forever) for the messages to be delivered:
+        that is, for wall and xmessage to finish, not merely to be started.
+
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.__condition:
+            self.__closing = True
+            self.__condition.notify()
+        self.__thread.join(timeout)
+        with self.__condition:
+            deliveries = set(self.__deliveries)
+        if deliveries:
+            wait(deliveries, timeout=None if deadline is None else max(0., deadline - time.monotonic()))
+        self.__pool.shutdown(wait=False)
+
+    @property
+    def sent(self):
+        return self.__sent
+
+    @property
+    def dropped(self):
+        return self.__dropped
+
+
+_default_dispatcher = None
+_default_dispatcher_lock = Lock()
+
+
+def default_dispatcher():
+    """Return the NotificationDispatcher that notify() uses unless told otherwise, creating it if need be."""
+    global _default_dispatcher
+    with _default_dispatcher_lock:
+        if _default_dispatcher is None:
+            _default_dispatcher = NotificationDispatcher()
+        return _default_dispatcher
@@ -0,0 +1,218 @@
+#!/usr/bin/python3
+"""Shut down in good order, in the time the battery has left.
+
+ShutdownOrchestrator runs the pre-shutdown hooks that have been registered with it
+(e.g. drain a queue, checkpoint a database, unmount a network filesystem) all at
+once, then powers the computer off. How long the hooks may take is worked out from
+the battery: the lower bound of the estimated time until it is empty, less a safety
+margin. It is worked out again every tenth of a second while they run, so the deadline
+moves in if the battery empties faster than expected. It never moves out.
+
+Hooks that are still running at the deadline are sent SIGTERM, then SIGKILL, in
+their whole process group. Whatever happens, the poweroff command is issued before
+the safety margin is eaten into.
+
+A hook is a shell command, a list of arguments, or a Python function (which can't
+be killed, only abandoned). add_hooks_from() registers every executable in a
+directory, e.g. /etc/rpiupspackcomms/pre-shutdown.d. Hooks that are commands get
+UPS_DEADLINE in their environment: how many seconds they have.
+
+Example:
+    >>> orchestrator = ShutdownOrchestrator(SmartUPS, safety_margin=30)
+    >>> orchestrator.add_hook('postgres', 'pg_ctl stop -m fast')
+    >>> orchestrator.add_hooks_from('/etc/rpiupspackcomms/pre-shutdown.d')
+    >>> engine.on(BATTERY_CRITICAL, orchestrator.shutdown)
+
+.. _Google Python Style Guide:
+   http://google.github.io/styleguide/pyguide.html
+
+"""
+
+from collections import namedtuple
+import os
+import signal
+import subprocess
+from threading import Thread
+import time
+
+HookResult = namedtuple('HookResult', ('name', 'outcome', 'seconds'))
+"""What became of one pre-shutdown hook.
+
+name (str): The hook's name. seconds (float): How long it ran for.
+outcome (str): 'ok', 'failed' (non-zero exit status or exception), 'killed' or 'abandoned'
+    (it overran; a function can't be killed, so it is abandoned instead).
+"""
+
+
+class _Hook:
+    __slots__ = ('name', 'hook', 'started', 'finished', 'outcome', 'process', 'thread')
+
+    def __init__(self, name, hook):
+        self.name = name
+        self.hook = hook
+        self.started = self.finished = self.outcome = self.process = self.thread = None
+
+
+class ShutdownOrchestrator:
+    """Run the pre-shutdown hooks in parallel, under a deadline set by the battery; then power off.
+
+    Args:
+        ups (SmartUPSBaseInterface): Whose time_until(0) sets the deadline.
+        command (:obj:`str`, optional): The poweroff command.
+        safety_margin (:obj:`float`, optional): How many seconds before the battery is
+            expected to be empty the poweroff command must be issued.
+        default_deadline (:obj:`float`, optional): How many seconds the hooks get if the
+            time left can't be estimated.
+        max_deadline (:obj:`float`, optional): The hooks never get longer than this.
+        kill_grace (:obj:`float`, optional): How long after SIGTERM an overrunning hook is
+            sent SIGKILL. This comes out of the safety margin, so keep it short.
+        before_poweroff (:obj:`function`, optional): Called after the hooks, just before the
+            poweroff command, e.g. to close log files.
+
+    Methods:
+        add_hook (name, hook): Register a hook.
+        add_hooks_from (directory): Register every executable file in directory.
+        deadline (): How many seconds the hooks may take, as of now.
+        run_hooks (): Run the hooks; return their HookResults.
+        shutdown (event, snapshot): Run the hooks, then power off. Suitable as a policy action.
+
+    """
+
+    def __init__(self, ups, command="shutdown -h now", safety_margin=30, default_deadline=60, max_deadline=300,
+                 kill_grace=2, before_poweroff=None):
+        self.__ups = ups
+        self.__command = command
+        self.__safety_margin = safety_margin
+        self.__default_deadline = default_deadline
+        self.__max_deadline = max_deadline
+        self.__kill_grace = kill_grace
+        self.__before_poweroff = before_poweroff
+        self.__hooks = []
+
+    def add_hook(self, name, hook):
+        """Register a pre-shutdown hook.
+
+        Args:
+            name (str): What to call it in the report.
+            hook: A shell command (str), a list of arguments, or a function that takes no arguments.
+
+        """
+        self.__hooks.append((name, hook))
+
+    def add_hooks_from(self, directory):
+        """Register every executable file in directory (in alphabetical order), as run-parts would.
+
+        A directory that doesn't exist has no hooks in it.
+
+        """
+        try:
+            names = sorted(os.listdir(directory))
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(directory, name)
+            if os.path.isfile(path) and os.access(path, os.X_OK):
+                self.add_hook(name, [path])
+
+    def deadline(self):
+        """Return how many seconds the hooks may take: the battery's time left, pessimistically, less the safety margin.
+
+        Returns:
+            float: Between 0 and max_deadline. default_deadline if the time left can't be estimated.
+
+        """
+        estimate = self.__ups.time_until(0)
+        if estimate is None or estimate.seconds < 0:
+            return min(self.__default_deadline, self.__max_deadline)
+        return max(0., min(estimate.low - self.__safety_margin, self.__max_deadline))
+
+    def _start(self, hook, seconds):
+        hook.started = time.monotonic()
+        if callable(hook.hook):
+            def _call():
+                try:
+                    hook.hook()
+                    hook.outcome = 'ok'
+                except Exception as e:
+                    print("%s occurred while running pre-shutdown hook %s" % (str(e), hook.name))
+                    hook.outcome = 'failed'
+                hook.finished = time.monotonic()
+            hook.thread = Thread(target=_call, daemon=True)
+            hook.thread.start()
+            return
+        env = dict(os.environ, UPS_DEADLINE=str(int(seconds)))
+        try:
+            hook.process = subprocess.Popen(hook.hook, shell=isinstance(hook.hook, str), env=env,
+                                            start_new_session=True)
+        except OSError as e:
+            print("%s occurred while starting pre-shutdown hook %s" % (str(e), hook.name))
+            hook.outcome = 'failed'
+            hook.finished = time.monotonic()
+
+    def _poll(self, hook):
+        if hook.outcome is None and hook.process is not None and hook.process.poll() is not None:
+            hook.outcome = 'ok' if hook.process.returncode == 0 else 'failed'
+            hook.finished = time.monotonic()
+        return hook.outcome is not None
+
+    def _signal(self, hook, signum):
+        try:
+            os.killpg(hook.process.pid, signum)
+        except OSError:
+            pass
+
+    def run_hooks(self):
+        """Run every hook at once; stop those that are still running at the deadline.
+
+        Returns:
+            list: A HookResult per hook, in the order in which they were registered.
+
+        """
+        started = time.monotonic()
+        seconds = self.deadline()
+        deadline = started + seconds
+        hooks = [_Hook(name, hook) for name, hook in self.__hooks]
+        for hook in hooks:
+            self._start(hook, seconds)
+        while not all(self._poll(hook) for hook in hooks):
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            time.sleep(min(.1, deadline - now))
+            deadline = min(deadline, time.monotonic() + self.deadline())  # The battery may be emptying faster.
+        overrunning = [hook for hook in hooks if not self._poll(hook)]
+        for hook in overrunning:
+            if hook.process is not None:
+                self._signal(hook, signal.SIGTERM)
+        grace_ends = time.monotonic() + self.__kill_grace
+        while time.monotonic() < grace_ends and not all(self._poll(hook) for hook in overrunning if hook.process is not None):
+            time.sleep(.05)
+        now = time.monotonic()
+        for hook in overrunning:
+            if hook.process is not None:
+                if not self._poll(hook):
+                    self._signal(hook, signal.SIGKILL)
+                    try:
+                        hook.process.wait(.1)
+                    except subprocess.TimeoutExpired:
+                        pass
+                hook.outcome = 'killed'
+            else:
+                hook.outcome = 'abandoned'
+            hook.finished = now
+        return [HookResult(hook.name, hook.outcome, hook.finished - hook.started) for hook in hooks]
+
+    def shutdown(self, event=None, snapshot=None):
+        """Run the hooks, report on them, call before_poweroff, and power off.
+
+        The arguments are ignored; they are there so that this can be a policy action.
+
+        """
+        for result in self.run_hooks():
+            print("Pre-shutdown hook %s: %s after %1.1f seconds" % result)
+        if self.__before_poweroff is not None:
+            try:
+                self.__before_poweroff()
+            except Exception as e:
+                print("%s occurred while getting ready to power off" % str(e))
+        os.system(self.__command)
@@ -0,0 +1,155 @@
+#!/usr/bin/python3
+"""Parser for the frames that the RPi UPSPack emits.
+
+The UPSPack writes one frame per line on its serial port, like this::
+
+    $ SmartUPS V3.2P,Vin GOOD,BATCAP 87,Vout 5123 $
+
+This module turns such frames into ParsedFrame tuples with typed fields. Each
+frame is parsed in one pass with a precompiled regular expression; frames whose
+fields come in an unexpected order are handled by a slower, general-purpose
+fallback. Anything that can't be parsed raises MalformedFrameError, rather than
+quietly producing half a dictionary.
+
+parse_many() and parse_file() parse whole buffers or capture files at once.
+
+Example:
+    >>> from pyupspack.parser import parse_frame, parse_many
+    >>> parse_frame('$ SmartUPS V3.2P,Vin GOOD,BATCAP 87,Vout 5123 $')
+    ParsedFrame(hardwareversion='V3.2P', Vin='GOOD', batterylevel=87, Vout=5.123)
+    >>> len(parse_many(open('capture.log', 'rb').read()))
+    86400
+
+.. _Google Python Style Guide:
+   http://google.github.io/styleguide/pyguide.html
+
+"""
+
+from collections import namedtuple
+import re
+
+from pyupspack.exceptions import MalformedFrameError
+
+ParsedFrame = namedtuple('ParsedFrame', ('hardwareversion', 'Vin', 'batterylevel', 'Vout'))
+"""One frame's worth of information.
+
+hardwareversion (str): e.g. 'V3.2P'; None if the frame didn't say.
+Vin (str): 'GOOD' if the UPSPack has external power; something else (e.g. 'NG') if it hasn't.
+batterylevel (int): 0 to 100.
+Vout (float): Voltage out, in volts; None if the frame didn't say.
+"""
+
+_FRAME_RE = re.compile(r'\s*\$?\s*SmartUPS ([^,$]*),Vin ([^,$]*),BATCAP (\d+),Vout (\d+)\s*\$?\s*$')
+_MANY_FRAMES_RE = re.compile(r'\$ *(?:SmartUPS ([^,$\n]*),Vin ([^,$\n]*),BATCAP (\d+),Vout (\d+) *|([^$\n]*))\$')
+
+
+def _parse_frame_slowly(frame):
+    """Parse a frame whose fields are in an unusual order (or missing). Raise MalformedFrameError if hopeless."""
+    dct = {}
+    for item in frame.strip().strip('$').strip().split(','):
+        key, _, value = item.strip().partition(' ')
+        if not value:
+            raise MalformedFrameError("Field %r has no value" % item, frame)
+        dct[key] = value
+    if 'Vin' not in dct or 'BATCAP' not in dct:
+        raise MalformedFrameError("Frame lacks Vin and/or BATCAP", frame)
+    try:
+        batterylevel = int(dct['BATCAP'].strip('%'))
+        Vout = float(dct['Vout']) / 1000. if 'Vout' in dct else None
+    except ValueError:
+        raise MalformedFrameError("BATCAP or Vout is not a number", frame)
+    if not 0 <= batterylevel <= 100:
+        raise MalformedFrameError("BATCAP %d is not a percentage" % batterylevel, frame)
+    return ParsedFrame(dct.get('SmartUPS'), dct['Vin'], batterylevel, Vout)
+
+
+def parse_frame(frame):
+    """Parse one frame.
+
+    Args:
+        frame (str or bytes): The frame, with or without its '$' delimiters.
+
+    Returns:
+        ParsedFrame: The frame's contents, typed.
+
+    Raises:
+        MalformedFrameError: The frame could not be parsed.
+
+    """
+    if isinstance(frame, (bytes, bytearray)):
+        frame = frame.decode(errors='replace')
+    match = _FRAME_RE.match(frame)
+    if match is None:
+        return _parse_frame_slowly(frame)
+    hardwareversion, Vin, batcap, vout = match.groups()
+    batterylevel = int(batcap)
+    if batterylevel > 100:
+        raise MalformedFrameError("BATCAP %d is not a percentage" % batterylevel, frame)
+    return ParsedFrame(hardwareversion, Vin, batterylevel, int(vout) / 1000.)
+
+
+def parse_many(buffer, on_malformed=None):
+    """Parse every frame in a buffer, e.g. a capture of the serial port's output.
+
+    The whole buffer is decoded once and scanned by a single precompiled regular
+    expression, so this is a good deal quicker than splitting it up and calling
+    parse_frame() on each piece. Frames in the canonical field order are parsed;
+    anything else between a pair of '$' delimiters on one line, or a BATCAP above 100,
+    counts as malformed.
+    Partial frames at either end of the buffer are ignored.
+
+    The UPSPack says the same thing many times over, so identical frames are parsed
+    once and share a ParsedFrame (which is immutable, so that's safe).
+
+    Args:
+        buffer (bytes or str): The buffer.
+        on_malformed (:obj:`function`, optional): Called with the text (str) of each
+            malformed frame. If None, malformed frames are skipped silently.
+
+    Returns:
+        list: ParsedFrame instances, in order.
+
+    """
+    if not isinstance(buffer, str):
+        buffer = bytes(buffer).decode('latin-1')
+    frames = []
+    append = frames.append
+    already_parsed = {}
+    for groups in _MANY_FRAMES_RE.findall(buffer):
+        parsed = already_parsed.get(groups)
+        if parsed is None:
+            hardwareversion, Vin, batcap, vout, garbage = groups
+            if not batcap or int(batcap) > 100:
+                if on_malformed is not None:
+                    on_malformed(garbage or 'SmartUPS %s,Vin %s,BATCAP %s,Vout %s' % groups[:4])
+                continue
+            parsed = already_parsed[groups] = ParsedFrame(hardwareversion, Vin, int(batcap), int(vout) / 1000.)
+        append(parsed)
+    return frames
+
+
+def parse_file(path, on_malformed=None, chunk_size=1 << 20):
+    """Parse a capture file, chunk by chunk, without reading it all into memory.
+
+    Args:
+        path (str): The capture file.
+        on_malformed (:obj:`function`, optional): See parse_many().
+        chunk_size (:obj:`int`, optional): How many bytes to read at a time.
+
+    Yields:
+        ParsedFrame: Each frame in the file, in order.
+
+    """
+    leftover = b''
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            chunk = leftover + chunk
+            end_of_last_line = chunk.rfind(b'\n') + 1
+            leftover = chunk[end_of_last_line:]
+            for parsed in parse_many(chunk[:end_of_last_line], on_malformed):
+                yield parsed
+    for parsed in parse_many(leftover, on_malformed):
+        yield parsed
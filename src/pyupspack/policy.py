@@ -0,0 +1,238 @@
+#!/usr/bin/python3
+"""Decide what to do about the UPSPack's state, one frame at a time.
+
+PolicyEngine is a small state machine, fed by frames rather than by polling. Each
+frame puts the UPSPack in one of four states:
+
+    mains     external power is present;
+    battery   running on the battery;
+    low       running on the battery, which is below low_level;
+    critical  running on the battery, which is below critical_level.
+
+Whenever the state changes, the engine fires an event (POWER_LOST, BATTERY_LOW,
+BATTERY_CRITICAL, BATTERY_RECOVERED or POWER_RESTORED) and runs the actions that
+have been attached to it with on(). While on the battery, it also fires REMINDER
+from time to time, more often as the battery empties. The battery level has to
+climb hysteresis percent above a threshold before the engine believes that it has
+really recovered; a level that wobbles around a threshold doesn't fire events
+frame after frame. Critical is left only when the power comes back.
+
+An action is any function that takes (event, snapshot). notify(), run_hook() and
+shutdown() make the usual ones.
+
+Example:
+    Here is how to warn the users and shut down when the battery is nearly empty::
+
+        from pyupspack import SmartUPS
+        from pyupspack.policy import PolicyEngine, BATTERY_CRITICAL, POWER_LOST, notify, shutdown
+
+        engine = PolicyEngine(low_level=20, critical_level=10)
+        engine.on(POWER_LOST, notify())
+        engine.on(BATTERY_CRITICAL, notify("SHUTTING DOWN"))
+        engine.on(BATTERY_CRITICAL, shutdown())
+        engine.run(SmartUPS)
+
+.. _Google Python Style Guide:
+   http://google.github.io/styleguide/pyguide.html
+
+"""
+
+from collections import defaultdict
+import os
+import queue
+import subprocess
+import time
+
+from pyupspack.notifications import default_dispatcher
+
+MAINS, BATTERY, LOW, CRITICAL = 'mains', 'battery', 'low', 'critical'
+_STATES = (MAINS, BATTERY, LOW, CRITICAL)  # In order of increasing alarm.
+
+POWER_LOST = 'power_lost'
+BATTERY_LOW = 'battery_low'
+BATTERY_CRITICAL = 'battery_critical'
+BATTERY_RECOVERED = 'battery_recovered'
+POWER_RESTORED = 'power_restored'
+REMINDER = 'reminder'
+EVENTS = (POWER_LOST, BATTERY_LOW, BATTERY_CRITICAL, BATTERY_RECOVERED, POWER_RESTORED, REMINDER)
+
+_EVENT_ON_ENTERING = {BATTERY: POWER_LOST, LOW: BATTERY_LOW, CRITICAL: BATTERY_CRITICAL}
+
+
+class PolicyEngine:
+    """Edge-triggered state machine that turns frames into events, and events into actions.
+
+    Args:
+        low_level (:obj:`int`, optional): Below this battery level, we're low.
+        critical_level (:obj:`int`, optional): Below this battery level, we're critical.
+        hysteresis (:obj:`int`, optional): How many percent above low_level the battery
+            must climb before we stop being low.
+        reminder_seconds_per_percent (:obj:`float`, optional): While on the battery, fire
+            REMINDER every batterylevel * this many seconds. None means never.
+        clock (:obj:`function`, optional): Returns the time, in seconds. Default is
+            time.monotonic.
+
+    Attributes:
+        state (str): MAINS, BATTERY, LOW or CRITICAL; None until the first frame.
+
+    Methods:
+        on (event, action): Call action(event, snapshot) whenever event fires.
+        feed (snapshot): Update the state from one frame; run the actions; return the events.
+        run (ups, callback, interval): Feed the engine every frame from ups, forever.
+
+    Raises:
+        ValueError: Bad parameters were supplied by the programmer.
+
+    """
+
+    def __init__(self, low_level=20, critical_level=10, hysteresis=2, reminder_seconds_per_percent=5,
+                 clock=time.monotonic):
+        if not 0 <= critical_level <= low_level <= 100:
+            raise ValueError("Please specify 0 <= critical_level <= low_level <= 100")
+        if hysteresis < 0:
+            raise ValueError("hysteresis must not be negative")
+        self.__low_level = low_level
+        self.__critical_level = critical_level
+        self.__hysteresis = hysteresis
+        self.__reminder_seconds_per_percent = reminder_seconds_per_percent
+        self.__clock = clock
+        self.__actions = defaultdict(list)
+        self.__state = None
+        self.__last_reminder = None
+
+    def on(self, event, action):
+        """Call action(event, snapshot) whenever event fires, after the actions already attached to it.
+
+        Args:
+            event (str): One of EVENTS.
+            action: Function that takes the event and the SmartUPSSnapshot that fired it.
+
+        Raises:
+            ValueError: No such event.
+
+        """
+        if event not in EVENTS:
+            raise ValueError("%r is not one of %s" % (event, ', '.join(EVENTS)))
+        self.__actions[event].append(action)
+
+    def _state_of(self, snapshot):
+        if not snapshot.discharging:
+            return MAINS
+        if self.__state == CRITICAL or snapshot.batterylevel is None:
+            return self.__state or BATTERY
+        if snapshot.batterylevel < self.__critical_level:
+            return CRITICAL
+        if snapshot.batterylevel < self.__low_level:
+            return LOW
+        if self.__state == LOW and snapshot.batterylevel < self.__low_level + self.__hysteresis:
+            return LOW
+        return BATTERY
+
+    def _events_for(self, old_state, new_state, now, snapshot):
+        if new_state == MAINS:
+            return [POWER_RESTORED] if old_state not in (None, MAINS) else []
+        old_rank = _STATES.index(old_state or MAINS)
+        new_rank = _STATES.index(new_state)
+        if new_rank > old_rank:
+            self.__last_reminder = now
+            return [_EVENT_ON_ENTERING[state] for state in _STATES[old_rank + 1:new_rank + 1]]
+        if new_rank < old_rank:
+            return [BATTERY_RECOVERED]
+        if new_state != CRITICAL and self.__reminder_seconds_per_percent is not None \
+                and now - self.__last_reminder >= self.__reminder_seconds_per_percent * (snapshot.batterylevel or 0):
+            self.__last_reminder = now
+            return [REMINDER]
+        return []
+
+    def feed(self, snapshot):
+        """Update the state from one frame; run the actions of any events that fire.
+
+        If an action raises an exception, the exception is printed and the other
+        actions are run regardless.
+
+        Args:
+            snapshot (SmartUPSSnapshot): The frame.
+
+        Returns:
+            list: The events that fired, in order.
+
+        """
+        new_state = self._state_of(snapshot)
+        events = self._events_for(self.__state, new_state, self.__clock(), snapshot)
+        self.__state = new_state
+        for event in events:
+            for action in self.__actions[event]:
+                try:
+                    action(event, snapshot)
+                except Exception as e:
+                    print("%s occurred while running %r for %s" % (str(e), action, event))
+        return events
+
+    def run(self, ups, callback=None, interval=None):
+        """Feed the engine every frame that ups receives, as it arrives. Never returns.
+
+        Frames are handed over by a frame listener and processed on the calling thread,
+        so slow actions don't hold up the serial port.
+
+        Args:
+            ups (SmartUPSBaseInterface): Where the frames come from.
+            callback (:obj:`function`, optional): Called as callback(snapshot, events) after
+                each frame, and as callback(None, []) if interval seconds pass without one.
+            interval (:obj:`float`, optional): See callback.
+
+        """
+        frames = queue.Queue()
+        ups.add_frame_listener(frames.put)
+        try:
+            snapshot, previous = ups.snapshot_or_None(), None
+            while True:
+                if snapshot is not None and snapshot is not previous:
+                    events = self.feed(snapshot)
+                    if callback is not None:
+                        callback(snapshot, events)
+                    previous = snapshot
+                try:
+                    snapshot = frames.get(timeout=interval)
+                except queue.Empty:
+                    snapshot = None
+                    if callback is not None:
+                        callback(None, [])
+        finally:
+            ups.remove_frame_listener(frames.put)
+
+    @property
+    def state(self):
+        return self.__state
+
+
+def notify(message=None, urgent=False, dispatcher=None):
+    """Return an action that sends message (or, by default, the snapshot's verbose) to all users.
+
+    The message is handed to a NotificationDispatcher (by default, default_dispatcher()),
+    so the action returns at once. See pyupspack.notifications.
+
+    """
+    def _notify(event, snapshot):
+        (default_dispatcher() if dispatcher is None else dispatcher).send(
+            snapshot.verbose if message is None else message, urgent=urgent)
+    return _notify
+
+
+def run_hook(command):
+    """Return an action that runs command in the background, with the event and battery level in its environment.
+
+    The command is run by the shell, with UPS_EVENT, UPS_BATTERYLEVEL and UPS_VERBOSE set.
+
+    """
+    def _run_hook(event, snapshot):
+        env = dict(os.environ, UPS_EVENT=event, UPS_VERBOSE=snapshot.verbose or '',
+                   UPS_BATTERYLEVEL='' if snapshot.batterylevel is None else str(snapshot.batterylevel))
+        subprocess.Popen(command, shell=True, env=env)
+    return _run_hook
+
+
+def shutdown(command="shutdown -h now"):
+    """Return an action that shuts the computer down."""
+    def _shutdown(event, snapshot):
+        os.system(command)
+    return _shutdown
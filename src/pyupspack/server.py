@@ -0,0 +1,259 @@
+#!/usr/bin/python3
+"""Serve the UPSPack's state to other processes over a Unix domain socket.
+
+Only one process can sensibly own the serial port. SmartUPSServer lets it share
+what it hears: any number of clients (see pyupspack.client) connect to a Unix
+socket, ask for the most recent snapshot or for statistics, or subscribe to a push
+stream of snapshots. Every connection is looked after by the shared IOLoop (see
+pyupspack.ioloop), the same thread that reads the serial port, so hundreds of
+subscribers cost next to nothing and no thread is added.
+
+The protocol is line-based. Each request is one line; each reply or event is one
+line of JSON::
+
+    SNAPSHOT             -> {"snapshot": {...}}        (null if there isn't one yet)
+    STATS                -> {"stats": {...}}
+    TIME_UNTIL level     -> {"time_until": [seconds, low, high]}  (level is an integer from
+                            0 to 100; see SmartUPS.time_until(); null if it can't tell;
+                            an infinite bound is null too)
+    SUBSCRIBE            -> {"snapshot": {...}}, then one line per change of Vin,
+                            batterylevel or hardwareversion
+    SUBSCRIBE ALL        -> {"snapshot": {...}}, then one line per frame
+    anything else        -> {"error": "..."}
+
+A subscriber that falls more than max_buffered_bytes behind is disconnected; it
+is welcome to reconnect.
+
+Example:
+    In the process that owns the serial port::
+
+        server = SmartUPSServer(SmartUPS, '/run/rpiupspackcomms.sock')
+
+    and, in a shell::
+
+        $ echo SNAPSHOT | socat - UNIX-CONNECT:/run/rpiupspackcomms.sock
+
+.. _Google Python Style Guide:
+   http://google.github.io/styleguide/pyguide.html
+
+"""
+
+import json
+import math
+import os
+import socket
+import stat
+
+from pyupspack.classes import SmartUPSSnapshot
+from pyupspack.exceptions import ReadOnlyError
+from pyupspack.ioloop import default_loop
+
+
+def snapshot_to_dict(snapshot):
+    """Return a SmartUPSSnapshot as a dictionary that json.dumps() can cope with."""
+    if snapshot is None:
+        return None
+    dct = {name: getattr(snapshot, name) for name in SmartUPSSnapshot.__slots__}
+    if dct['timeleft_range'] is not None:
+        dct['timeleft_range'] = [None if math.isinf(t) else t for t in dct['timeleft_range']]
+    return dct
+
+
+def snapshot_from_dict(dct):
+    """Return a SmartUPSSnapshot made from the output of snapshot_to_dict(); the inverse of it."""
+    if dct is None:
+        return None
+    timeleft_range = dct.get('timeleft_range')
+    if timeleft_range is not None:
+        timeleft_range = tuple(math.inf if t is None else t for t in timeleft_range)
+    return SmartUPSSnapshot(sequence=dct['sequence'], timestamp=dct['timestamp'], monotonic=dct['monotonic'],
+                            hardwareversion=dct['hardwareversion'], Vin=dct['Vin'], batterylevel=dct['batterylevel'],
+                            Vout=dct['Vout'], timeleft=dct['timeleft'], verbose=dct['verbose'], raw=dct['raw'],
+                            timeleft_range=timeleft_range)
+
+
+def _change_key(snapshot):
+    return (snapshot.Vin, snapshot.batterylevel, snapshot.hardwareversion)
+
+
+class _Connection:
+    __slots__ = ('sock', 'inbuf', 'outbuf', 'subscription')
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.inbuf = b''
+        self.outbuf = bytearray()
+        self.subscription = None  # None, 'changes' or 'all'
+
+
+class SmartUPSServer:
+    """Share a SmartUPSInterface (or AsyncSmartUPS) with other processes, over a Unix socket.
+
+    Args:
+        ups (SmartUPSBaseInterface): Whose snapshots to serve.
+        path (str): Where to create the socket. A stale socket left there by a previous
+            run is removed first.
+        mode (:obj:`int`, optional): Permissions of the socket.
+        max_buffered_bytes (:obj:`int`, optional): How far a subscriber may fall behind
+            before it is disconnected.
+        io_loop (:obj:`IOLoop`, optional): Default is pyupspack.ioloop.default_loop().
+
+    Attributes:
+        path (str): The socket.
+        noof_clients (int): How many clients are connected.
+
+    Methods:
+        close (): Stop serving, disconnect everybody, and remove the socket.
+
+    Raises:
+        ValueError: Something that isn't a socket is in the way.
+        OSError: We couldn't create the socket.
+
+    """
+
+    def __init__(self, ups, path, mode=0o666, max_buffered_bytes=1 << 16, io_loop=None):
+        self.__ups = ups
+        self.__path = path
+        self.__max_buffered_bytes = max_buffered_bytes
+        self.__io_loop = default_loop() if io_loop is None else io_loop
+        if os.path.lexists(path):
+            if not stat.S_ISSOCK(os.lstat(path).st_mode):
+                raise ValueError("%s exists and isn't a socket" % path)
+            os.unlink(path)
+        self.__listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.__listener.bind(path)
+        os.chmod(path, mode)
+        self.__listener.listen(64)
+        self.__listener.setblocking(False)
+        self.__connections = {}
+        self.__last_change_key = None
+        self.__io_loop.add_reader(self.__listener.fileno(), self._accept)
+        ups.add_frame_listener(self._on_frame)
+
+    def _on_frame(self, snapshot):
+        # Called on the reader's thread (often the I/O loop's own): hand the snapshot over.
+        self.__io_loop.call_soon(self._broadcast, snapshot)
+
+    def _accept(self):
+        try:
+            sock, _ = self.__listener.accept()
+        except (BlockingIOError, OSError):
+            return
+        sock.setblocking(False)
+        connection = _Connection(sock)
+        self.__connections[sock.fileno()] = connection
+        self.__io_loop.add_reader(sock.fileno(), self._read, connection)
+
+    def _disconnect(self, connection):
+        fd = connection.sock.fileno()
+        if self.__connections.pop(fd, None) is not None:
+            self.__io_loop.remove_reader(fd)
+            self.__io_loop.remove_writer(fd)
+        connection.sock.close()
+
+    def _read(self, connection):
+        try:
+            data = connection.sock.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._disconnect(connection)
+            return
+        connection.inbuf += data
+        while b'\n' in connection.inbuf:
+            line, _, connection.inbuf = connection.inbuf.partition(b'\n')
+            self._handle(connection, line.decode(errors='replace').strip().upper())
+        if len(connection.inbuf) > 1024:
+            self._disconnect(connection)  # That's no request.
+
+    def _handle(self, connection, request):
+        if request == 'SNAPSHOT':
+            self._send(connection, {'snapshot': snapshot_to_dict(self.__ups.snapshot_or_None())})
+        elif request == 'STATS':
+            self._send(connection, {'stats': self.__ups.stats()})
+        elif request.startswith('TIME_UNTIL '):
+            try:
+                batterylevel = int(request[len('TIME_UNTIL '):])
+            except ValueError:
+                batterylevel = None
+            if batterylevel is None or not 0 <= batterylevel <= 100:
+                self._send(connection, {'error': "Bad request %r" % request})
+                return
+            try:
+                estimate = self.__ups.time_until(batterylevel)
+            except Exception as e:
+                self._send(connection, {'error': "%s occurred while estimating the time until %d%%" % (str(e), batterylevel)})
+                return
+            self._send(connection, {'time_until': None if estimate is None
+                                    else [None if math.isinf(t) else t for t in estimate]})
+        elif request in ('SUBSCRIBE', 'SUBSCRIBE ALL'):
+            connection.subscription = 'all' if request == 'SUBSCRIBE ALL' else 'changes'
+            self._send(connection, {'snapshot': snapshot_to_dict(self.__ups.snapshot_or_None())})
+        elif request:
+            self._send(connection, {'error': "Unknown request %r" % request})
+
+    def _send(self, connection, message, encoded=None):
+        was_empty = not connection.outbuf
+        connection.outbuf += encoded if encoded is not None else (json.dumps(message) + '\n').encode()
+        if was_empty:
+            self._flush(connection)
+        elif len(connection.outbuf) > self.__max_buffered_bytes:
+            self._disconnect(connection)
+
+    def _flush(self, connection):
+        if connection.sock.fileno() < 0:
+            return
+        try:
+            sent = connection.sock.send(connection.outbuf)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self._disconnect(connection)
+            return
+        del connection.outbuf[:sent]
+        if len(connection.outbuf) > self.__max_buffered_bytes:
+            self._disconnect(connection)
+        elif connection.outbuf:
+            self.__io_loop.add_writer(connection.sock.fileno(), self._flush, connection)
+        else:
+            self.__io_loop.remove_writer(connection.sock.fileno())
+
+    def _broadcast(self, snapshot):
+        key = _change_key(snapshot)
+        changed = key != self.__last_change_key
+        self.__last_change_key = key
+        encoded = None
+        for connection in list(self.__connections.values()):
+            if connection.subscription == 'all' or (changed and connection.subscription == 'changes'):
+                if encoded is None:
+                    encoded = (json.dumps({'snapshot': snapshot_to_dict(snapshot)}) + '\n').encode()  # once, for everybody
+                self._send(connection, None, encoded)
+
+    def close(self):
+        """Stop serving, disconnect everybody, and remove the socket."""
+        self.__ups.remove_frame_listener(self._on_frame)
+        self.__io_loop.call_and_wait(self._close)
+        try:
+            os.unlink(self.__path)
+        except OSError:
+            pass
+
+    def _close(self):
+        for connection in list(self.__connections.values()):
+            self._disconnect(connection)
+        self.__io_loop.remove_reader(self.__listener.fileno())
+        self.__listener.close()
+
+    @property
+    def path(self):
+        return self.__path
+
+    @path.setter
+    def path(self, value):
+        raise ReadOnlyError("Cannot set path attribute. That is inappropriate!")
+
+    @property
+    def noof_clients(self):
+        return len(self.__connections)
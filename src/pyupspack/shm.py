@@ -0,0 +1,244 @@
+#!/usr/bin/python3
+"""Share the most recent snapshot with other processes through shared memory.
+
+SharedSnapshotWriter is a frame listener. Whenever the process that owns the serial
+port gets a frame, it packs the snapshot into a fixed-layout record in a small file
+in /dev/shm, guarded by a sequence counter (a seqlock): the counter is made odd
+before the record is written and even again afterwards. Any local process can map
+the file with a SharedSnapshotReader and read the record without locks, sockets or
+system calls. A reader copies the record, then checks that the counter is even and
+hasn't changed; if it has, the writer was busy and the reader simply tries again.
+
+The reader keeps the snapshot it made last time; as long as the counter hasn't
+moved, snapshot() costs one struct.unpack_from() of the counter and returns that.
+
+Strings longer than their fields (see SharedSnapshotWriter) are truncated.
+
+Example:
+    In the process that owns the serial port::
+
+        writer = SharedSnapshotWriter('/dev/shm/rpiupspackcomms')
+        SmartUPS.add_frame_listener(writer.publish)
+
+    and, in any other process::
+
+        ups = SharedSnapshotReader('/dev/shm/rpiupspackcomms')
+        if ups.discharging:
+            ...
+
+.. _Google Python Style Guide:
+   http://google.github.io/styleguide/pyguide.html
+
+"""
+
+import math
+import mmap
+import os
+import struct
+
+from pyupspack.classes import SmartUPSBaseInterface, SmartUPSSnapshot
+from pyupspack.exceptions import ReadSmartUPSError, ReadOnlyError
+
+DEFAULT_SHM_PATH = '/dev/shm/rpiupspackcomms'
+
+MAGIC = b'UPSSHM01'
+_header = struct.Struct('<8sHH?3x')  # magic, layout version, record size, writer is open
+_counter = struct.Struct('<Q')
+_record = struct.Struct('<QddddddH8s16s192s96s')
+# sequence, timestamp, monotonic, Vout, timeleft, timeleft low, timeleft high (all NaN if None),
+# batterylevel (0xFFFF if None), Vin, hardwareversion, verbose, raw
+_COUNTER_OFFSET = 16
+_RECORD_OFFSET = 24
+SIZE = _RECORD_OFFSET + _record.size
+_NO_BATTERYLEVEL = 0xFFFF
+
+
+def _float_or_nan(value):
+    return math.nan if value is None else float(value)
+
+
+def _int_or_None(value):
+    return None if math.isnan(value) else int(value)
+
+
+def _text(value):
+    return value.rstrip(b'\0').decode(errors='replace')
+
+
+class SharedSnapshotWriter:
+    """Publish each SmartUPSSnapshot in a shared-memory file, for SharedSnapshotReaders.
+
+    Only one process should write to a given file. If the file is already there
+    (e.g. the writer has been restarted), it is reused, so that readers which have
+    it mapped carry on seeing updates.
+
+    Args:
+        path (:obj:`str`, optional): The file. It should be in /dev/shm or another tmpfs.
+        mode (:obj:`int`, optional): Permissions of the file.
+
+    Methods:
+        publish (snapshot): Write a snapshot. Suitable for add_frame_listener().
+        close (): Tell readers we have gone away; unmap the file.
+
+    Raises:
+        ValueError: Something that isn't one of our files is in the way.
+
+    """
+
+    def __init__(self, path=DEFAULT_SHM_PATH, mode=0o644):
+        self.__path = path
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, mode)
+        try:
+            existing_size = os.fstat(fd).st_size
+            if existing_size == 0:
+                os.ftruncate(fd, SIZE)
+            elif existing_size != SIZE:
+                raise ValueError("%s is %d bytes long; a shared snapshot is %d bytes long" % (path, existing_size, SIZE))
+            self.__mmap = mmap.mmap(fd, SIZE)
+        finally:
+            os.close(fd)
+        magic = _header.unpack_from(self.__mmap, 0)[0]
+        if magic not in (MAGIC, b'\0' * 8):
+            self.__mmap.close()
+            raise ValueError("%s is not a shared snapshot file" % path)
+        counter = _counter.unpack_from(self.__mmap, _COUNTER_OFFSET)[0]
+        self.__counter = counter + (counter & 1)  # If a previous writer died mid-write, finish its write.
+        _counter.pack_into(self.__mmap, _COUNTER_OFFSET, self.__counter)
+        _header.pack_into(self.__mmap, 0, MAGIC, 1, _record.size, True)
+
+    def publish(self, snapshot):
+        """Write a SmartUPSSnapshot, where readers can see it.
+
+        Args:
+            snapshot (SmartUPSSnapshot): The most recent frame.
+
+        """
+        timeleft_range = (None, None) if snapshot.timeleft_range is None else snapshot.timeleft_range
+        _counter.pack_into(self.__mmap, _COUNTER_OFFSET, self.__counter + 1)
+        _record.pack_into(self.__mmap, _RECORD_OFFSET, snapshot.sequence, snapshot.timestamp, snapshot.monotonic,
+                          _float_or_nan(snapshot.Vout), _float_or_nan(snapshot.timeleft),
+                          _float_or_nan(timeleft_range[0]), _float_or_nan(timeleft_range[1]),
+                          _NO_BATTERYLEVEL if snapshot.batterylevel is None else snapshot.batterylevel,
+                          (snapshot.Vin or '').encode(), (snapshot.hardwareversion or '').encode(),
+                          (snapshot.verbose or '').encode(), (snapshot.raw or '').encode())
+        self.__counter += 2
+        _counter.pack_into(self.__mmap, _COUNTER_OFFSET, self.__counter)
+
+    def close(self):
+        """Tell readers that nobody is writing any more; unmap the file. The file is left for them."""
+        if not self.__mmap.closed:
+            _header.pack_into(self.__mmap, 0, MAGIC, 1, _record.size, False)
+            self.__mmap.close()
+
+    @property
+    def path(self):
+        return self.__path
+
+
+class SharedSnapshotReader(SmartUPSBaseInterface):
+    """Read the snapshots that a SharedSnapshotWriter publishes; it looks like a SmartUPSInterface.
+
+    Args:
+        path (:obj:`str`, optional): The writer's file.
+        max_retries (:obj:`int`, optional): How many times to try again if the writer is
+            busy. Writing takes a microsecond or two, so this is plenty.
+
+    Attributes:
+        Vout, batterylevel, charging, discharging, hardwareversion, timeleft, timeleft_range,
+            verbose, stale: See SmartUPSInterface.
+        connected (bool): True if the writer is still running.
+        sequence (int): Goes up each time the writer publishes a snapshot. Cheaper to check
+            than snapshot().
+
+    Methods:
+        snapshot (): Returns the most recent SmartUPSSnapshot, or None.
+        add_frame_listener (callback): Raises TypeError. Nobody tells a reader when the
+            writer publishes; poll sequence instead.
+        close (): Unmap the file.
+
+    Raises:
+        ReadSmartUPSError: There is no such file, or it isn't one of ours.
+
+    """
+
+    def __init__(self, path=DEFAULT_SHM_PATH, max_retries=1000):
+        super().__init__()
+        self.__path = path
+        self.__max_retries = max_retries
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError as e:
+            raise ReadSmartUPSError("Unable to open %s: %s" % (path, str(e)))
+        try:
+            self.__mmap = mmap.mmap(fd, SIZE, prot=mmap.PROT_READ)
+        except (OSError, ValueError) as e:
+            raise ReadSmartUPSError("%s is not a shared snapshot file: %s" % (path, str(e)))
+        finally:
+            os.close(fd)
+        magic, layout, record_size, _ = _header.unpack_from(self.__mmap, 0)
+        if magic != MAGIC or record_size != _record.size:
+            self.__mmap.close()
+            raise ReadSmartUPSError("%s is not a shared snapshot file" % path)
+        self.__counter = None
+        self.__snapshot = None
+
+    def snapshot(self):
+        """Return the most recent SmartUPSSnapshot that the writer published, or None if there isn't one yet.
+
+        Raises:
+            ReadSmartUPSError: The writer was busy every time we looked.
+
+        """
+        counter = _counter.unpack_from(self.__mmap, _COUNTER_OFFSET)[0]
+        if counter == self.__counter:
+            return self.__snapshot
+        for _ in range(self.__max_retries):
+            if not counter & 1:
+                fields = _record.unpack_from(self.__mmap, _RECORD_OFFSET)
+                if _counter.unpack_from(self.__mmap, _COUNTER_OFFSET)[0] == counter:
+                    self.__snapshot = self._snapshot_from(fields)
+                    self.__counter = counter
+                    return self.__snapshot
+            counter = _counter.unpack_from(self.__mmap, _COUNTER_OFFSET)[0]
+        raise ReadSmartUPSError("%s was being written to every time we looked" % self.__path)
+
+    def add_frame_listener(self, callback):
+        raise TypeError("A SharedSnapshotReader isn't told about frames; poll sequence instead")
+
+    @staticmethod
+    def _snapshot_from(fields):
+        (sequence, timestamp, monotonic, Vout, timeleft, low, high, batterylevel,
+         Vin, hardwareversion, verbose, raw) = fields
+        if sequence == 0:
+            return None
+        return SmartUPSSnapshot(sequence=sequence, timestamp=timestamp, monotonic=monotonic,
+                                hardwareversion=_text(hardwareversion) or None, Vin=_text(Vin),
+                                batterylevel=None if batterylevel == _NO_BATTERYLEVEL else batterylevel,
+                                Vout=None if math.isnan(Vout) else Vout, timeleft=_int_or_None(timeleft),
+                                verbose=_text(verbose), raw=_text(raw),
+                                timeleft_range=None if math.isnan(low) else (int(low), high if math.isinf(high) else int(high)))
+
+    def close(self):
+        """Unmap the file."""
+        if not self.__mmap.closed:
+            self.__mmap.close()
+
+    @property
+    def sequence(self):
+        return _counter.unpack_from(self.__mmap, _COUNTER_OFFSET)[0] >> 1
+
+    @sequence.setter
+    def sequence(self, value):
+        raise ReadOnlyError("Cannot set sequence attribute. That is inappropriate!")
+
+    @property
+    def connected(self):
+        return _header.unpack_from(self.__mmap, 0)[3]
+
+    @connected.setter
+    def connected(self, value):
+        raise ReadOnlyError("Cannot set connected attribute. That is inappropriate!")
+
+    @property
+    def path(self):
+        return self.__path
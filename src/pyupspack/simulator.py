@@ -0,0 +1,267 @@
+#!/usr/bin/python3
+"""Simulator of the RPi UPSPack, for testing and benchmarking without one.
+
+UPSPackSimulator opens a Linux pseudo-terminal and writes frames to it, just as the
+UPSPack writes them to its serial port::
+
+    $ SmartUPS V3.2P,Vin GOOD,BATCAP 87,Vout 5123 $
+
+Point SmartUPSInterface (or monitor.py --device) at the simulator's device and it
+can't tell the difference. What is written is a scenario: a sequence of (delay,
+bytes) events, built from steady(), power_loss(), recovery(), garbage(),
+partial_line(), silence(), and so on, or replayed from a capture of a real UPSPack
+(replay_capture()) or from a TelemetryRingRecorder file (replay_ring()). The
+scenario can be played in real time or sped up.
+
+Example:
+    From Python::
+
+        from pyupspack import SmartUPSInterface
+        from pyupspack.simulator import UPSPackSimulator, steady, power_loss
+
+        with UPSPackSimulator(steady(3, 87) + power_loss(60, 87, 20), speed=10) as sim:
+            ups = SmartUPSInterface(sim.device)
+            sim.wait_until_finished()
+
+    From the command line::
+
+        $ python3 -m pyupspack.simulator --scenario power-loss --speed 10
+        /dev/pts/5
+        $ python3 monitor.py --device /dev/pts/5
+
+.. _Google Python Style Guide:
+   http://google.github.io/styleguide/pyguide.html
+
+"""
+
+import argparse
+import os
+import random
+from threading import Event, Thread
+import time
+import tty
+
+from pyupspack.telemetry import TelemetryRingRecorder
+
+FRAME_INTERVAL = 1.  # The UPSPack sends a frame every second or so.
+
+
+def frame(batterylevel, Vin='GOOD', Vout=5.123, hardwareversion='V3.2P'):
+    """Return one frame, as bytes, exactly as the UPSPack would send it."""
+    return b'$ SmartUPS %s,Vin %s,BATCAP %d,Vout %d $\n' % (hardwareversion.encode(), Vin.encode(), batterylevel,
+                                                           int(Vout * 1000 + .5))
+
+
+def steady(seconds, batterylevel, Vin='GOOD', Vout=5.123, interval=FRAME_INTERVAL):
+    """Return a scenario in which nothing changes for a while."""
+    return [(interval, frame(batterylevel, Vin, Vout)) for _ in range(int(seconds / interval))]
+
+
+def _ramp(seconds, from_level, to_level, Vin, from_Vout, to_Vout, interval):
+    noof_frames = max(1, int(seconds / interval))
+    return [(interval, frame(round(from_level + (to_level - from_level) * i / noof_frames), Vin,
+                             from_Vout + (to_Vout - from_Vout) * i / noof_frames))
+            for i in range(1, noof_frames + 1)]
+
+
+def power_loss(seconds, from_level, to_level, interval=FRAME_INTERVAL):
+    """Return a scenario in which the power fails and the battery discharges from from_level to to_level."""
+    return _ramp(seconds, from_level, to_level, 'NG', 5.1, 4.9, interval)
+
+
+def recovery(seconds, from_level, to_level, interval=FRAME_INTERVAL):
+    """Return a scenario in which the power comes back and the battery charges from from_level to to_level."""
+    return _ramp(seconds, from_level, to_level, 'GOOD', 5.2, 5.2, interval)
+
+
+def low_battery(seconds, from_level, interval=FRAME_INTERVAL):
+    """Return a scenario in which the battery discharges until it is nearly empty."""
+    return power_loss(seconds, from_level, 3, interval)
+
+
+def garbage(noof_bytes, seed=None):
+    """Return a scenario consisting of random line noise (but no '$' or newline)."""
+    rnd = random.Random(seed)
+    return [(0., bytes(rnd.choice(b'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789,% \x00\xff') for _ in range(noof_bytes)))]
+
+
+def partial_line(batterylevel, Vin='GOOD', interval=FRAME_INTERVAL):
+    """Return a scenario in which a frame is cut off half-way, e.g. because the cable was jostled."""
+    whole = frame(batterylevel, Vin)
+    return [(interval, whole[:len(whole) // 2] + b'\n')]
+
+
+def silence(seconds):
+    """Return a scenario in which nothing is sent for a while."""
+    return [(seconds, b'')]
+
+
+def replay_capture(path, interval=FRAME_INTERVAL):
+    """Return a scenario that replays a capture of a real UPSPack's serial port, one line per interval."""
+    with open(path, 'rb') as f:
+        return [(interval, line) for line in f if line.strip()]
+
+
+def replay_ring(path, capacity):
+    """Return a scenario that replays a TelemetryRingRecorder file, keeping the original timing.
+
+    Raises:
+        FileNotFoundError: There is no such file.
+        ValueError: It isn't a ring file of that capacity.
+
+    """
+    ring = TelemetryRingRecorder(path, capacity=capacity, readonly=True)
+    try:
+        scenario = []
+        previous = None
+        for record in (ring[i] for i in range(len(ring))):
+            scenario.append((0. if previous is None else max(0., record.timestamp - previous),
+                             frame(record.batterylevel, 'GOOD' if record.Vin_good else 'NG', record.Vout,
+                                   record.hardwareversion or 'V3.2P')))
+            previous = record.timestamp
+        return scenario
+    finally:
+        ring.close()
+
+
+SCENARIOS = {
+    'steady': lambda: steady(60, 100),
+    'power-loss': lambda: steady(5, 87) + power_loss(120, 87, 60) + recovery(120, 60, 87),
+    'low-battery': lambda: steady(5, 40) + low_battery(120, 40),
+    'flaky': lambda: (steady(5, 87) + garbage(64) + steady(5, 87) + partial_line(87) + steady(5, 87)
+                      + silence(10) + steady(5, 87)),
+}
+
+
+class UPSPackSimulator:
+    """Pretend to be an RPi UPSPack on a pseudo-terminal.
+
+    A background thread plays the scenario. If nobody is reading the device and its
+    buffer fills up, further bytes are dropped, as a real UART would drop them.
+
+    Args:
+        scenario (:obj:`list`, optional): (delay, bytes) events, e.g. power_loss(...). The delay
+            is in seconds since the previous event. If None, the battery is full forever.
+        speed (:obj:`float`, optional): Play the scenario this many times faster than real time.
+        loop (:obj:`bool`, optional): Play the scenario over and over again.
+
+    Attributes:
+        device (str): The pseudo-terminal's device, e.g. /dev/pts/5.
+        bytes_written (int): How many bytes have been written so far.
+        bytes_dropped (int): How many bytes nobody had room for.
+
+    Methods:
+        start (): Start playing. (Entering a with block does this too.)
+        stop (): Stop playing and close the pseudo-terminal.
+        send (data): Write some bytes at once, whatever the scenario is doing.
+        wait_until_finished (timeout): Wait for the scenario to end.
+
+    Raises:
+        ValueError: Bad parameters were supplied by the programmer.
+
+    """
+
+    def __init__(self, scenario=None, speed=1., loop=False):
+        if speed <= 0:
+            raise ValueError("speed must be positive")
+        self.__scenario = list(scenario) if scenario is not None else steady(FRAME_INTERVAL, 100)
+        self.__loop = loop or scenario is None
+        self.__speed = speed
+        self.__master_fd, self.__slave_fd = os.openpty()
+        tty.setraw(self.__slave_fd)
+        os.set_blocking(self.__master_fd, False)
+        self.__device = os.ttyname(self.__slave_fd)
+        self.__stopping = Event()
+        self.__finished = Event()
+        self.__thread = Thread(target=self._play, daemon=True)
+        self.bytes_written = 0
+        self.bytes_dropped = 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        self.__thread.start()
+
+    def _play(self):
+        try:
+            due = time.monotonic()
+            while True:
+                for delay, data in self.__scenario:
+                    due += delay / self.__speed
+                    if self.__stopping.wait(max(0., due - time.monotonic())):
+                        return
+                    if data:
+                        self._write(data)
+                if not self.__loop or not self.__scenario:
+                    return
+        finally:
+            self.__finished.set()
+
+    def _write(self, data):
+        try:
+            written = os.write(self.__master_fd, data)
+        except BlockingIOError:
+            written = 0
+        except OSError:
+            return  # We are being stopped.
+        self.bytes_written += written
+        self.bytes_dropped += len(data) - written
+
+    def send(self, data):
+        """Write data to the device at once. Returns the time.monotonic() at which it was written."""
+        self._write(data)
+        return time.monotonic()
+
+    def wait_until_finished(self, timeout=None):
+        """Wait for the scenario to end. Returns False if it didn't end in time."""
+        return self.__finished.wait(timeout)
+
+    def stop(self):
+        self.__stopping.set()
+        if self.__thread.is_alive():
+            self.__thread.join()
+        for fd in (self.__master_fd, self.__slave_fd):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    @property
+    def device(self):
+        return self.__device
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pretend to be an RPi UPSPack on a pseudo-terminal.")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--scenario', choices=sorted(SCENARIOS), default='power-loss')
+    source.add_argument('--replay', metavar='CAPTURE', help="replay a capture of a real UPSPack's serial port")
+    source.add_argument('--replay-ring', metavar='RING', help="replay a TelemetryRingRecorder file")
+    parser.add_argument('--ring-capacity', type=int, default=28 * 24 * 3600)
+    parser.add_argument('--speed', type=float, default=1., help="play this many times faster than real time")
+    parser.add_argument('--loop', action='store_true', help="play the scenario over and over again")
+    args = parser.parse_args()
+    if args.replay:
+        scenario = replay_capture(args.replay)
+    elif args.replay_ring:
+        scenario = replay_ring(args.replay_ring, args.ring_capacity)
+    else:
+        scenario = SCENARIOS[args.scenario]()
+    with UPSPackSimulator(scenario, speed=args.speed, loop=args.loop) as sim:
+        print(sim.device, flush=True)
+        try:
+            sim.wait_until_finished()
+            print("Finished. Press Ctrl-C to close %s." % sim.device, flush=True)
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+#!/usr/bin/python3
+"""Telemetry recorders for the RPi UPSPack.
+
+This module contains TelemetryLogWriter, which writes the human-readable log that
+monitor.py produces. It is kind to SD cards: the log file is kept open, lines are
+batched and written in one go, identical consecutive lines are collapsed, and the
+file is rotated before it gets too big or too old.
+
+It also contains TelemetryRingRecorder, a fixed-size, memory-mapped ring file that
+holds a compact binary record of every frame, for long-term history.
+
+Example:
+    >>> from pyupspack.telemetry import TelemetryLogWriter
+    >>> log = TelemetryLogWriter('/var/log/rpiupspackcomms', flush_interval=60)
+    >>> log.write('Vout=5.1230; charging?Yes; ...')
+    >>> log.write('Vout=4.0000; charging?No; ...', urgent=True)  # written and synced at once
+    >>> log.close()
+
+.. _Google Python Style Guide:
+   http://google.github.io/styleguide/pyguide.html
+
+"""
+
+from collections import namedtuple
+import mmap
+import os
+import struct
+import time
+
+
+class TelemetryLogWriter:
+    """Buffered, rotating, SD-card-friendly log file.
+
+    Lines are held in memory until flush_interval seconds have passed since the last
+    flush, or flush_size bytes have piled up, or somebody writes an urgent line (e.g.
+    because the power has just gone off). Urgent lines are also fsync()ed, so that
+    they survive the power going off altogether.
+
+    If skip_duplicates is True, a line that is identical to the previous one isn't
+    written; instead, when a different line comes along, a note saying how many
+    times the previous line was repeated is written first.
+
+    Before a flush would make the file bigger than max_bytes, or once the file is
+    older than max_age seconds, it is rotated: path.{n} becomes path.{n+1} (the
+    oldest is deleted), path becomes path.1, and a new path is started. (A file's
+    age is counted from when this instance opened it; Linux doesn't record when a
+    file was created.)
+
+    Args:
+        path (str): The log file.
+        flush_interval (:obj:`float`, optional): Maximum seconds between flushes.
+        flush_size (:obj:`int`, optional): Maximum bytes held in memory.
+        max_bytes (:obj:`int`, optional): Rotate before the file exceeds this. None means never.
+        max_age (:obj:`float`, optional): Rotate when the file is older than this many seconds.
+            None means never.
+        backup_count (:obj:`int`, optional): How many rotated files to keep.
+        skip_duplicates (:obj:`bool`, optional): Collapse identical consecutive lines.
+
+    Methods:
+        write(line, urgent): Log a line.
+        flush(sync): Write out whatever is being held in memory.
+        close(): Flush and close the file.
+
+    """
+
+    def __init__(self, path, flush_interval=60, flush_size=4096, max_bytes=1 << 20, max_age=None,
+                 backup_count=3, skip_duplicates=True):
+        self.__path = path
+        self.__flush_interval = flush_interval
+        self.__flush_size = flush_size
+        self.__max_bytes = max_bytes
+        self.__max_age = max_age
+        self.__backup_count = backup_count
+        self.__skip_duplicates = skip_duplicates
+        self.__pending = []
+        self.__pending_size = 0
+        self.__last_line = None
+        self.__repeats = 0
+        self.__last_flush = time.monotonic()
+        self.__file = None
+        self.__file_started = None
+        self._open()
+
+    def _open(self):
+        self.__file = open(self.__path, 'a')
+        self.__file_started = time.time()
+
+    def _rotate(self):
+        self.__file.close()
+        for n in range(self.__backup_count - 1, 0, -1):
+            if os.path.exists('%s.%d' % (self.__path, n)):
+                os.replace('%s.%d' % (self.__path, n), '%s.%d' % (self.__path, n + 1))
+        if self.__backup_count > 0:
+            os.replace(self.__path, '%s.1' % self.__path)
+        else:
+            os.remove(self.__path)
+        self._open()
+
+    def _append(self, line):
+        self.__pending.append(line + '\n')
+        self.__pending_size += len(line) + 1
+
+    def _note_repeats(self):
+        if self.__repeats:
+            self._append('(previous line repeated %d more time%s)' % (self.__repeats, '' if self.__repeats == 1 else 's'))
+            self.__repeats = 0
+
+    def write(self, line, urgent=False):
+        """Log a line.
+
+        Args:
+            line (str): The line, without '\\n' on the end.
+            urgent (:obj:`bool`, optional): If True, flush (and sync) at once, even if the
+                line is a duplicate. Use this when something important has just happened.
+
+        """
+        if self.__skip_duplicates and line == self.__last_line and not urgent:
+            self.__repeats += 1
+        else:
+            self._note_repeats()
+            self._append(line)
+            self.__last_line = line
+        if urgent:
+            self.flush(sync=True)
+        elif self.__pending_size >= self.__flush_size or time.monotonic() - self.__last_flush >= self.__flush_interval:
+            self.flush()
+
+    def flush(self, sync=False):
+        """Write out whatever is being held in memory, rotating the file first if necessary.
+
+        Args:
+            sync (:obj:`bool`, optional): If True, fsync() the file too.
+
+        """
+        self.__last_flush = time.monotonic()
+        if not self.__pending:
+            return
+        if (self.__max_bytes is not None and self.__file.tell() and self.__file.tell() + self.__pending_size > self.__max_bytes) \
+                or (self.__max_age is not None and time.time() - self.__file_started > self.__max_age):
+            self._rotate()
+        self.__file.write(''.join(self.__pending))
+        self.__pending = []
+        self.__pending_size = 0
+        self.__file.flush()
+        if sync:
+            os.fsync(self.__file.fileno())
+
+    def close(self):
+        """Flush (noting any repeats) and close the file."""
+        if self.__file is not None:
+            self._note_repeats()
+            self.flush(sync=True)
+            self.__file.close()
+            self.__file = None
+
+    @property
+    def path(self):
+        return self.__path
+
+
+TelemetryRecord = namedtuple('TelemetryRecord', ('timestamp', 'Vin_good', 'batterylevel', 'Vout', 'hardwareversion'))
+"""One record from a TelemetryRingRecorder.
+
+timestamp (float): Seconds since the epoch; see TelemetryRingRecorder about its monotonicity.
+Vin_good (bool): Did the UPSPack have external power? batterylevel (int): 0 to 100.
+Vout (float): Voltage out, in volts. hardwareversion (str): e.g. 'V3.2P', or None.
+"""
+
+
+class TelemetryRingRecorder:
+    """Fixed-size, memory-mapped ring file holding one packed record per frame.
+
+    The file consists of a 4 KiB header followed by capacity records of 16 bytes
+    each: a timestamp (float64), the Vin flag, BATCAP, Vout in millivolts, and an
+    index into the header's table of hardware versions. Once the ring is full, each
+    new record overwrites the oldest. Four weeks of 1 Hz history take 37 MiB.
+
+    record() packs the snapshot straight into the mapped file with struct.pack_into(),
+    so appending is O(1) and doesn't build any intermediate bytes. The kernel writes
+    the dirty pages out in its own time, in page-sized chunks.
+
+    Timestamps are taken from the monotonic clock, anchored to the wall clock when the
+    recorder is opened (and never earlier than the newest record already in the file).
+    Within a run they never go backwards, even if NTP steps the clock, so the records
+    are always in timestamp order and find() can use a binary search.
+
+    e.g.
+        >>> ring = TelemetryRingRecorder('/var/lib/rpiupspackcomms/telemetry.ring')
+        >>> SmartUPS.add_frame_listener(ring.record)
+        >>> len(ring), ring[-1].batterylevel
+        (86400, 87)
+        >>> [r.Vout for r in ring.between(time.time() - 3600, time.time())]
+
+    Args:
+        path (str): The ring file. It is created if it doesn't exist (unless readonly).
+        capacity (:obj:`int`, optional): How many records the ring holds.
+        readonly (:obj:`bool`, optional): Open an existing ring to read it, e.g. to replay it.
+
+    Methods:
+        record(snapshot): Append a SmartUPSSnapshot.
+        find(timestamp): Index of the first record at or after timestamp.
+        between(start, end): Iterate over the records from start to end.
+        close(): Unmap and close the file.
+
+    Raises:
+        ValueError: The file exists but isn't a ring file of this capacity; or, if readonly,
+            it is empty.
+        FileNotFoundError: readonly, and there is no such file.
+
+    """
+
+    MAGIC = b'UPSRING1'
+    HEADER_SIZE = 4096
+    _header = struct.Struct('<8sHHIQd')  # magic, layout version, record size, capacity, records written, newest timestamp
+    _record = struct.Struct('<d?BHB3x')  # timestamp, Vin good, BATCAP, Vout in mV, hardware version index
+    _HWVERSION_OFFSET = 64
+    _HWVERSION_SIZE = 16
+    _MAX_HWVERSIONS = 32
+    _UNKNOWN_HWVERSION = 255
+
+    def __init__(self, path, capacity=28 * 24 * 3600, readonly=False):
+        self.__path = path
+        self.__readonly = readonly
+        size = self.HEADER_SIZE + capacity * self._record.size
+        fd = os.open(path, os.O_RDONLY) if readonly else os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            existing_size = os.fstat(fd).st_size
+            if existing_size == 0 and not readonly:
+                os.ftruncate(fd, size)
+            elif existing_size != size:
+                raise ValueError("%s is %d bytes long; a ring of %d records should be %d bytes long" % (path, existing_size, capacity, size))
+            self.__mmap = mmap.mmap(fd, size, access=mmap.ACCESS_READ if readonly else mmap.ACCESS_WRITE)
+        finally:
+            os.close(fd)
+        magic, layout, record_size, existing_capacity, written, newest = self._header.unpack_from(self.__mmap, 0)
+        if magic == b'\0' * 8 and not readonly:
+            self._header.pack_into(self.__mmap, 0, self.MAGIC, 1, self._record.size, capacity, 0, 0.)
+            written, newest = 0, 0.
+        elif magic != self.MAGIC or record_size != self._record.size or existing_capacity != capacity:
+            self.__mmap.close()
+            raise ValueError("%s is not a telemetry ring file with %d records" % (path, capacity))
+        self.__capacity = capacity
+        self.__written = written
+        self.__hwversions = {}
+        for i in range(self._MAX_HWVERSIONS):
+            offset = self._HWVERSION_OFFSET + i * self._HWVERSION_SIZE
+            name = self.__mmap[offset:offset + self._HWVERSION_SIZE].rstrip(b'\0')
+            if name:
+                self.__hwversions[name.decode()] = i
+        self.__hwversion_names = {i: name for name, i in self.__hwversions.items()}
+        self.__clock_offset = max(time.time(), newest) - time.monotonic()
+
+    def _hwversion_index(self, hardwareversion):
+        index = self.__hwversions.get(hardwareversion)
+        if index is None:
+            if hardwareversion is None or len(self.__hwversions) >= self._MAX_HWVERSIONS:
+                return self._UNKNOWN_HWVERSION
+            index = len(self.__hwversions)
+            encoded = hardwareversion.encode()[:self._HWVERSION_SIZE]
+            offset = self._HWVERSION_OFFSET + index * self._HWVERSION_SIZE
+            self.__mmap[offset:offset + len(encoded)] = encoded
+            self.__hwversions[hardwareversion] = index
+            self.__hwversion_names[index] = hardwareversion
+        return index
+
+    def record(self, snapshot):
+        """Append a SmartUPSSnapshot to the ring, overwriting the oldest record if it is full.
+
+        Args:
+            snapshot (SmartUPSSnapshot): The frame to record.
+
+        Raises:
+            ValueError: The ring was opened readonly.
+
+        """
+        if self.__readonly:
+            raise ValueError("%s was opened read-only" % self.__path)
+        timestamp = snapshot.monotonic + self.__clock_offset
+        self._record.pack_into(self.__mmap, self.HEADER_SIZE + (self.__written % self.__capacity) * self._record.size,
+                               timestamp, not snapshot.discharging, snapshot.batterylevel or 0,
+                               0 if snapshot.Vout is None else int(snapshot.Vout * 1000 + .5),
+                               self._hwversion_index(snapshot.hardwareversion))
+        self.__written += 1
+        self._header.pack_into(self.__mmap, 0, self.MAGIC, 1, self._record.size, self.__capacity, self.__written, timestamp)
+
+    def __len__(self):
+        return min(self.__written, self.__capacity)
+
+    def _timestamp_at(self, i):
+        return self._record.unpack_from(self.__mmap, self._offset_of(i))[0]
+
+    def _offset_of(self, i):
+        return self.HEADER_SIZE + ((self.__written - len(self) + i) % self.__capacity) * self._record.size
+
+    def __getitem__(self, i):
+        """Return the i-th oldest record (negative indices count back from the newest)."""
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("ring index out of range")
+        timestamp, Vin_good, batterylevel, millivolts, hwversion = self._record.unpack_from(self.__mmap, self._offset_of(i))
+        return TelemetryRecord(timestamp, Vin_good, batterylevel, millivolts / 1000., self.__hwversion_names.get(hwversion))
+
+    def find(self, timestamp):
+        """Return the index of the first record at or after timestamp (len(self) if there's none). O(log n)."""
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._timestamp_at(mid) < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def between(self, start, end):
+        """Yield the records whose timestamps are in [start, end), oldest first."""
+        for i in range(self.find(start), len(self)):
+            record = self[i]
+            if record.timestamp >= end:
+                break
+            yield record
+
+    def flush(self):
+        """Ask the kernel to write the dirty pages out now."""
+        self.__mmap.flush()
+
+    def close(self):
+        """Unmap and close the file."""
+        if not self.__mmap.closed:
+            if not self.__readonly:
+                self.__mmap.flush()
+            self.__mmap.close()
+
+    @property
+    def path(self):
+        return self.__path
+
+    @property
+    def capacity(self):
+        return self.__capacity
@@ -32,24 +32,128 @@ Todo:
    http://google.github.io/styleguide/pyguide.html
 
 """
+from collections import namedtuple
 import os
 import random
 from time import sleep
+from types import MappingProxyType
 from pyupspack.exceptions import SmartUPSInitializationError
 
 
-def identify_serial_device():
+SerialDeviceInfo = namedtuple('SerialDeviceInfo', ('device', 'vid', 'pid', 'serial_number', 'usb_path', 'driver'))
+"""Description of one USB serial device, as found by list_serial_devices().
+
+device (str): e.g. '/dev/ttyUSB0'. vid, pid (int): USB vendor and product IDs.
+serial_number (str): USB serial number, or None if the converter hasn't got one.
+usb_path (str): Where it is plugged in, e.g. '1-1.2'. driver (str): e.g. 'ch341'.
+"""
+
+_identified_serial_devices = {}  # (vid, pid, serial_number) -> (SerialDeviceInfo, identity); see identify_serial_device()
+
+
+def _read_sysfs_attribute(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def _describe_tty(tty_name, sysfs_root, dev_root):
+    """Return a SerialDeviceInfo for /sys/class/tty/{tty_name}, or None if it isn't a USB device."""
+    tty_dir = os.path.join(sysfs_root, 'class', 'tty', tty_name)
+    interface_dir = os.path.realpath(os.path.join(tty_dir, 'device'))
+    if not os.path.isdir(interface_dir):
+        return None
+    driver_link = os.path.join(interface_dir, 'driver')
+    driver = os.path.basename(os.readlink(driver_link)) if os.path.islink(driver_link) else None
+    usb_dir = interface_dir
+    while not os.path.exists(os.path.join(usb_dir, 'idVendor')):
+        parent = os.path.dirname(usb_dir)
+        if parent == usb_dir:
+            return None
+        usb_dir = parent
+    try:
+        vid = int(_read_sysfs_attribute(os.path.join(usb_dir, 'idVendor')), 16)
+        pid = int(_read_sysfs_attribute(os.path.join(usb_dir, 'idProduct')), 16)
+    except (TypeError, ValueError):
+        return None
+    return SerialDeviceInfo(device=os.path.join(dev_root, tty_name), vid=vid, pid=pid,
+                            serial_number=_read_sysfs_attribute(os.path.join(usb_dir, 'serial')),
+                            usb_path=os.path.basename(usb_dir), driver=driver)
+
+
+def list_serial_devices(sysfs_root='/sys', dev_root='/dev'):
+    """List the USB serial devices that are attached, according to sysfs.
+
+    USB/TTL converters (ttyUSB*) are found via /sys/bus/usb-serial/devices; USB
+    modems and other CDC ACM devices (ttyACM*) via /sys/class/tty. Only devices
+    whose /dev node exists are listed. No processes are spawned and the kernel's
+    ring buffer isn't consulted, so this takes just as long after a year of uptime
+    as after a minute.
+
+    Args:
+        sysfs_root (:obj:`str`, optional): Where sysfs is mounted.
+        dev_root (:obj:`str`, optional): Where the device nodes live.
+
+    Returns:
+        list: SerialDeviceInfo instances, sorted by device.
+
+    """
+    tty_names = set()
+    usb_serial_dir = os.path.join(sysfs_root, 'bus', 'usb-serial', 'devices')
+    if os.path.isdir(usb_serial_dir):
+        tty_names.update(os.listdir(usb_serial_dir))
+    tty_class_dir = os.path.join(sysfs_root, 'class', 'tty')
+    if os.path.isdir(tty_class_dir):
+        tty_names.update(r for r in os.listdir(tty_class_dir) if r.startswith('ttyACM'))
+    lst = []
+    for tty_name in tty_names:
+        info = _describe_tty(tty_name, sysfs_root, dev_root)
+        if info is not None and os.path.exists(info.device):
+            lst.append(info)
+    lst.sort(key=lambda info: info.device)
+    return lst
+
+
+def _identity_of(info, sysfs_root, dev_root):
+    """Return something that changes if info.device is no longer the device described by info.
+
+    The device's entry in sysfs is read again, so that a different converter that has been
+    given the same name (e.g. /dev/ttyUSB0) is noticed.
+
+    """
+    live_info = _describe_tty(os.path.basename(info.device), sysfs_root, dev_root)
+    if live_info is None:
+        return None
+    try:
+        rdev = os.stat(live_info.device).st_rdev
+    except OSError:
+        return None
+    return (rdev, live_info.vid, live_info.pid, live_info.serial_number, live_info.usb_path)
+
+
+def identify_serial_device(vid=None, pid=None, serial_number=None, sysfs_root='/sys', dev_root='/dev'):
     """Find the serial device associated with the UPSPack circuit board.
     
-    By examining the output of 'dmesg', locate the serial/USB device associated
-    with the RPi UPSPack circuit board. The returned value should be
-    /dev/{something}
+    By walking sysfs (see list_serial_devices()), locate the serial/USB device
+    associated with the RPi UPSPack circuit board. The returned value should be
+    /dev/{something}. If vid, pid and/or serial_number are specified, only devices
+    that match them are considered; otherwise, any USB/TTL converter (but not a
+    CDC ACM device) will do.
+
+    The answer is cached. Next time, that one device's sysfs entry is read again; as long
+    as it still describes the same USB device (vendor, product, serial number and port),
+    the cached answer is returned without walking the rest of sysfs.
 
     Note:
         This probably won't work on FreeBSD, MacOS, or any other OS (but Linux).
 
     Args:
-        None
+        vid (:obj:`int`, optional): USB vendor ID, e.g. 0x1a86.
+        pid (:obj:`int`, optional): USB product ID, e.g. 0x7523.
+        serial_number (:obj:`str`, optional): USB serial number.
+        sysfs_root, dev_root: See list_serial_devices().
 
     Returns:
         str: The return value ("/dev/{...}") if found. Otherwise, raise an exception.
@@ -61,24 +165,19 @@ def identify_serial_device():
         https://www.python.org/dev/peps/pep-0484/
 
     """
-    tmpdir = '/tmp/flurblegerbil'
-    os.system('mkdir -p "%s"' % tmpdir)
-    os.system('dmesg > "%s/logs"' % tmpdir)
-    with open('%s/logs' % tmpdir) as logf:
-        log = logf.read()
-    lst = []
-    for r in [r for r in log.split('\n') if 'usb' in r and 'conv' in r and 'attached' in r]:
-        device = '/dev/%s' % (r.split(' ')[-1])
-        if os.path.exists(device):
-            lst.append(device)
-    lst = list(set(lst))
-    lst.sort()
+    key = (vid, pid, serial_number, sysfs_root, dev_root)
+    cached = _identified_serial_devices.get(key)
+    if cached is not None:
+        if _identity_of(cached[0], sysfs_root, dev_root) == cached[1]:
+            return cached[0].device
+        del _identified_serial_devices[key]
+    lst = identify_serial_devices(vid, pid, serial_number, sysfs_root, dev_root)
     if len(lst) > 1:
         raise SmartUPSInitializationError("I found %d USB/TTL devices. Please specify the one I should use." % len(lst))
     if len(lst) == 0:
         raise SmartUPSInitializationError("I found zero USB/TTL devices. Please install or find one.")
-    serial_device = lst[0]
-    return serial_device
+    _identified_serial_devices[key] = (lst[0], _identity_of(lst[0], sysfs_root, dev_root))
+    return lst[0].device
 
 
 def loworchargebattery_string_info(i):
@@ -112,6 +211,99 @@ def loworchargebattery_string_info(i):
         return "%s seconds" % i
 
 
+def identify_serial_devices(vid=None, pid=None, serial_number=None, sysfs_root='/sys', dev_root='/dev'):
+    """List every serial device that might be a UPSPack, for computers with more than one.
+
+    The devices are chosen as identify_serial_device() chooses them, but all of them
+    are returned, rather than an exception if there is more than one.
+
+    Args:
+        vid, pid, serial_number, sysfs_root, dev_root: See identify_serial_device().
+
+    Returns:
+        list: SerialDeviceInfo instances, sorted by device. Perhaps empty.
+
+    """
+    return [info for info in list_serial_devices(sysfs_root, dev_root)
+            if (vid is None or info.vid == vid)
+            and (pid is None or info.pid == pid)
+            and (serial_number is None or info.serial_number == serial_number)
+            and (vid is not None or pid is not None or serial_number is not None or info.driver != 'cdc_acm')]
+
+
+def device_identity(info):
+    """Return a name for the USB device described by info that survives being unplugged and plugged back in.
+
+    That is its USB serial number if it has one, e.g. 'serial:A50285BI'; otherwise, the
+    USB port that it is plugged into, e.g. 'usb:1-1.2'. Unlike '/dev/ttyUSB0', neither
+    changes when another converter is plugged in first.
+
+    Args:
+        info (SerialDeviceInfo): See list_serial_devices().
+
+    Returns:
+        str: The identity.
+
+    """
+    return 'serial:%s' % info.serial_number if info.serial_number else 'usb:%s' % info.usb_path
+
+
+def find_serial_device(identity, sysfs_root='/sys', dev_root='/dev'):
+    """Return the device (e.g. '/dev/ttyUSB1') of the USB serial device whose device_identity() is identity.
+
+    Raises:
+        SmartUPSInitializationError: It isn't plugged in.
+
+    """
+    for info in list_serial_devices(sysfs_root, dev_root):
+        if device_identity(info) == identity:
+            return info.device
+    raise SmartUPSInitializationError("I cannot find %s. Is it plugged in?" % identity)
+
+
+def modification_time_of(path):
+    """Return the modification time of path (in nanoseconds), or None if it doesn't exist.
+
+    The modification time of /dev changes whenever a device node is created or removed,
+    which makes this a cheap way of noticing that something has been plugged in.
+
+    Args:
+        path (str): The file or directory.
+
+    Returns:
+        int: st_mtime_ns, or None.
+
+    """
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def freeze(value):
+    """Return an immutable equivalent of value, which may then be shared without copying it.
+
+    Dictionaries become read-only views (MappingProxyType) of private copies; lists and
+    tuples become tuples; sets become frozensets; all recursively. Anything else, e.g. a
+    number, a string or a SmartUPSSnapshot, is returned as it is and is assumed to be
+    immutable already.
+
+    Args:
+        value: What to freeze.
+
+    Returns:
+        The frozen equivalent.
+
+    """
+    if isinstance(value, (dict, MappingProxyType)):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    if type(value) in (list, tuple):
+        return tuple(freeze(v) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(value)
+    return value
+
+
 def sleep_for_a_random_period(maxdur):
     """Sleep for between 0.01 and maxdur seconds.
 